@@ -0,0 +1,2 @@
+"""Benchmarks of hot paths of vebits_api. Run `python -m benchmarks.run -h`
+from the root of the repository for usage."""
@@ -0,0 +1,41 @@
+from vebits_api import annotation_util, stats_util
+from vebits_api.annotation_util import AnnotationStore
+
+from .harness import benchmark
+
+
+@benchmark("annotations.read_csv", items=100000)
+def bench_read_csv(fixtures):
+    csv_path = fixtures.csv(20000)
+    return lambda: annotation_util.read_annotations(csv_path)
+
+
+@benchmark("annotations.store_from_dataframe", items=100000)
+def bench_store_from_dataframe(fixtures):
+    df = fixtures.annotations(20000)
+    return lambda: AnnotationStore.from_dataframe(df)
+
+
+@benchmark("annotations.store_load", items=100000)
+def bench_store_load(fixtures):
+    store_dir = fixtures.path("store")
+    AnnotationStore.from_dataframe(fixtures.annotations(20000)).save(
+        store_dir)
+    return lambda: AnnotationStore.load(store_dir).to_dataframe()
+
+
+@benchmark("annotations.xml_to_csv", items=500)
+def bench_xml_to_csv(fixtures):
+    xml_dir = fixtures.xml_dir(500)
+    csv_path = fixtures.path("xml_to_csv.csv")
+
+    def run():
+        df = annotation_util.read_voc_dir(xml_dir, num_workers=1)
+        annotation_util.write_annotations(df, csv_path)
+    return run
+
+
+@benchmark("annotations.dataset_stats", items=100000)
+def bench_dataset_stats(fixtures):
+    df = fixtures.annotations(20000)
+    return lambda: stats_util.compute_stats([df], seed=0)
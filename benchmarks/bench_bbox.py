@@ -0,0 +1,55 @@
+import numpy as np
+
+from vebits_api import bbox_util
+from vebits_api.bbox_util import BBox, BBoxes
+
+from .harness import benchmark
+
+
+@benchmark("bbox.iou_pairwise", items=1000)
+def bench_iou_pairwise(fixtures):
+    boxes = fixtures.boxes(1001)
+    return lambda: [bbox_util.iou(boxes[i], boxes[i + 1])
+                    for i in range(1000)]
+
+
+@benchmark("bbox.iou_matrix", items=1000 * 1000)
+def bench_iou_matrix(fixtures):
+    boxes = fixtures.boxes(1000)
+    return lambda: bbox_util.iou_matrix(boxes, boxes)
+
+
+@benchmark("bbox.filter_boxes", items=100)
+def bench_filter_boxes(fixtures):
+    # Outputs of Tensorflow Object Detection API for a single image
+    rng = np.random.RandomState(0)
+    boxes = np.sort(rng.rand(100, 4), axis=1)
+    scores = rng.rand(100)
+    classes = rng.randint(1, 3, 100).astype(np.float32)
+    return lambda: bbox_util.filter_boxes(boxes, scores, classes, "all",
+                                          0.5, (480, 640))
+
+
+@benchmark("bbox.BBoxes.to_dataframe", items=50)
+def bench_bboxes_to_dataframe(fixtures):
+    bboxes_list = [BBox("phone", box) for box in fixtures.boxes(50)]
+
+    def run():
+        BBoxes(bboxes_list=bboxes_list, filename="img.jpg",
+               width=640, height=480)
+    return run
+
+
+@benchmark("bbox.BBoxes.to_bboxes_list", items=50)
+def bench_bboxes_to_list(fixtures):
+    df = fixtures.annotations(1, 50)
+
+    def run():
+        BBoxes(df=df).to_bboxes_list()
+    return run
+
+
+@benchmark("bbox.get_filename_index", items=100000)
+def bench_get_filename_index(fixtures):
+    df = fixtures.annotations(20000, 5)
+    return lambda: bbox_util.get_filename_index(df)
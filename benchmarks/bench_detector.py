@@ -0,0 +1,64 @@
+import cv2
+import numpy as np
+
+from vebits_api.detector_util import Backend, TiledBackend
+
+from .harness import benchmark
+
+
+class RectangleBackend(Backend):
+    """Stub backend detecting bright rectangles on a black background, to
+    measure the overhead of `TiledBackend` without a model. Boxes cut by
+    the edge of an input get a higher score than whole boxes, which is the
+    worst case of merging across tiles.
+    """
+    name = "rectangles"
+    box_format = "pixel_xyxy"
+
+    def __init__(self, max_detections=100):
+        Backend.__init__(self, {})
+        self.max_detections = max_detections
+
+    def infer(self, inputs):
+        num_inputs, height, width = inputs.shape[:3]
+        boxes = np.zeros((num_inputs, self.max_detections, 4),
+                         dtype=np.float32)
+        scores = np.zeros((num_inputs, self.max_detections), dtype=np.float32)
+        classes = np.ones((num_inputs, self.max_detections), dtype=np.int32)
+        for i, img in enumerate(inputs):
+            _, _, stats, _ = cv2.connectedComponentsWithStats(
+                (img[..., 0] > 0).astype(np.uint8))
+            stats = stats[1:self.max_detections + 1]
+            n = len(stats)
+            boxes[i, :n, :2] = stats[:, :2]
+            boxes[i, :n, 2:] = stats[:, :2] + stats[:, 2:4]
+            cut = ((stats[:, 0] == 0) | (stats[:, 1] == 0)
+                   | (boxes[i, :n, 2] == width) | (boxes[i, :n, 3] == height))
+            scores[i, :n] = np.where(cut, 0.9, 0.8)
+        return boxes, scores, classes
+
+
+def _draw_rectangles(boxes, height, width):
+    img = np.zeros((1, height, width, 3), dtype=np.uint8)
+    for xmin, ymin, xmax, ymax in boxes:
+        img[0, ymin:ymax, xmin:xmax] = 255
+    return img
+
+
+@benchmark("detector.TiledBackend", items=1)
+def bench_tiled_backend(fixtures):
+    backend = TiledBackend(RectangleBackend(), (512, 512), overlap=64)
+    # Objects straddling edges between tiles must be returned whole, and
+    # not cut by the edge of a tile
+    expected = np.array([[1400, 500, 1450, 520], [100, 100, 140, 130],
+                         [470, 700, 530, 740], [990, 460, 1010, 540]])
+    img = _draw_rectangles(expected, 1000, 1500)
+    boxes, scores, _ = backend.detect_objects(img)
+    found = boxes[0, scores[0] > 0].astype(np.int64)
+    found = found[np.lexsort(found.T[::-1])]
+    if not np.array_equal(found, expected[np.lexsort(expected.T[::-1])]):
+        raise AssertionError("Wrong boxes merged across tiles: {}".format(
+            found.tolist()))
+
+    img = _draw_rectangles(fixtures.boxes(30, (1000, 1500)), 1000, 1500)
+    return lambda: backend.detect_objects(img)
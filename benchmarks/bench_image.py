@@ -0,0 +1,33 @@
+import numpy as np
+
+from vebits_api import im_util
+
+from .harness import benchmark
+
+
+@benchmark("image.resize_padding", items=1)
+def bench_resize_padding(fixtures):
+    img = fixtures.image(720, 1280)
+    return lambda: im_util.resize_padding(img, (480, 640))
+
+
+@benchmark("image.resize_padding_with_boxes", items=1)
+def bench_resize_padding_boxes(fixtures):
+    img = fixtures.image(720, 1280)
+    boxes = fixtures.boxes(20, (720, 1280)).astype(np.float64)
+    return lambda: im_util.resize_padding(img, (480, 640), boxes)
+
+
+@benchmark("image.save_img_jpeg", items=1)
+def bench_save_img(fixtures):
+    img = fixtures.image()
+    path = fixtures.path("save.jpg")
+    return lambda: im_util.save_img(img, path)
+
+
+@benchmark("image.copy_img", items=1)
+def bench_copy_img(fixtures):
+    src_path = fixtures.path("copy_src.jpg")
+    im_util.save_img(fixtures.image(), src_path)
+    dest_path = fixtures.path("copy_dest.jpg")
+    return lambda: im_util.copy_img(src_path, dest_path)
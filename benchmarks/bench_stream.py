@@ -0,0 +1,29 @@
+from vebits_api.detector_util import (VideoStream, MultiThreadingVideoStream,
+                                      MultiProcessingVideoStream)
+
+from .harness import benchmark
+
+NUM_FRAMES = 150
+
+
+def _consume(stream):
+    for _ in stream:
+        pass
+
+
+@benchmark("stream.VideoStream", items=NUM_FRAMES)
+def bench_video_stream(fixtures):
+    video_path = fixtures.video(NUM_FRAMES)
+    return lambda: _consume(VideoStream(video_path))
+
+
+@benchmark("stream.MultiThreadingVideoStream", items=NUM_FRAMES)
+def bench_multithreading_stream(fixtures):
+    video_path = fixtures.video(NUM_FRAMES)
+    return lambda: _consume(MultiThreadingVideoStream(video_path))
+
+
+@benchmark("stream.MultiProcessingVideoStream", items=NUM_FRAMES)
+def bench_multiprocessing_stream(fixtures):
+    video_path = fixtures.video(NUM_FRAMES)
+    return lambda: _consume(MultiProcessingVideoStream(video_path))
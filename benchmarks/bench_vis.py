@@ -0,0 +1,20 @@
+from vebits_api import vis_util
+
+from .harness import benchmark
+
+LABELMAP_DICT = {"phone": 1, "not_phone": 2}
+
+
+@benchmark("vis.draw_boxes_on_image", items=20)
+def bench_draw_boxes(fixtures):
+    img = fixtures.image()
+    boxes = fixtures.boxes(20)
+    labels = [1 + i % 2 for i in range(20)]
+    return lambda: vis_util.draw_boxes_on_image(img.copy(), boxes, labels,
+                                                LABELMAP_DICT)
+
+
+@benchmark("vis.draw_number", items=1)
+def bench_draw_number(fixtures):
+    img = fixtures.image()
+    return lambda: vis_util.draw_number(img.copy(), 123)
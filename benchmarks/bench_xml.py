@@ -0,0 +1,27 @@
+from vebits_api import xml_util
+from vebits_api.bbox_util import BBox
+from vebits_api.annotation_util import read_voc_dir
+
+from .harness import benchmark
+
+
+@benchmark("xml.create_xml_file", items=1)
+def bench_create_xml_file(fixtures):
+    bboxes = [BBox("phone", box) for box in fixtures.boxes(10)]
+    img_path = fixtures.path("img.jpg")
+    return lambda: xml_util.create_xml_file(img_path, 640, 480, bboxes)
+
+
+@benchmark("xml.read_xml_file", items=1)
+def bench_read_xml_file(fixtures):
+    img_path = fixtures.path("read.jpg")
+    xml_util.create_xml_file_from_arrays(img_path, 640, 480, ["phone"] * 10,
+                                         fixtures.boxes(10))
+    xml_path = fixtures.path("read.xml")
+    return lambda: xml_util.read_xml_file(xml_path)
+
+
+@benchmark("xml.read_voc_dir", items=500)
+def bench_read_voc_dir(fixtures):
+    xml_dir = fixtures.xml_dir(500)
+    return lambda: read_voc_dir(xml_dir, num_workers=1)
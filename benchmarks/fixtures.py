@@ -0,0 +1,150 @@
+"""Synthetic data used by benchmarks, generated locally and deterministically
+(images, bounding boxes, annotation tables, *.xml files and videos)."""
+
+import os
+import zlib
+import shutil
+import tempfile
+
+import cv2
+import numpy as np
+import pandas as pd
+
+from vebits_api.bbox_util import BBOX_COLS
+
+
+class Fixtures():
+    """Lazily generate and cache synthetic data. Files are written to a
+    temporary directory, removed by `cleanup`.
+
+    Parameters
+    ----------
+    seed : int
+    tmp_dir : str
+        Parent directory of the temporary directory. If None, use the
+        default of `tempfile`.
+
+    """
+    def __init__(self, seed=0, tmp_dir=None):
+        self.seed = seed
+        self.dir = tempfile.mkdtemp(prefix="vebits_bench_", dir=tmp_dir)
+        self._cache = {}
+
+    def _rng(self, *key):
+        # Independent random state per fixture, so that fixtures do not
+        # depend on the order in which they are generated
+        return np.random.RandomState(zlib.crc32(repr((self.seed,) + key)
+                                                .encode("utf-8")))
+
+    def _cached(self, key, create):
+        if key not in self._cache:
+            self._cache[key] = create()
+        return self._cache[key]
+
+    def path(self, *names):
+        return os.path.join(self.dir, *names)
+
+    def image(self, height=480, width=640):
+        """
+        Return an image with smooth gradients and rectangles, which is more
+        realistic to encode than random noise.
+        """
+        def create():
+            rng = self._rng("image", height, width)
+            y, x = np.mgrid[0:height, 0:width]
+            img = np.stack([x * 255 // max(width - 1, 1),
+                            y * 255 // max(height - 1, 1),
+                            (x + y) * 255 // max(width + height - 2, 1)],
+                           axis=-1).astype(np.uint8)
+            for box in self.boxes(20, (height, width), key=("image",)):
+                color = tuple(int(c) for c in rng.randint(0, 256, 3))
+                cv2.rectangle(img, tuple(box[:2]), tuple(box[2:]), color, -1)
+            return img
+        return self._cached(("image", height, width), create)
+
+    def boxes(self, num_boxes, img_size=(480, 640), key=()):
+        """
+        Return int32 boxes of shape (num_boxes, 4) in `xmin, ymin, xmax,
+        ymax` format, inside an image of size `img_size` (height, width).
+        """
+        def create():
+            rng = self._rng("boxes", num_boxes, img_size, key)
+            height, width = img_size
+            xmin = rng.randint(0, width - 10, num_boxes)
+            ymin = rng.randint(0, height - 10, num_boxes)
+            xmax = np.minimum(xmin + rng.randint(5, 200, num_boxes), width)
+            ymax = np.minimum(ymin + rng.randint(5, 200, num_boxes), height)
+            return np.stack([xmin, ymin, xmax, ymax], axis=1).astype(np.int32)
+        return self._cached(("boxes", num_boxes, img_size, key), create)
+
+    def annotations(self, num_images, boxes_per_image=5,
+                    classes=("phone", "not_phone", "person")):
+        """
+        Return a dataframe of annotations with columns `filename, width,
+        height, class, xmin, ymin, xmax, ymax`.
+        """
+        def create():
+            rng = self._rng("annotations", num_images, boxes_per_image)
+            num_boxes = num_images * boxes_per_image
+            df = pd.DataFrame({
+                "filename": np.repeat(["img{}.jpg".format(i)
+                                       for i in range(num_images)],
+                                      boxes_per_image),
+                "width": 640,
+                "height": 480,
+                "class": np.asarray(classes)[
+                    rng.randint(0, len(classes), num_boxes)]})
+            df[BBOX_COLS] = self.boxes(num_boxes, key=("annotations",))
+            return df
+        return self._cached(("annotations", num_images, boxes_per_image,
+                             tuple(classes)), create)
+
+    def csv(self, num_images, boxes_per_image=5):
+        """
+        Return path to a csv file of `annotations(num_images,
+        boxes_per_image)`.
+        """
+        def create():
+            path = self.path("annotations_{}_{}.csv".format(
+                num_images, boxes_per_image))
+            self.annotations(num_images, boxes_per_image).to_csv(
+                path, index=False)
+            return path
+        return self._cached(("csv", num_images, boxes_per_image), create)
+
+    def xml_dir(self, num_images, boxes_per_image=5):
+        """
+        Return path to a directory of *.xml files of `annotations(
+        num_images, boxes_per_image)`.
+        """
+        def create():
+            from vebits_api.bbox_util import df_to_xml_files
+            xml_dir = self.path("xml_{}_{}".format(num_images,
+                                                   boxes_per_image))
+            os.makedirs(xml_dir)
+            df = self.annotations(num_images, boxes_per_image)
+            df_to_xml_files(df, "images", xml_dir, num_workers=1)
+            return xml_dir
+        return self._cached(("xml_dir", num_images, boxes_per_image), create)
+
+    def video(self, num_frames=300, height=480, width=640):
+        """
+        Return path to a MJPG video of moving rectangles.
+        """
+        def create():
+            path = self.path("video_{}_{}x{}.avi".format(num_frames, width,
+                                                         height))
+            writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"),
+                                     30, (width, height))
+            background = self.image(height, width)
+            for i in range(num_frames):
+                frame = background.copy()
+                x = (i * 5) % (width - 50)
+                cv2.rectangle(frame, (x, 100), (x + 50, 150), (0, 0, 255), -1)
+                writer.write(frame)
+            writer.release()
+            return path
+        return self._cached(("video", num_frames, height, width), create)
+
+    def cleanup(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
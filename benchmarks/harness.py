@@ -0,0 +1,161 @@
+"""Minimal benchmark harness: registry of benchmarks, timing with automatic
+calibration, saving of results as baselines and comparison with them."""
+
+import sys
+import json
+import time
+import platform
+from datetime import datetime
+
+import numpy as np
+
+BENCHMARKS = {}
+
+
+def benchmark(name, items=1):
+    """Register a benchmark.
+
+    The decorated function takes a `Fixtures` object, does any setup, and
+    returns a function without arguments which is the code to be timed.
+    `items` is the number of items (e.g. boxes, frames) processed by each
+    call, used to report throughput.
+
+    Examples
+    --------
+    >>> @benchmark("bbox.iou_matrix", items=1000)
+    ... def bench_iou_matrix(fixtures):
+    ...     boxes = fixtures.boxes(1000)
+    ...     return lambda: bbox_util.iou_matrix(boxes, boxes)
+
+    """
+    def wrapper(function):
+        if name in BENCHMARKS:
+            raise ValueError("Duplicate benchmark: {}".format(name))
+        BENCHMARKS[name] = (function, items)
+        return function
+    return wrapper
+
+
+def time_function(function, min_time=0.2, repeats=5):
+    """
+    Time `function`. The number of calls per repeat is calibrated so that
+    each repeat lasts at least `min_time` seconds. Return a dictionary of
+    per-call times in seconds.
+    """
+    # Calibrate (this also warms up caches)
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            function()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time or loops >= 1 << 20:
+            break
+        loops = max(loops * 2, int(loops * min_time / max(elapsed, 1e-9)))
+
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for _ in range(loops):
+            function()
+        times.append((time.perf_counter() - start) / loops)
+    times = np.asarray(times)
+    return {"min": float(times.min()), "median": float(np.median(times)),
+            "mean": float(times.mean()), "std": float(times.std()),
+            "loops": loops, "repeats": repeats}
+
+
+def run_benchmarks(fixtures, pattern=None, min_time=0.2, repeats=5,
+                   verbose=True):
+    """
+    Run registered benchmarks whose name contains `pattern` (all if None).
+    Return a dictionary of results, including metadata of the machine.
+    """
+    results = {}
+    for name in sorted(BENCHMARKS):
+        if pattern is not None and pattern not in name:
+            continue
+        function, items = BENCHMARKS[name]
+        timed = function(fixtures)
+        result = time_function(timed, min_time, repeats)
+        result["items"] = items
+        results[name] = result
+        if verbose:
+            print("{:<40} {:>12} {:>14}".format(
+                name, format_time(result["median"]),
+                format_rate(items / result["median"])))
+            sys.stdout.flush()
+    return {"metadata": get_metadata(), "results": results}
+
+
+def get_metadata():
+    import cv2
+    import pandas as pd
+    return {"date": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "opencv": cv2.__version__}
+
+
+def format_time(seconds):
+    for unit, scale in (("s", 1), ("ms", 1e-3), ("us", 1e-6)):
+        if seconds >= scale:
+            return "{:.3g} {}".format(seconds / scale, unit)
+    return "{:.3g} ns".format(seconds / 1e-9)
+
+
+def format_rate(rate):
+    for unit, scale in (("G", 1e9), ("M", 1e6), ("k", 1e3)):
+        if rate >= scale:
+            return "{:.3g}{} items/s".format(rate / scale, unit)
+    return "{:.3g} items/s".format(rate)
+
+
+def save_results(results, path):
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2)
+
+
+def load_results(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare_results(baseline, current, threshold=0.2):
+    """Compare median times of benchmarks present in both results.
+
+    Returns
+    -------
+    rows : list of tuple
+        `(name, baseline_time, current_time, ratio, status)` where status is
+        "slower" if `ratio > 1 + threshold`, "faster" if
+        `ratio < 1 / (1 + threshold)`, and "same" otherwise.
+
+    """
+    rows = []
+    baseline, current = baseline["results"], current["results"]
+    for name in sorted(set(baseline) & set(current)):
+        base_time = baseline[name]["median"]
+        cur_time = current[name]["median"]
+        ratio = cur_time / base_time
+        if ratio > 1 + threshold:
+            status = "slower"
+        elif ratio < 1 / (1 + threshold):
+            status = "faster"
+        else:
+            status = "same"
+        rows.append((name, base_time, cur_time, ratio, status))
+    return rows
+
+
+def format_comparison(rows):
+    lines = ["{:<40} {:>12} {:>12} {:>8}  {}".format(
+        "benchmark", "baseline", "current", "ratio", "status")]
+    for name, base_time, cur_time, ratio, status in rows:
+        lines.append("{:<40} {:>12} {:>12} {:>7.2f}x  {}".format(
+            name, format_time(base_time), format_time(cur_time), ratio,
+            status.upper() if status == "slower" else status))
+    return "\n".join(lines)
@@ -0,0 +1,72 @@
+import sys
+import argparse
+
+from .harness import (run_benchmarks, save_results, load_results,
+                      compare_results, format_comparison)
+from .fixtures import Fixtures
+# Import benchmark modules to register benchmarks
+from . import (bench_bbox, bench_image, bench_vis, bench_xml,  # noqa: F401
+               bench_annotations, bench_stream, bench_detector)
+
+DESCRIPTION = """This runs benchmarks of hot paths of vebits_api on synthetic
+data, optionally saves results as a baseline and compares them with a
+previously saved baseline. Run from the root of the repository:
+`python -m benchmarks.run --save baseline.json`, then after changes
+`python -m benchmarks.run --compare baseline.json`.
+"""
+
+
+def main(args):
+    fixtures = Fixtures(seed=args.seed, tmp_dir=args.tmp_dir)
+    try:
+        results = run_benchmarks(fixtures, pattern=args.filter,
+                                 min_time=args.min_time,
+                                 repeats=args.repeats)
+    finally:
+        fixtures.cleanup()
+
+    if args.save is not None:
+        save_results(results, args.save)
+        print(">>> Results saved to {}".format(args.save))
+
+    if args.compare is not None:
+        rows = compare_results(load_results(args.compare), results,
+                               threshold=args.threshold)
+        print()
+        print(format_comparison(rows))
+        num_slower = sum(row[-1] == "slower" for row in rows)
+        print(">>> {} of {} benchmarks are slower by more than {:.0%}".format(
+            num_slower, len(rows), args.threshold))
+        if args.fail_on_regression and num_slower > 0:
+            sys.exit(1)
+
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        description=DESCRIPTION)
+
+    parser.add_argument('--filter', type=str, default=None,
+        help='Only run benchmarks whose name contains this string, e.g. '
+             '`bbox.`')
+    parser.add_argument('--save', type=str, default=None,
+        help='Path to a JSON file to which results will be written.')
+    parser.add_argument('--compare', type=str, default=None,
+        help='Path to a JSON file of baseline results to compare with.')
+    parser.add_argument('--threshold', type=float, default=0.2,
+        help='Relative slowdown above which a benchmark is reported as a '
+             'regression.')
+    parser.add_argument('--fail_on_regression', action="store_true",
+        help='Exit with status 1 if any benchmark regressed.')
+    parser.add_argument('--min_time', type=float, default=0.2,
+        help='Minimum duration in seconds of each repeat.')
+    parser.add_argument('--repeats', type=int, default=5,
+        help='Number of repeats per benchmark. The median is reported.')
+    parser.add_argument('--seed', type=int, default=0,
+        help='Seed used to generate synthetic data.')
+    parser.add_argument('--tmp_dir', type=str, default=None,
+        help='Directory in which synthetic data is written.')
+    return parser.parse_args(argv)
+
+if __name__ == '__main__':
+    main(parse_arguments(sys.argv[1:]))
@@ -31,6 +31,7 @@ sys.path.append("..")
 
 # Import utilites
 from vebits_api import bbox_util, detector_util, labelmap_util, xml_util, im_util
+from vebits_api import cli_util
 from utils import visualization_utils as vis_util
 
 
@@ -245,7 +246,8 @@ def parse_arguments(argv):
         help='Destination frame height.')
 
 
+    cli_util.add_arguments(parser)
     return parser.parse_args(argv)
 
 if __name__ == '__main__':
-    main(parse_arguments(sys.argv[1:]))
+    cli_util.run(main, parse_arguments(sys.argv[1:]))
@@ -30,6 +30,7 @@ os.environ["CUDA_VISIBLE_DEVICES"]="0"
 
 # Import utilites
 from vebits_api import detector_util, labelmap_util, im_util
+from vebits_api import cli_util
 from utils import visualization_utils as vis_util
 
 
@@ -149,7 +150,8 @@ def parse_arguments(argv):
         help='Path to output the video.')
 
 
+    cli_util.add_arguments(parser)
     return parser.parse_args(argv)
 
 if __name__ == '__main__':
-    main(parse_arguments(sys.argv[1:]))
+    cli_util.run(main, parse_arguments(sys.argv[1:]))
@@ -6,6 +6,7 @@ import glob
 from tqdm import tqdm
 
 from vebits_api.xml_util import change_label_and_save
+from vebits_api import cli_util
 
 DESCRIPTION = """This script changes all labels in *.xml files produced by
 `labelimg` to a specific label. This is particularly useful when one wants
@@ -49,7 +50,8 @@ def parse_arguments(argv):
     parser.add_argument('label_dest', type=str,
         help='Directory to which all modified xml files will be saved.')
 
+    cli_util.add_arguments(parser)
     return parser.parse_args(argv)
 
 if __name__ == '__main__':
-    main(parse_arguments(sys.argv[1:]))
+    cli_util.run(main, parse_arguments(sys.argv[1:]))
@@ -2,60 +2,95 @@ import os
 import argparse
 import sys
 
-import pandas as pd
 from tqdm import tqdm
-import tensorflow as tf
+
+from vebits_api.annotation_util import read_annotations
+from vebits_api.index_util import IMG_EXTENSIONS, DatasetIndex
+from vebits_api.integrity_util import scan_images, write_report
+from vebits_api import cli_util
 
 DESCRIPTION = """This checks for any corrupted images accidentally produced
 during data preparation. This is particularly useful when seeing an error like
-[[node ...]]. For best performance, run this script iteratively for about
+[[node ...]]. Headers and trailers of JPEG/PNG files are validated first, and
+only suspect (or sampled) images are fully decoded.
 """
+# Name under which checked images are recorded in the dataset index
+CONSUMER = "check_corrupted_images"
 
 def main(args):
     # Reading data
-    df = pd.read_csv(args.csv_path)
-    img_list = sorted(df.filename.unique())[args.start:]
-    # Preparing
     img_dir = args.img_dir
-    batch_size = args.batch_size
-    batch = []
+    index = None
+    if args.use_index:
+        # Only check images that are new or changed since last run
+        index = DatasetIndex(img_dir)
+        index.update(num_workers=args.num_workers)
+        img_list = index.pending(CONSUMER)
+    elif args.csv_path is None:
+        # Other files (e.g. *.xml labels) would be reported as corrupted
+        img_list = sorted(img_name for img_name in os.listdir(img_dir)
+                          if img_name.lower().endswith(IMG_EXTENSIONS))
+    else:
+        df = read_annotations(args.csv_path)
+        img_list = sorted(df.filename.unique())
+    img_list = cli_util.limit_items(img_list[args.start:], args.limit)
+    img_paths = [os.path.join(img_dir, img_name) for img_name in img_list]
 
     print(">>> Checking {} images in {}".format(len(img_list), img_dir))
     # Start checking images
-    with tf.Graph().as_default():
-        init_op = tf.initialize_all_tables()
-        with tf.Session() as sess:
-            sess.run(init_op)
-            for i, img_name in enumerate(tqdm(img_list)):
-                img_contents = tf.read_file(os.path.join(img_dir, img_name))
-                img = tf.image.decode_jpeg(img_contents, channels=3)
-                batch.append(img)
-                if (i + 1) % batch_size:
-                    try:
-                        sess.run(batch)
-                    except:
-                        if batch_size == 1:
-                            print(">>> Found corrupted image: "
-                                  "{}".format(img_name))
-                        else:
-                            print(">>> Found corrupted image(s) at batch "
-                                  "{}-{}".format(i - batch_size, i))
-                    batch = []
+    corrupted = []
+    with tqdm(total=len(img_paths)) as t:
+        for num_checked, results in scan_images(img_paths,
+                                                num_workers=args.num_workers,
+                                                sample_rate=args.sample_rate,
+                                                seed=args.seed,
+                                                chunk_size=args.batch_size):
+            for img_path, reason in results:
+                print(">>> Found corrupted image: {} ({})".format(img_path,
+                                                                reason))
+            corrupted.extend(results)
+            t.update(num_checked)
+
+    print(">>> Found {} corrupted image(s)".format(len(corrupted)))
+    if args.report_path is not None:
+        write_report(corrupted, args.report_path)
+    if index is not None:
+        # Corrupted images remain pending, so that they are checked again
+        corrupted_names = set(os.path.relpath(img_path, img_dir)
+                              for img_path, _ in corrupted)
+        index.mark_done(CONSUMER, [img_name for img_name in img_list
+                                   if img_name not in corrupted_names])
+        index.save()
 
 
 def parse_arguments(argv):
     parser = argparse.ArgumentParser(
-        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        description=DESCRIPTION)
 
-    parser.add_argument('csv_path', type=str,
-        help='Path to the first inference graph.')
+    parser.add_argument('csv_path', type=str, nargs='?', default=None,
+        help='Path to the csv file or annotation store. If specified, only '
+             'images in it are checked. Otherwise, all images in `img_dir`.')
     parser.add_argument('img_dir', type=str,
-        help='Path to the label map of the first model.')
+        help='Directory to images.')
     parser.add_argument('--start', type=int, default=0,
         help='Where to start checking.')
+    parser.add_argument('--use_index', action='store_true',
+        help='Keep an index of images in `img_dir`, and only check images '
+             'that are new or changed since last run. `csv_path` is '
+             'ignored.')
     parser.add_argument('--batch_size', type=int, default=128,
-        help='How many images to aggregate per batch.')
+        help='How many images to check per task.')
+    parser.add_argument('--num_workers', type=int, default=None,
+        help='Number of processes. If not specified, all CPUs will be used.')
+    parser.add_argument('--sample_rate', type=float, default=0.0,
+        help='Fraction of valid-looking images to fully decode anyway.')
+    parser.add_argument('--seed', type=int, default=None,
+        help='Random seed used to sample images to decode.')
+    parser.add_argument('--report_path', type=str, default=None,
+        help='Path to a csv file to which corrupted images will be listed.')
+    cli_util.add_arguments(parser, limit=True)
     return parser.parse_args(argv)
 
 if __name__ == '__main__':
-    main(parse_arguments(sys.argv[1:]))
+    cli_util.run(main, parse_arguments(sys.argv[1:]))
@@ -0,0 +1,135 @@
+import os
+import sys
+import time
+import argparse
+
+import cv2
+import numpy as np
+
+from vebits_api import bbox_util, cli_util, detector_util, im_util, timing_util
+from vebits_api.eval_util import DetectionEvaluator
+
+DESCRIPTION = """This runs several detector backends (see
+`detector_util.BACKENDS`) on the same batches of images, and reports the
+throughput and time per stage of each backend, as well as the agreement of its
+detections with those of the first backend (AP@0.5 and recall, taking the
+first backend's detections as ground truth). Use it to check that a faster
+runtime gives the same results as the reference Tensorflow model.
+"""
+
+
+def load_batches(img_dir, batch_size, num_batches, img_size):
+    """
+    Return `num_batches` batches of images from `img_dir`, resized to
+    `img_size` (height, width), cycling through images if there are not
+    enough of them.
+    """
+    img_names = sorted(img_name for img_name in os.listdir(img_dir)
+                       if img_name.lower().endswith((".jpg", ".jpeg", ".png")))
+    if len(img_names) == 0:
+        raise ValueError("No images found in {}".format(img_dir))
+    imgs = np.stack([
+        im_util.resize_padding(cv2.imread(os.path.join(img_dir, img_name)),
+                               img_size)
+        for img_name in img_names[:batch_size * num_batches]])
+    indices = np.arange(batch_size * num_batches) % len(imgs)
+    return [imgs[indices[i * batch_size:(i + 1) * batch_size]]
+            for i in range(num_batches)]
+
+
+def run_backend(backend, batches, confidence_threshold):
+    """
+    Return elapsed time of `backend` on `batches`, after warming it up on
+    the first batch, and its filtered detections as pixel `xmin, ymin, xmax,
+    ymax` boxes, for each image.
+    """
+    backend.detect_objects(batches[0])
+    timing_util.reset()
+    detections = []
+    start = time.perf_counter()
+    outputs = [backend.detect_objects(batch) for batch in batches]
+    elapsed = time.perf_counter() - start
+
+    for batch, (boxes, scores, classes) in zip(batches, outputs):
+        for i in range(len(batch)):
+            detections.append(bbox_util.filter_boxes(
+                np.asarray(boxes[i], dtype=np.float64).reshape(-1, 4),
+                np.asarray(scores[i]), np.asarray(classes[i]), "all",
+                confidence_threshold, batch.shape[1:3],
+                box_format=backend.box_format))
+    return elapsed, detections
+
+
+def main(args):
+    batches = load_batches(args.img_dir, args.batch_size, args.num_batches,
+                           (args.height, args.width))
+    num_imgs = sum(len(batch) for batch in batches)
+    timing_util.enable()
+
+    reference = None
+    for spec in args.backend:
+        name, model_path = spec[0], spec[1]
+        config_path = spec[2] if len(spec) > 2 else None
+        backend = detector_util.load_backend(name, model_path, config_path)
+        try:
+            elapsed, detections = run_backend(backend, batches,
+                                              args.confidence_threshold)
+        finally:
+            backend.close()
+
+        print(">>> Backend {} ({}): {:.2f} imgs/s".format(
+            name, model_path, num_imgs / elapsed))
+        print(timing_util.format_report())
+        if reference is None:
+            reference = detections
+            continue
+        evaluator = DetectionEvaluator(iou_thresholds=[args.iou_threshold])
+        for (boxes, scores, classes), (ref_boxes, _, ref_classes) in zip(
+                detections, reference):
+            evaluator.add(boxes, scores, classes, ref_boxes, ref_classes)
+        results = evaluator.evaluate()
+        num_tp = sum(stats["recall"] * stats["num_gts"]
+                     for stats in results["per_class"].values()
+                     if stats["num_gts"] > 0)
+        num_gts = sum(stats["num_gts"]
+                      for stats in results["per_class"].values())
+        print(">>> Agreement with {}: AP@{:.2f} {:.4f}, recall {:.4f}".format(
+            args.backend[0][0], args.iou_threshold, results["AP"],
+            num_tp / num_gts if num_gts else float("nan")))
+        sys.stdout.flush()
+
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        description=DESCRIPTION)
+
+    parser.add_argument('img_dir', type=str,
+        help='Directory of sample images.')
+    parser.add_argument('--backend', type=str, nargs='+', action='append',
+        required=True, metavar='NAME MODEL_PATH [CONFIG_PATH]',
+        help='Backend to compare, as its registered name, path to its model '
+             'and optionally path to its config (e.g. the meta file of '
+             'Darkflow). Can be repeated. The first backend is the '
+             'reference.')
+    parser.add_argument('--confidence_threshold', type=float, default=0.5,
+        help='Confidence threshold of detections.')
+    parser.add_argument('--iou_threshold', type=float, default=0.5,
+        help='IoU threshold at which detections agree with the reference.')
+    parser.add_argument('--batch_size', type=int, default=8,
+        help='Number of images per batch.')
+    parser.add_argument('--num_batches', type=int, default=16,
+        help='Number of batches timed per backend.')
+    parser.add_argument('--height', type=int, default=480,
+        help='Height of images.')
+    parser.add_argument('--width', type=int, default=640,
+        help='Width of images.')
+    cli_util.add_arguments(parser)
+    args = parser.parse_args(argv)
+    for spec in args.backend:
+        if len(spec) not in (2, 3):
+            parser.error("--backend takes NAME MODEL_PATH [CONFIG_PATH]")
+    return args
+
+if __name__ == '__main__':
+    cli_util.run(main, parse_arguments(sys.argv[1:]))
@@ -5,6 +5,8 @@ import argparse
 import cv2
 import numpy as np
 
+from vebits_api import cli_util
+
 DESCRIPTION = """This reads as many as videos provided and display them in
 the same displaying window.
 """
@@ -40,7 +42,8 @@ def parse_arguments(argv):
     parser.add_argument('--delay', type=int, default=60,
         help='Number of miliseconds to delay between each frame.')
 
+    cli_util.add_arguments(parser)
     return parser.parse_args(argv)
 
 if __name__ == '__main__':
-    main(parse_arguments(sys.argv[1:]))
+    cli_util.run(main, parse_arguments(sys.argv[1:]))
@@ -0,0 +1,51 @@
+import sys
+import argparse
+
+from tqdm import tqdm
+
+from vebits_api.annotation_util import AnnotationStore, read_annotations, write_annotations
+from vebits_api import cli_util
+
+DESCRIPTION = """This converts annotations between csv files, annotation stores
+and directories of *.xml files of PASCAL VOC format.
+"""
+
+
+def main(args):
+    df = read_annotations(args.src_path, args.num_workers)
+    print(">>> Read {} objects of {} images".format(df.shape[0],
+                                                    df.filename.nunique()))
+
+    if args.voc_img_dir is None:
+        write_annotations(df, args.dest_path)
+    else:
+        store = AnnotationStore.from_dataframe(df)
+        with tqdm(total=store.num_images) as t:
+            store.to_voc_dir(args.voc_img_dir, args.dest_path,
+                             num_workers=args.num_workers, callback=t.update)
+
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        description=DESCRIPTION)
+
+    parser.add_argument('src_path', type=str,
+        help='Path to a csv file, an annotation store or a directory of xml '
+             'files.')
+    parser.add_argument('dest_path', type=str,
+        help='Path to which the annotations will be saved. If it ends with '
+             '.csv, a csv file will be saved. Otherwise, an annotation store '
+             'will be saved, unless `--voc_img_dir` is specified.')
+    parser.add_argument('--voc_img_dir', type=str, default=None,
+        help='If specified, save one xml file per image to `dest_path`, '
+             'using this as the directory to images.')
+    parser.add_argument('--num_workers', type=int, default=None,
+        help='Number of processes used to read/write xml files. '
+             'If not specified, all CPUs will be used.')
+
+    cli_util.add_arguments(parser)
+    return parser.parse_args(argv)
+
+if __name__ == '__main__':
+    cli_util.run(main, parse_arguments(sys.argv[1:]))
@@ -8,6 +8,8 @@ from tqdm import tqdm
 import pandas as pd
 from PIL import Image
 
+from vebits_api import cli_util
+
 DESCRIPTION = """This crops input image(s) by the values specified
 for top, bottom, left, right edges.
 """
@@ -72,7 +74,8 @@ def parse_arguments(argv):
     parser.add_argument('left', type=str,
         help='Percent (float) or Pixel (integer).')
 
+    cli_util.add_arguments(parser)
     return parser.parse_args(argv)
 
 if __name__ == '__main__':
-    main(parse_arguments(sys.argv[1:]))
+    cli_util.run(main, parse_arguments(sys.argv[1:]))
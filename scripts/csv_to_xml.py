@@ -1,11 +1,11 @@
 import argparse
 import sys
-import os
 
 from tqdm import tqdm
-import pandas as pd
 
-from vebits_api.bbox_util import BBoxes
+from vebits_api.annotation_util import read_annotations
+from vebits_api.bbox_util import df_to_xml_files
+from vebits_api import cli_util
 
 DESCRIPTION = """This convert a csv file into as many *.xml files of PASCAL
 VOC formatas in the csv file.
@@ -16,16 +16,12 @@ def main(args):
     img_dir = args.img_dir
     dest_dir = img_dir if args.dest_dir is None else args.dest_dir
 
-    df = pd.read_csv(args.csv_path)
-    img_list = sorted(df.filename.unique())
+    df = read_annotations(args.csv_path)
+    num_imgs = df.filename.nunique()
 
-    for img_name in tqdm(img_list):
-        img_path = os.path.join(img_dir, img_name)
-        xml_name = os.path.splitext(img_name)[0] + ".xml"
-        xml_path = os.path.join(dest_dir, xml_name)
-
-        bboxes = BBoxes(df=df[df.filename == img_name])
-        bboxes.to_xml(img_path, xml_path)
+    with tqdm(total=num_imgs) as t:
+        df_to_xml_files(df, img_dir, dest_dir, num_workers=args.num_workers,
+                        callback=t.update)
 
 
 def parse_arguments(argv):
@@ -34,14 +30,18 @@ def parse_arguments(argv):
         description=DESCRIPTION)
 
     parser.add_argument('csv_path', type=str,
-        help='Path to the csv file.')
+        help='Path to the csv file or annotation store.')
     parser.add_argument('img_dir', type=str,
         help='Directory to images.')
     parser.add_argument('--dest_dir', type=str, default=None,
         help='Directory to which all xml files will be saved. '
              'If not specified, then xml files will be save to `img_dir`')
+    parser.add_argument('--num_workers', type=int, default=None,
+        help='Number of processes used to write xml files. '
+             'If not specified, all CPUs will be used.')
 
+    cli_util.add_arguments(parser)
     return parser.parse_args(argv)
 
 if __name__ == '__main__':
-    main(parse_arguments(sys.argv[1:]))
+    cli_util.run(main, parse_arguments(sys.argv[1:]))
@@ -4,6 +4,7 @@ This script is deprecated and should not be used!!!
 
 
 from vebits_api import detector_util as detector_util
+from vebits_api import cli_util
 import xml.etree.ElementTree as ET
 
 import cv2
@@ -216,7 +217,8 @@ def parse_arguments(argv):
     parser.add_argument('--num_workers', type=int, default=4,
         help='Number of workers.')
 
+    cli_util.add_arguments(parser)
     return parser.parse_args(argv)
 
 if __name__ == '__main__':
-    main(parse_arguments(sys.argv[1:]))
+    cli_util.run(main, parse_arguments(sys.argv[1:]))
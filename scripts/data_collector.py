@@ -21,6 +21,8 @@ os.environ["CUDA_VISIBLE_DEVICES"]="0"
 from utils import label_map_util
 from utils import visualization_utils as vis_util
 
+from vebits_api import cli_util
+
 # Some constants
 WIDTH = 1280
 HEIGHT = 720
@@ -225,7 +227,8 @@ def parse_arguments(argv):
     parser.add_argument('xml_template', type=str,
         help='Path to the xml template.')
 
+    cli_util.add_arguments(parser)
     return parser.parse_args(argv)
 
 if __name__ == '__main__':
-    main(parse_arguments(sys.argv[1:]))
+    cli_util.run(main, parse_arguments(sys.argv[1:]))
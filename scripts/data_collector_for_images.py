@@ -14,6 +14,7 @@ import imgaug.augmenters as iaa
 import datetime
 from data_collect import BBox, create_xml_file
 from vebits_api import detector_util, bbox_util
+from vebits_api import cli_util
 
 os.environ["CUDA_DEVICE_ORDER"]="PCI_BUS_ID"   # see issue #152
 os.environ["CUDA_VISIBLE_DEVICES"]="0"
@@ -261,7 +262,8 @@ def parse_arguments(argv):
     parser.add_argument('--height', type=int, default=900,
         help='Height of the imgs in the video stream.')
 
+    cli_util.add_arguments(parser)
     return parser.parse_args(argv)
 
 if __name__ == '__main__':
-    main(parse_arguments(sys.argv[1:]))
+    cli_util.run(main, parse_arguments(sys.argv[1:]))
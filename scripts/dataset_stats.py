@@ -0,0 +1,69 @@
+import sys
+import argparse
+
+from tqdm import tqdm
+
+from vebits_api.annotation_util import iter_annotations
+from vebits_api.stats_util import DatasetStats
+from vebits_api import cli_util
+
+DESCRIPTION = """This computes statistics of a dataset: class counts, box size
+and aspect ratio distributions, boxes per image, degenerate and out-of-bounds
+boxes, as well as anchor sizes by k-means clustering. Annotations are read by
+chunks, so datasets larger than memory are supported.
+"""
+
+
+def main(args):
+    stats = DatasetStats(num_anchor_samples=args.num_anchor_samples,
+                         seed=args.seed)
+    with tqdm(unit="boxes") as t:
+        for df in iter_annotations(args.annotation_path,
+                                   chunk_size=args.chunk_size):
+            stats.update(df)
+            t.update(len(df))
+    print(stats.format_report())
+
+    extra = {}
+    if args.num_anchors > 0:
+        anchors, mean_iou = stats.get_anchors(args.num_anchors,
+                                              relative=args.relative,
+                                              seed=args.seed)
+        print("Anchors (width, height), mean IoU {:.3f}:".format(mean_iou))
+        for w, h in anchors:
+            print("    {:.4g}, {:.4g}".format(w, h))
+        extra["anchors"] = {"relative": args.relative,
+                            "mean_iou": mean_iou,
+                            "sizes": anchors.tolist()}
+
+    if args.output_path is not None:
+        stats.to_json(args.output_path, **extra)
+        print(">>> Statistics written to {}".format(args.output_path))
+
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        description=DESCRIPTION)
+
+    parser.add_argument('annotation_path', type=str,
+        help='Path to a csv file, Parquet file, annotation store or '
+             'directory of *.xml files.')
+    parser.add_argument('--chunk_size', type=int, default=1000000,
+        help='Number of boxes read at once.')
+    parser.add_argument('--num_anchors', type=int, default=9,
+        help='Number of anchors to compute. Use 0 to disable.')
+    parser.add_argument('--relative', action='store_true',
+        help='Compute anchors relative to image sizes instead of in pixels.')
+    parser.add_argument('--num_anchor_samples', type=int, default=1000000,
+        help='Maximum number of boxes (uniformly sampled) used to compute '
+             'anchors.')
+    parser.add_argument('--seed', type=int, default=None,
+        help='Random seed of sampling and clustering.')
+    parser.add_argument('--output_path', type=str, default=None,
+        help='Path to a JSON file to which statistics will be written.')
+    cli_util.add_arguments(parser)
+    return parser.parse_args(argv)
+
+if __name__ == '__main__':
+    cli_util.run(main, parse_arguments(sys.argv[1:]))
@@ -19,6 +19,7 @@
 # Import packages
 import os
 import sys
+import time
 import argparse
 import datetime
 
@@ -26,16 +27,19 @@ from tqdm import tqdm
 import cv2
 import imutils
 import numpy as np
-import tensorflow as tf
 
 # Import utilites
 from vebits_api import bbox_util, detector_util, im_util, others_util
-from vebits_api.xml_util import create_xml_file
+from vebits_api import cli_util, timing_util, xml_util
+from vebits_api.index_util import DatasetIndex
+from vebits_api.job_util import JobJournal
 
 FONT = cv2.FONT_HERSHEY_SIMPLEX
 CONFIDENCE_THRESHOLD = 0.5
 IMG_HEIGHT = 480
 IMG_WIDTH = 640
+# Name under which processed images are recorded in dataset indices
+CONSUMER = "det_img2img"
 
 DESCRIPTION="""This script loads Object Detection API's model(s) (up to two),
 makes predictions on images provided and save annotated images as well as
@@ -47,36 +51,65 @@ specific classes.
 def load_tensors(inference_graph_path,
                  labelmap_path,
                  num_classes,
-                 class_to_be_detected):
+                 class_to_be_detected,
+                 session_config=None,
+                 warm_up_shapes=None,
+                 num_sessions=1,
+                 num_processes=0,
+                 backend="tf",
+                 config_path=None):
     """
     This function extends `vebits_api.bbox_util.load_tensors` by providing one
-    more metadata: class to be detected.
+    more metadata: class to be detected. Session options are only used by
+    the "tf" backend.
     """
+    if backend == "tf":
+        backend_kwargs = {"session_config": session_config,
+                          "warm_up_shapes": warm_up_shapes,
+                          "num_sessions": num_sessions,
+                          "num_processes": num_processes}
+    else:
+        backend_kwargs = {}
     tensors = detector_util.load_tensors(
                                 inference_graph_path,
                                 labelmap_path,
-                                num_classes)
+                                num_classes,
+                                meta_path=config_path,
+                                backend=backend,
+                                backend_kwargs=backend_kwargs)
     class_to_be_detected = others_util.get_classes(class_to_be_detected,
                                                    tensors["labelmap_dict"])
     tensors["class_to_be_detected"] = class_to_be_detected
     return tensors
 
 
+def get_session_config(args):
+    """
+    Return keyword arguments of `detector_util.get_session_config` from
+    command line arguments.
+    """
+    return {"intra_op_threads": args.intra_op_threads,
+            "inter_op_threads": args.inter_op_threads,
+            "allow_growth": args.allow_growth}
+
+
 def get_filtered_boxes(boxes,
                        scores,
                        classes,
                        class_to_be_detected,
                        labelmap_dict_inverse,
                        confidence_threshold,
-                       img_size):
+                       img_size,
+                       box_format="normalized_yxyx"):
     # Filter unwanted boxes
     boxes, scores, classes = bbox_util.filter_boxes(
                                     boxes=boxes,
                                     scores=scores,
                                     classes=classes,
-                                    cls=class_to_be_detected,
+                                    classes_to_keep=class_to_be_detected,
                                     confidence_threshold=confidence_threshold,
-                                    img_size=img_size)
+                                    img_size=img_size,
+                                    box_format=box_format)
     # Convert to BBox format
     bboxes = []
     for i in range(boxes.shape[0]):
@@ -87,18 +120,34 @@ def get_filtered_boxes(boxes,
     return bboxes
 
 
+def get_output_paths(img_save_paths):
+    """
+    Return paths to all images and *.xml files written for a batch, which
+    must be on disk before the batch is recorded in the journal.
+    """
+    return img_save_paths + [os.path.splitext(path)[0] + ".xml"
+                             for path in img_save_paths]
+
+
 def process_frame_batch(frames,
                         img_save_paths,
                         num_transform,
                         sequence,
                         tensors,
                         tensors_2,
-                        confidence_threshold):
-
-    # Perform augmentation
-    if num_transform > 0:
-        frames_aug = sequence(images=frames * num_transform)
-    else: frames_aug = []
+                        confidence_threshold,
+                        img_src_paths=None):
+    """
+    `img_src_paths` contains, for each frame, the path to its source file if
+    the frame is unmodified, or None otherwise. Unmodified frames are saved
+    by copying the source file instead of encoding them again.
+    """
+    # Perform augmentation. `sequence` can either be an imgaug augmenter or
+    # an `im_util.AugmentationPool` to augment the batch on multiple cores.
+    with timing_util.stage("augment"):
+        if num_transform > 0:
+            frames_aug = sequence(images=frames * num_transform)
+        else: frames_aug = []
     # Get names for the whole batch
     img_save_paths_aug = (
         others_util.get_batch_names(img_save_paths[i], num_transform)
@@ -106,6 +155,8 @@ def process_frame_batch(frames,
     )
     for img_aug_names in zip(*img_save_paths_aug):
         img_save_paths.extend(list(img_aug_names))
+    if img_src_paths is not None:
+        img_src_paths.extend([None] * len(frames_aug))
     # Get all images (un-augmented and augmented ones)
     frames.extend(frames_aug)
     frames = np.array(frames)
@@ -116,46 +167,64 @@ def process_frame_batch(frames,
 
     frame_height, frame_width = frames.shape[1:3]
     # Filter out unwanted boxes
-    for i in range(boxes.shape[0]):
-        bboxes = get_filtered_boxes(
-                            boxes=boxes[i],
-                            scores=scores[i],
-                            classes=classes[i],
-                            class_to_be_detected=tensors["class_to_be_detected"],
-                            labelmap_dict_inverse=tensors["labelmap_dict_inverse"],
-                            confidence_threshold=confidence_threshold,
-                            img_size=(frame_height, frame_width),
-                        )
-
-        if tensors_2 is not None:
-            bboxes_2 = get_filtered_boxes(
-                                boxes=boxes_2[i],
-                                scores=scores_2[i],
-                                classes=classes_2[i],
-                                class_to_be_detected=tensors_2["class_to_be_detected"],
-                                labelmap_dict_inverse=tensors_2["labelmap_dict_inverse"],
+    with timing_util.stage("postprocess"):
+        bboxes_list = []
+        for i in range(boxes.shape[0]):
+            bboxes = get_filtered_boxes(
+                                boxes=boxes[i],
+                                scores=scores[i],
+                                classes=classes[i],
+                                class_to_be_detected=tensors["class_to_be_detected"],
+                                labelmap_dict_inverse=tensors["labelmap_dict_inverse"],
                                 confidence_threshold=confidence_threshold,
                                 img_size=(frame_height, frame_width),
+                                box_format=detector_util.get_backend(tensors).box_format,
                             )
-            bboxes = bboxes + bboxes_2
+
+            if tensors_2 is not None:
+                bboxes_2 = get_filtered_boxes(
+                                    boxes=boxes_2[i],
+                                    scores=scores_2[i],
+                                    classes=classes_2[i],
+                                    class_to_be_detected=tensors_2["class_to_be_detected"],
+                                    labelmap_dict_inverse=tensors_2["labelmap_dict_inverse"],
+                                    confidence_threshold=confidence_threshold,
+                                    img_size=(frame_height, frame_width),
+                                    box_format=detector_util.get_backend(tensors_2).box_format,
+                                )
+                bboxes = bboxes + bboxes_2
+            bboxes_list.append(bboxes)
+    with timing_util.stage("write"):
         # Generate *.xml files simultaneously
-        xml_util.create_xml_file(
-            img_save_paths[i],
-            frame_width,
-            frame_height,
-            bboxes,
-        )
+        for img_save_path, bboxes in zip(img_save_paths, bboxes_list):
+            xml_util.create_xml_file(img_save_path, frame_width, frame_height,
+                                     bboxes)
         # Save images
-        im_util.save_imgs(frames, img_save_paths)
+        im_util.save_imgs(frames, img_save_paths, img_src_paths)
 
 
 def main(args):
-    # Load tensors
+    if args.timing_path is not None:
+        timing_util.enable()
+    # Load tensors. Warm up with full batches of original and augmented
+    # images.
+    session_config = get_session_config(args)
+    warm_up_shapes = None
+    # Worker processes need the batch shape to allocate shared memory
+    if not args.no_warm_up or args.num_processes > 0:
+        warm_up_shapes = [(args.batch_size * (args.num_transform + 1),
+                           IMG_HEIGHT, IMG_WIDTH, 3)]
     tensors = load_tensors(
                     args.inference_graph_path,
                     args.labelmap_path,
                     args.num_classes,
-                    args.class_to_be_detected)
+                    args.class_to_be_detected,
+                    session_config,
+                    warm_up_shapes,
+                    args.num_sessions,
+                    args.num_processes,
+                    args.backend,
+                    args.config_path)
 
     if args.inference_graph_path_2 is None:
         tensors_2 = None
@@ -164,36 +233,86 @@ def main(args):
                         args.inference_graph_path_2,
                         args.labelmap_path_2,
                         args.num_classes_2,
-                        args.class_to_be_detected_2)
+                        args.class_to_be_detected_2,
+                        session_config,
+                        warm_up_shapes,
+                        args.num_sessions,
+                        args.num_processes,
+                        args.backend,
+                        args.config_path_2)
 
     img_dirs = args.img_dirs
     output_dirs = args.output_dirs
     batch_size = args.batch_size
 
-    sequence = im_util.create_sequence()
+    sequence = im_util.AugmentationPool(num_workers=args.num_aug_workers,
+                                        seed=args.seed)
     num_transform = args.num_transform
 
     num_frame_processed = 0
     num_img_generated = 0
     frames = []
     img_save_paths = []
+    img_src_paths = []
+    img_names = []
+    # Images already processed by previous runs are recorded in the journal
+    journal = None
+    if args.journal_path is not None:
+        journal = JobJournal(args.journal_path)
+        print(">>> Resuming: {} images already processed".format(len(journal)))
 
     for img_dir, output_dir in zip(img_dirs, output_dirs):
-        img_list = sorted(os.listdir(img_dir))[args.start:]
+        if args.use_index:
+            # Only process images that are new or changed since last run
+            index = DatasetIndex(img_dir)
+            new, changed, removed = index.update()
+            print(">>> Index of {}: {} new, {} changed, {} removed".format(
+                img_dir, len(new), len(changed), len(removed)))
+            img_list = index.pending(CONSUMER)
+            if journal is not None:
+                # Images recorded in the journal since the index was last
+                # saved are replayed into it
+                replayed = [img_name for img_name in img_list
+                            if os.path.join(img_dir, img_name) in journal]
+                index.mark_done(CONSUMER, replayed)
+            # Save hashes computed by the update, lest they are computed
+            # again after an interruption
+            index.save()
+            img_list = img_list[args.start:]
+            last_save = time.monotonic()
+        else:
+            index = None
+            img_list = sorted(os.listdir(img_dir))[args.start:]
+        img_list = cli_util.limit_items(img_list, args.limit)
         with tqdm(img_list) as t:
             for img_name in t:
                 _, ext = os.path.splitext(img_name)
                 if ext not in [".jpg", ".png"]:
                     continue
+                img_path = os.path.join(img_dir, img_name)
+                if journal is not None and img_path in journal:
+                    continue
 
                 # Update the variables.
                 num_frame_processed += 1
                 # Read image and resize to desired size
-                img_path = os.path.join(img_dir, img_name)
-                img = cv2.imread(img_path)
-                img = im_util.resize_padding(img, (IMG_HEIGHT, IMG_WIDTH))
-
-                img_save_paths.append(os.path.join(output_dir, img_name))
+                with timing_util.stage("decode"):
+                    img = cv2.imread(img_path)
+                if img.shape[:2] == (IMG_HEIGHT, IMG_WIDTH):
+                    # Unmodified image will be copied instead of re-encoded
+                    img_src_paths.append(img_path)
+                else:
+                    with timing_util.stage("preprocess"):
+                        img = im_util.resize_padding(img,
+                                                     (IMG_HEIGHT, IMG_WIDTH))
+                    img_src_paths.append(None)
+
+                img_save_path = os.path.join(output_dir, img_name)
+                if os.path.dirname(img_name):
+                    # Images found by the index may be in subdirectories
+                    os.makedirs(os.path.dirname(img_save_path), exist_ok=True)
+                img_save_paths.append(img_save_path)
+                img_names.append(img_name)
                 frames.append(img)
                 # Wait until batch_size number of frames are grabbed
                 if num_frame_processed % batch_size != 0:
@@ -205,13 +324,29 @@ def main(args):
                                     sequence=sequence,
                                     tensors=tensors,
                                     tensors_2=tensors_2,
-                                    confidence_threshold=CONFIDENCE_THRESHOLD)
+                                    confidence_threshold=CONFIDENCE_THRESHOLD,
+                                    img_src_paths=img_src_paths)
 
                 num_img_generated += len(img_save_paths)
                 t.set_postfix(generated=num_img_generated)
+                if journal is not None:
+                    journal.commit((os.path.join(img_dir, img_name)
+                                    for img_name in img_names),
+                                   outputs=get_output_paths(img_save_paths))
+                if index is not None:
+                    # Saving rewrites the whole index, so it is only done
+                    # periodically. Images processed since the last save are
+                    # replayed from the journal, or processed again.
+                    index.mark_done(CONSUMER, img_names)
+                    if (time.monotonic() - last_save
+                            >= args.index_save_interval):
+                        index.save()
+                        last_save = time.monotonic()
 
                 frames = []
                 img_save_paths = []
+                img_src_paths = []
+                img_names = []
         # At the end of the loop, there might be some images that
         # have not been processed
         if frames != []:
@@ -221,16 +356,34 @@ def main(args):
                                 sequence=sequence,
                                 tensors=tensors,
                                 tensors_2=tensors_2,
-                                confidence_threshold=CONFIDENCE_THRESHOLD)
+                                confidence_threshold=CONFIDENCE_THRESHOLD,
+                                img_src_paths=img_src_paths)
 
             num_img_generated += len(img_save_paths)
+            if journal is not None:
+                journal.commit((os.path.join(img_dir, img_name)
+                                for img_name in img_names),
+                               outputs=get_output_paths(img_save_paths))
+            if index is not None:
+                index.mark_done(CONSUMER, img_names)
+        if index is not None:
+            index.save()
 
         print('>>> Results: {} images generated to {}'.format(num_img_generated, output_dir))
         # Reset parameters to continue processing with the next folders
         frames = []
         img_save_paths = []
+        img_src_paths = []
+        img_names = []
         num_img_generated = 0
 
+    sequence.close()
+    if journal is not None:
+        journal.close()
+    if args.timing_path is not None:
+        print(timing_util.format_report())
+        timing_util.write(args.timing_path)
+
 
 def parse_arguments(argv):
     parser = argparse.ArgumentParser(
@@ -248,6 +401,16 @@ def parse_arguments(argv):
         separate each class with comma (e.g \'phone,not_phone\'). \
         Specify \'all\' to use all classes.')
 
+    parser.add_argument('--backend', type=str, default='tf',
+        choices=sorted(detector_util.BACKENDS),
+        help='Backend running the model(s). See `detector_util.BACKENDS`. '
+             'Session options only apply to the "tf" backend.')
+    parser.add_argument('--config_path', type=str, default=None,
+        help='Path to the config of the first model, if the backend needs '
+             'one (e.g. the cfg file of a Darknet model for "cv2_dnn").')
+    parser.add_argument('--config_path_2', type=str, default=None,
+        help='Path to the config of the second model.')
+
     parser.add_argument('-i', '--inference_graph_path_2', type=str, default=None,
         help='Path to the second inference graph.')
     parser.add_argument('-l', '--labelmap_path_2', type=str, default=None,
@@ -270,7 +433,51 @@ def parse_arguments(argv):
         help='Number of times to perform augmentation.')
     parser.add_argument('--start', type=int, default=0,
         help='Index to start. Helpful when continuing from previous work.')
+    parser.add_argument('--journal_path', type=str, default=None,
+        help='Path to a journal in which processed images are recorded after '
+             'each batch. If it exists, these images are skipped, so that an '
+             'interrupted run can be resumed with the same arguments.')
+    parser.add_argument('--use_index', action='store_true',
+        help='Keep an index of images in each directory of `img_dirs`, and '
+             'only process images that are new or changed since last run.')
+    parser.add_argument('--index_save_interval', type=float, default=60,
+        help='Minimum number of seconds between saves of indices during a '
+             'run (they are also saved at the end of each directory). Use '
+             'with `--journal_path` so that images processed since the last '
+             'save are not processed again after an interruption.')
+    parser.add_argument('--intra_op_threads', type=int, default=None,
+        help='Number of threads used by Tensorflow to run a single '
+             'operation. If not specified, all cores are used.')
+    parser.add_argument('--inter_op_threads', type=int, default=None,
+        help='Number of threads used by Tensorflow to run independent '
+             'operations in parallel.')
+    parser.add_argument('--num_sessions', type=int, default=1,
+        help='Number of Tensorflow sessions among which each batch is '
+             'split. On machines with many cores, several sessions with '
+             'fewer threads each are usually faster. See '
+             '`tune_model_pool.py`.')
+    parser.add_argument('--allow_growth', action='store_true',
+        help='Allocate GPU memory as needed instead of all at once.')
+    parser.add_argument('--num_processes', type=int, default=0,
+        help='If specified, run each model in this many worker processes, '
+             'among which each batch is split, so that inference does not '
+             'share the GIL with decoding and writing. Overrides '
+             '`--num_sessions`.')
+    parser.add_argument('--no_warm_up', action='store_true',
+        help='Do not warm up models with dummy batches before processing. '
+             'Ignored with `--num_processes`.')
+    parser.add_argument('--timing_path', type=str, default=None,
+        help='If specified, time each stage (decode, preprocess, inference, '
+             'postprocess, write, ...), print a summary at the end and write '
+             'histograms to this path: in Prometheus text format if it ends '
+             'with `.prom`, as JSON otherwise.')
+    parser.add_argument('--num_aug_workers', type=int, default=None,
+        help='Number of processes to perform augmentation. If not specified, '
+             'all CPUs but one will be used.')
+    parser.add_argument('--seed', type=int, default=None,
+        help='Random seed of augmentation.')
+    cli_util.add_arguments(parser, limit=True)
     return parser.parse_args(argv)
 
 if __name__ == '__main__':
-    main(parse_arguments(sys.argv[1:]))
+    cli_util.run(main, parse_arguments(sys.argv[1:]))
@@ -1,5 +1,7 @@
 import os
 import cv2
+import imutils
+import numpy as np
 
 import sys
 import argparse
@@ -8,8 +10,10 @@ from tqdm import tqdm
 
 # Import utilites
 from vebits_api import bbox_util, detector_util, im_util, others_util
-from vebits_api.xml_util import create_xml_file
-from det_img2img import load_tensors, get_filtered_boxes
+from vebits_api import cli_util, timing_util, xml_util
+from vebits_api.hash_util import HASH_FUNCTIONS, FrameDeduplicator
+from vebits_api.job_util import JobJournal
+from det_img2img import load_tensors, get_filtered_boxes, get_session_config
 
 FONT = cv2.FONT_HERSHEY_SIMPLEX
 CONFIDENCE_THRESHOLD = 0.5
@@ -21,6 +25,15 @@ to predict specific classes.
 """
 
 
+def get_output_paths(img_save_paths):
+    """
+    Return paths to all images and *.xml files written for a batch, which
+    must be on disk before the batch is recorded in the journal.
+    """
+    return img_save_paths + [os.path.splitext(path)[0] + ".xml"
+                             for path in img_save_paths]
+
+
 def process_frame_batch(frames,
                         img_save_paths,
                         num_transform,
@@ -29,8 +42,10 @@ def process_frame_batch(frames,
                         tensors_2,
                         confidence_threshold):
 
-    # Perform augmentation
-    frames_aug = sequence(images=frames * num_transform)
+    # Perform augmentation. `sequence` can either be an imgaug augmenter or
+    # an `im_util.AugmentationPool` to augment the batch on multiple cores.
+    with timing_util.stage("augment"):
+        frames_aug = sequence(images=frames * num_transform)
     frames.extend(frames_aug)
     frames = np.asarray(frames)
     # Update number of images generated
@@ -49,47 +64,122 @@ def process_frame_batch(frames,
 
     frame_height, frame_width = frames.shape[1:3]
 
-    for i in range(boxes.shape[0]):
-        bboxes = get_filtered_boxes(
-                            boxes=boxes[i],
-                            scores=scores[i],
-                            classes=classes[i],
-                            class_to_be_detected=tensors["class_to_be_detected"],
-                            labelmap_dict_inverse=tensors["labelmap_dict_inverse"],
-                            confidence_threshold=confidence_threshold,
-                            img_size=(frame_height, frame_width),
-                        )
-        if tensors_2 is not None:
-            bboxes_2 = get_filtered_boxes(
-                                boxes=boxes_2[i],
-                                scores=scores_2[i],
-                                classes=classes_2[i],
-                                class_to_be_detected=tensors_2["class_to_be_detected"],
-                                labelmap_dict_inverse=tensors_2["labelmap_dict_inverse"],
+    with timing_util.stage("postprocess"):
+        bboxes_list = []
+        for i in range(boxes.shape[0]):
+            bboxes = get_filtered_boxes(
+                                boxes=boxes[i],
+                                scores=scores[i],
+                                classes=classes[i],
+                                class_to_be_detected=tensors["class_to_be_detected"],
+                                labelmap_dict_inverse=tensors["labelmap_dict_inverse"],
                                 confidence_threshold=confidence_threshold,
                                 img_size=(frame_height, frame_width),
+                                box_format=detector_util.get_backend(tensors).box_format,
                             )
+            if tensors_2 is not None:
+                bboxes_2 = get_filtered_boxes(
+                                    boxes=boxes_2[i],
+                                    scores=scores_2[i],
+                                    classes=classes_2[i],
+                                    class_to_be_detected=tensors_2["class_to_be_detected"],
+                                    labelmap_dict_inverse=tensors_2["labelmap_dict_inverse"],
+                                    confidence_threshold=confidence_threshold,
+                                    img_size=(frame_height, frame_width),
+                                    box_format=detector_util.get_backend(tensors_2).box_format,
+                                )
 
-            bboxes = bboxes + bboxes_2
-
-        xml_util.create_xml_file(
-            img_save_paths[i],
-            frame_width,
-            frame_height,
-            bboxes,
-        )
-
+                bboxes = bboxes + bboxes_2
+            bboxes_list.append(bboxes)
+    with timing_util.stage("write"):
+        # Generate *.xml files simultaneously
+        for img_save_path, bboxes in zip(img_save_paths, bboxes_list):
+            xml_util.create_xml_file(img_save_path, frame_width, frame_height,
+                                     bboxes)
+        # Save images
         im_util.save_imgs(frames, img_save_paths)
 
     return num_img_generated
 
+def get_frame_size(video_path, rotate, scale):
+    """
+    Return `(height, width)` of frames of `video_path` after rotation and
+    scaling, as computed from the first frame in `main`.
+    """
+    video = cv2.VideoCapture(video_path)
+    width = int(video.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(video.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    video.release()
+    if rotate == 90 or rotate == 270:
+        width, height = height, width
+    return int(height * scale), int(width * scale)
+
+
+def parse_roi(text):
+    """
+    Parse a region of interest `xmin,ymin,xmax,ymax` given on command line.
+    """
+    try:
+        roi = [int(value) for value in text.split(",")]
+    except ValueError:
+        roi = []
+    if len(roi) != 4:
+        raise argparse.ArgumentTypeError(
+            "Invalid region of interest: {}".format(text))
+    return roi
+
+
+def add_tiling(tensors, args):
+    """
+    Wrap the backend of `tensors` to detect objects on tiles of frames, if
+    `--tile_size` is specified.
+    """
+    if tensors is not None and args.tile_size is not None:
+        tensors["backend"] = detector_util.TiledBackend(
+            detector_util.get_backend(tensors), args.tile_size,
+            args.tile_overlap, args.rois, args.tile_full_image)
+    return tensors
+
+
 def main(args):
-    # Load models' tensors
+    if args.timing_path is not None:
+        timing_util.enable()
+    # Prepare for image rotation
+    rotate = args.rotate
+    if rotate is not None:
+        if rotate % 90 != 0:
+            raise ValueError("Invalid value for \'rotate\'")
+        else:
+            rotate = rotate % 360
+    # Load models' tensors. Warm up with full batches of original and
+    # augmented frames of the first video.
+    session_config = get_session_config(args)
+    warm_up_shapes = None
+    # Worker processes need the batch shape to allocate shared memory
+    if not args.no_warm_up or args.num_processes > 0:
+        frame_size = get_frame_size(args.video_paths[0], rotate, args.scale)
+        num_inputs = args.batch_size * (args.num_transform + 1)
+        if args.tile_size is not None:
+            # Models run on tiles of all frames of a batch at once
+            num_inputs *= (len(im_util.get_tiles(frame_size, args.tile_size,
+                                                 args.tile_overlap,
+                                                 args.rois))
+                           + int(args.tile_full_image))
+            frame_size = (min(args.tile_size[0], frame_size[0]),
+                          min(args.tile_size[1], frame_size[1]))
+        warm_up_shapes = [(num_inputs,) + frame_size + (3,)]
     tensors = load_tensors(
                     args.inference_graph_path,
                     args.labelmap_path,
                     args.num_classes,
-                    args.class_to_be_detected)
+                    args.class_to_be_detected,
+                    session_config,
+                    warm_up_shapes,
+                    args.num_sessions,
+                    args.num_processes,
+                    args.backend,
+                    args.config_path)
+    tensors = add_tiling(tensors, args)
 
     if args.inference_graph_path_2 is None:
         dual = False
@@ -100,21 +190,22 @@ def main(args):
                         args.inference_graph_path_2,
                         args.labelmap_path_2,
                         args.num_classes_2,
-                        args.class_to_be_detected_2)
+                        args.class_to_be_detected_2,
+                        session_config,
+                        warm_up_shapes,
+                        args.num_sessions,
+                        args.num_processes,
+                        args.backend,
+                        args.config_path_2)
+        tensors_2 = add_tiling(tensors_2, args)
     # Read arguments
     batch_size = args.batch_size
     beginning = True
     scale = args.scale
     # Prepare for image augmentation
-    sequence = create_sequence()
+    sequence = im_util.AugmentationPool(num_workers=args.num_aug_workers,
+                                        seed=args.seed)
     num_transform = args.num_transform
-    # Prepare for image rotation
-    rotate = args.rotate
-    if rotate is not None:
-        if rotate % 90 != 0:
-            raise ValueError("Invalid value for \'rotate\'")
-        else:
-            rotate = rotate % 360
 
     num_frame_passed = 0
     num_frame_processed = 0
@@ -122,25 +213,86 @@ def main(args):
     num_frame_interval = args.num_frame_interval
     frames = []
     img_save_paths = []
+    # Progress of each video is recorded in the journal after each batch
+    journal = None
+    if args.journal_path is not None:
+        journal = JobJournal(args.journal_path)
+
+    def commit(key, frame_idx, img_save_paths, kept_hashes, done=False):
+        # Hashes of kept frames are recorded so that near-duplicates of them
+        # are still dropped after resuming
+        journal.commit(progress={key: {
+            "frame": frame_idx, "done": done,
+            "passed": num_frame_passed, "processed": num_frame_processed,
+            "generated": num_img_generated,
+            "size": [frame_width, frame_height]}},
+            records={"dedup:" + key: kept_hashes},
+            outputs=get_output_paths(img_save_paths))
 
     for video_path, output_dir in zip(args.video_paths, args.output_dirs):
         if not os.path.isdir(output_dir):
             os.mkdir(output_dir)
+        frame_idx = 0
+        # The same video may be processed to several output directories
+        key = "{}:{}".format(video_path, output_dir)
+        state = None if journal is None else journal.get_progress(key)
+        if state is not None:
+            # Restore counters, so that frames are sampled and named exactly
+            # as in the interrupted run
+            num_frame_passed = state["passed"]
+            num_frame_processed = state["processed"]
+            if beginning:
+                frame_width, frame_height = state["size"]
+                beginning = False
+            if state["done"]:
+                print(">>> Skipping {} (already processed)".format(video_path))
+                continue
+            num_img_generated = state["generated"]
+            frame_idx = state["frame"]
+        # Drop frames that are near-duplicates of frames kept from this video
+        dedup = None
+        if args.dedup_threshold is not None:
+            dedup = FrameDeduplicator(args.dedup_threshold, args.dedup_hash)
+            if journal is not None:
+                for hash_value in journal.get_records("dedup:" + key):
+                    dedup.add(hash_value)
+        # Hashes of frames kept since the last commit
+        kept_hashes = []
         # Open video file
         video = cv2.VideoCapture(video_path)
         _, video_name = os.path.split(video_path)
         name, _ = os.path.splitext(video_name)
+        if frame_idx > 0:
+            print(">>> Resuming {} from frame {}".format(video_path, frame_idx))
+            # Skip processed frames without decoding them. This is slower than
+            # seeking, but exact for all codecs.
+            for _ in range(frame_idx):
+                if not video.grab():
+                    break
+        # Number of frames sampled from this video in this run
+        num_sampled = 0
         # Start reading and processing frame by frame
         with tqdm() as t:
             while True:
-                ret, frame = video.read()
+                if args.limit is not None and num_sampled >= args.limit:
+                    break
+                with timing_util.stage("decode"):
+                    ret, frame = video.read()
                 if not ret:
                     break
+                frame_idx += 1
                 # Wait until reached the end of the interval.
                 num_frame_passed += 1
                 if num_frame_passed % num_frame_interval != 0:
                     continue
+                if dedup is not None:
+                    with timing_util.stage("dedup"):
+                        keep = dedup.keep(frame)
+                    if not keep:
+                        continue
+                    kept_hashes.append(dedup.last_hash)
                 # If reached, then update the variables.
+                num_sampled += 1
                 num_frame_processed += 1
                 num_img_generated += 1
                 img_save_name = "{}_{}.jpg".format(name, num_img_generated)
@@ -156,11 +308,12 @@ def main(args):
                     frame_width = int(frame_width * scale)
                     frame_height = int(frame_height * scale)
                     beginning = False
-                # Rotate frame
-                if rotate:
-                    frame = imutils.rotate_bound(frame, rotate)
-                # Resize frame
-                frame = cv2.resize(frame, (frame_width, frame_height))
+                with timing_util.stage("preprocess"):
+                    # Rotate frame
+                    if rotate:
+                        frame = imutils.rotate_bound(frame, rotate)
+                    # Resize frame
+                    frame = cv2.resize(frame, (frame_width, frame_height))
                 frames.append(frame)
                 # Wait until batch_size number of frames are grabbed.
                 if num_frame_processed % batch_size != 0:
@@ -175,9 +328,12 @@ def main(args):
                                         tensors_2=tensors_2,
                                         confidence_threshold=CONFIDENCE_THRESHOLD)
                 t.set_postfix(generated=num_img_generated, img=img_save_name)
+                if journal is not None:
+                    commit(key, frame_idx, img_save_paths, kept_hashes)
                 # Reset each time one batch is processed
                 frames = []
                 img_save_paths = []
+                kept_hashes = []
             # At the end of the loop, there might bt some leftover
             if frames != []:
                 num_img_generated = process_frame_batch(
@@ -189,15 +345,29 @@ def main(args):
                                         tensors_2=tensors_2,
                                         confidence_threshold=CONFIDENCE_THRESHOLD)
                 t.set_postfix(generated=num_img_generated, img=img_save_name)
+            if journal is not None and not beginning:
+                # A video cut short by `--limit` can be resumed later
+                commit(key, frame_idx, img_save_paths, kept_hashes,
+                       done=args.limit is None or num_sampled < args.limit)
 
             print('\n>>> Results: {} images generated to '
                   '{}'.format(num_img_generated, output_dir))
+            if dedup is not None:
+                print('>>> {} near-duplicate frames dropped'.format(
+                    dedup.num_dropped))
             # Clean up
             video.release()
             frames = []
             img_save_paths = []
             num_img_generated = 0
 
+    sequence.close()
+    if journal is not None:
+        journal.close()
+    if args.timing_path is not None:
+        print(timing_util.format_report())
+        timing_util.write(args.timing_path)
+
 
 def parse_arguments(argv):
     parser = argparse.ArgumentParser(
@@ -215,6 +385,16 @@ def parse_arguments(argv):
         separate each class with comma (e.g \'phone,not_phone\'). \
         Specify \'all\' to use all classes.')
 
+    parser.add_argument('--backend', type=str, default='tf',
+        choices=sorted(detector_util.BACKENDS),
+        help='Backend running the model(s). See `detector_util.BACKENDS`. '
+             'Session options only apply to the "tf" backend.')
+    parser.add_argument('--config_path', type=str, default=None,
+        help='Path to the config of the first model, if the backend needs '
+             'one (e.g. the cfg file of a Darknet model for "cv2_dnn").')
+    parser.add_argument('--config_path_2', type=str, default=None,
+        help='Path to the config of the second model.')
+
     parser.add_argument('-i', '--inference_graph_path_2', type=str, default=None,
         help='Path to the second inference graph.')
     parser.add_argument('-l', '--labelmap_path_2', type=str, default=None,
@@ -239,10 +419,74 @@ def parse_arguments(argv):
         help='Number of times to perform augmentation.')
     parser.add_argument('--scale', type=float, default=0.5,
         help='Scale to resize the images.')
+    parser.add_argument('--tile_size', type=int, nargs=2, default=None,
+        metavar=('HEIGHT', 'WIDTH'),
+        help='If specified, detect objects on overlapping tiles of this size '
+             'of (rotated and scaled) frames, all run in one batch, and merge '
+             'detections across tiles. Use it with `--scale 1` to detect '
+             'small objects in high-resolution frames.')
+    parser.add_argument('--tile_overlap', type=int, default=64,
+        help='Minimum overlap in pixels between adjacent tiles. Should be at '
+             'least the size of objects to detect.')
+    parser.add_argument('--tile_full_image', action='store_true',
+        help='Also detect objects on whole frames resized to the tile size, '
+             'to detect objects larger than tiles.')
+    parser.add_argument('--rois', type=parse_roi, nargs='+', default=None,
+        metavar='XMIN,YMIN,XMAX,YMAX',
+        help='Regions of interest of (rotated and scaled) frames. Only these '
+             'regions are tiled, and detections whose center is outside all '
+             'of them are discarded. Requires `--tile_size`.')
     parser.add_argument('--num_frame_interval', type=int, default=15,
         help='Length of frame interval to skip.')
+    parser.add_argument('--journal_path', type=str, default=None,
+        help='Path to a journal in which progress of each video is recorded '
+             'after each batch. If it exists, processed videos and frames are '
+             'skipped, so that an interrupted run can be resumed with the '
+             'same arguments.')
+    parser.add_argument('--dedup_threshold', type=int, default=None,
+        help='If specified, sampled frames whose perceptual hash is within '
+             'this Hamming distance (out of 64 bits) of a frame already kept '
+             'are dropped. Around 4 drops frames of static scenes.')
+    parser.add_argument('--dedup_hash', type=str, default='dct',
+        choices=sorted(HASH_FUNCTIONS),
+        help='Perceptual hash used to find near-duplicate frames.')
+    parser.add_argument('--intra_op_threads', type=int, default=None,
+        help='Number of threads used by Tensorflow to run a single '
+             'operation. If not specified, all cores are used.')
+    parser.add_argument('--inter_op_threads', type=int, default=None,
+        help='Number of threads used by Tensorflow to run independent '
+             'operations in parallel.')
+    parser.add_argument('--num_sessions', type=int, default=1,
+        help='Number of Tensorflow sessions among which each batch is '
+             'split. On machines with many cores, several sessions with '
+             'fewer threads each are usually faster. See '
+             '`tune_model_pool.py`.')
+    parser.add_argument('--allow_growth', action='store_true',
+        help='Allocate GPU memory as needed instead of all at once.')
+    parser.add_argument('--num_processes', type=int, default=0,
+        help='If specified, run each model in this many worker processes, '
+             'among which each batch is split, so that inference does not '
+             'share the GIL with decoding and writing. Overrides '
+             '`--num_sessions`.')
+    parser.add_argument('--no_warm_up', action='store_true',
+        help='Do not warm up models with dummy batches before processing. '
+             'Ignored with `--num_processes`.')
+    parser.add_argument('--timing_path', type=str, default=None,
+        help='If specified, time each stage (decode, preprocess, inference, '
+             'postprocess, write, ...), print a summary at the end and write '
+             'histograms to this path: in Prometheus text format if it ends '
+             'with `.prom`, as JSON otherwise.')
+    parser.add_argument('--num_aug_workers', type=int, default=None,
+        help='Number of processes to perform augmentation. If not specified, '
+             'all CPUs but one will be used.')
+    parser.add_argument('--seed', type=int, default=None,
+        help='Random seed of augmentation.')
 
-    return parser.parse_args(argv)
+    cli_util.add_arguments(parser, limit=True)
+    args = parser.parse_args(argv)
+    if args.rois is not None and args.tile_size is None:
+        parser.error("--rois requires --tile_size")
+    return args
 
 if __name__ == '__main__':
-    main(parse_arguments(sys.argv[1:]))
+    cli_util.run(main, parse_arguments(sys.argv[1:]))
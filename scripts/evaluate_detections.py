@@ -0,0 +1,90 @@
+import sys
+import json
+import argparse
+
+import numpy as np
+
+from vebits_api.annotation_util import read_annotations
+from vebits_api.eval_util import COCO_IOU_THRESHOLDS, evaluate_dataframes
+from vebits_api import cli_util
+
+DESCRIPTION = """This evaluates predictions of an object detector against
+ground truth annotations, and reports AP per class at multiple IoU thresholds
+(COCO-style by default). Predictions have the same format as annotations, with
+an additional column `score`.
+"""
+
+
+def nan_to_none(obj):
+    """
+    Replace NaN values (e.g. AP of classes without ground truth) in nested
+    dicts and lists by None, which is written as `null`, since NaN is not
+    valid JSON.
+    """
+    if isinstance(obj, dict):
+        return {key: nan_to_none(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [nan_to_none(value) for value in obj]
+    if isinstance(obj, float) and np.isnan(obj):
+        return None
+    return obj
+
+
+def main(args):
+    gt_df = read_annotations(args.gt_path, num_workers=args.num_workers)
+    pred_df = read_annotations(args.pred_path)
+    if args.min_score > 0:
+        pred_df = pred_df[pred_df["score"] >= args.min_score]
+
+    if args.iou_thresholds is None:
+        iou_thresholds = COCO_IOU_THRESHOLDS
+    else:
+        iou_thresholds = np.asarray(args.iou_thresholds)
+    results = evaluate_dataframes(gt_df, pred_df, iou_thresholds,
+                                  method=args.method)
+
+    print(">>> Evaluated {} images".format(results["num_images"]))
+    print("AP: {:.4f}".format(results["AP"]))
+    for threshold in iou_thresholds:
+        key = "AP@{:.2f}".format(threshold)
+        print("{}: {:.4f}".format(key, results[key]))
+    print("Per class (num_gts, num_preds, AP@{:.2f}):".format(
+        iou_thresholds[0]))
+    for cl, stats in results["per_class"].items():
+        print("    {}: {}, {}, {:.4f}".format(cl, stats["num_gts"],
+                                              stats["num_preds"],
+                                              stats["AP"][0]))
+
+    if args.output_path is not None:
+        with open(args.output_path, "w") as f:
+            json.dump(nan_to_none(results), f, indent=2, allow_nan=False)
+        print(">>> Results written to {}".format(args.output_path))
+
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        description=DESCRIPTION)
+
+    parser.add_argument('gt_path', type=str,
+        help='Path to ground truth annotations: a csv file, Parquet file, '
+             'annotation store or directory of *.xml files.')
+    parser.add_argument('pred_path', type=str,
+        help='Path to a csv or Parquet file of predictions.')
+    parser.add_argument('--iou_thresholds', type=float, nargs='+',
+        default=None,
+        help='IoU thresholds. If not specified, 0.5:0.05:0.95 as in COCO.')
+    parser.add_argument('--method', type=str, default='coco',
+        choices=['coco', 'voc'],
+        help='Interpolation of precision/recall curves.')
+    parser.add_argument('--min_score', type=float, default=0.0,
+        help='Predictions with lower scores are discarded.')
+    parser.add_argument('--num_workers', type=int, default=None,
+        help='Number of processes used to parse *.xml files.')
+    parser.add_argument('--output_path', type=str, default=None,
+        help='Path to a JSON file to which results will be written.')
+    cli_util.add_arguments(parser)
+    return parser.parse_args(argv)
+
+if __name__ == '__main__':
+    cli_util.run(main, parse_arguments(sys.argv[1:]))
@@ -0,0 +1,92 @@
+import sys
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from vebits_api.hash_util import find_duplicate_clusters, to_hash_array
+from vebits_api.index_util import DatasetIndex
+from vebits_api import cli_util
+
+DESCRIPTION = """This finds exact and near-duplicate images across dataset
+splits (e.g. the same image, or re-encoded copies of it, in both training and
+evaluation sets). Each directory is a split; its images are indexed with their
+perceptual hashes, and the index is saved in the directory so that later runs
+only hash new or changed images.
+"""
+
+
+def main(args):
+    # Index each split
+    dfs = []
+    for img_dir in args.img_dirs:
+        index = DatasetIndex(img_dir)
+        new, changed, removed = index.update(num_workers=args.num_workers,
+                                             perceptual=True)
+        index.save()
+        print(">>> Indexed {} images in {} ({} new, {} changed, {} removed)"
+              "".format(len(index), img_dir, len(new), len(changed),
+                        len(removed)))
+        df = index.df.reset_index(drop=True)
+        df["split"] = img_dir
+        dfs.append(df)
+    df = pd.concat(dfs, ignore_index=True)
+
+    undecodable = df["phash"].isna().to_numpy()
+    if undecodable.any():
+        print(">>> Ignoring {} images that cannot be decoded".format(
+            undecodable.sum()))
+        df = df[~undecodable].reset_index(drop=True)
+
+    # Cluster duplicates
+    df["cluster"] = find_duplicate_clusters(
+        to_hash_array(df["phash"].to_numpy()), args.threshold,
+        exact_keys=df["hash"].to_numpy(),
+        max_bucket_size=args.max_bucket_size)
+    groups = df.groupby("cluster")
+    df["cluster_size"] = groups["path"].transform("size")
+    df["num_splits"] = groups["split"].transform("nunique")
+    df["kind"] = np.where(groups["hash"].transform("nunique") == 1,
+                          "exact", "near")
+
+    duplicates = df[df["cluster_size"] > 1]
+    if not args.within_splits:
+        duplicates = duplicates[duplicates["num_splits"] > 1]
+    duplicates = duplicates.sort_values(["cluster", "split", "path"])
+
+    print(">>> Found {} clusters of duplicates ({} images)".format(
+        duplicates["cluster"].nunique(), duplicates.shape[0]))
+    leaked = df[df["num_splits"] > 1]
+    for split, count in leaked.groupby("split").size().items():
+        print(">>> {}: {} images also appear in other splits".format(
+            split, count))
+
+    duplicates.loc[:, ["cluster", "kind", "split", "path"]].to_csv(
+        args.output_path, index=False)
+    print(">>> Report written to {}".format(args.output_path))
+
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        description=DESCRIPTION)
+
+    parser.add_argument('img_dirs', type=str, nargs='+',
+        help='Directories of images, one per split.')
+    parser.add_argument('--threshold', type=int, default=4,
+        help='Maximum Hamming distance (out of 64 bits) between perceptual '
+             'hashes of near-duplicates. 0 only finds re-encoded copies.')
+    parser.add_argument('--within_splits', action='store_true',
+        help='Also report duplicates within a single split.')
+    parser.add_argument('--max_bucket_size', type=int, default=10000,
+        help='Hash buckets larger than this (e.g. blank images) are skipped '
+             'when looking for near-duplicates.')
+    parser.add_argument('--num_workers', type=int, default=None,
+        help='Number of processes. If not specified, all CPUs will be used.')
+    parser.add_argument('--output_path', type=str, default='duplicates.csv',
+        help='Path to the csv file listing duplicates.')
+    cli_util.add_arguments(parser)
+    return parser.parse_args(argv)
+
+if __name__ == '__main__':
+    cli_util.run(main, parse_arguments(sys.argv[1:]))
@@ -6,15 +6,27 @@ import os
 import argparse
 from shutil import rmtree
 import time
+from multiprocessing import Pool
 from tqdm import tqdm
 
-import imgaug as ia
 import imgaug.augmenters as iaa
 from imgaug.augmentables.bbs import BoundingBox, BoundingBoxesOnImage
 
+from vebits_api import im_util, labelmap_util
+from vebits_api.annotation_util import read_annotations, write_annotations
+from vebits_api.tfrecord_util import ShardedTFRecordWriter, create_record
+from vebits_api.bbox_util import BBOX_COLS, get_filename_index
+from vebits_api import cli_util
+
 import warnings
 warnings.filterwarnings("ignore")
 
+# Columns of generated annotations. Other input columns (e.g. `folder` of
+# annotations converted from *.xml files) do not apply to generated images.
+OUTPUT_COLS = ["filename", "width", "height", "class"] + BBOX_COLS
+# State of each worker process, set by `init_worker`.
+_worker = {}
+
 def create_sequence():
     sequence = iaa.Sequential([
         iaa.Fliplr(0.5),
@@ -28,26 +40,120 @@ def create_sequence():
     return sequence
 
 
-def get_bboxes(df, img_name):
-    bboxes = np.asarray(df[df.filename == img_name].iloc[:, 4:])
-    return [BoundingBox(*i) for i in bboxes]
-
-# Function to copy data of original image to new image.
-def copy_data(orig_data, img_name, bboxes):
-    transformed_data = pd.DataFrame(
-        [orig_data.iloc[0, :]] * bboxes.shape[0],
-        columns=orig_data.columns)
-
-    transformed_data[["xmin", "ymin", "xmax", "ymax"]] = bboxes
-    transformed_data.filename = img_name
-    return transformed_data
-
 # Function to calculate the fraction of the bounding boxes with relative to the original image.
 def cal_bboxes_fraction(orig_area, bboxes):
     bboxes = np.asarray(bboxes, dtype=float)
     bboxes_area = (bboxes[:, 2] - bboxes[:, 0]) * (bboxes[:, 3] - bboxes[:, 1])
     return bboxes_area / orig_area * 100
 
+
+def init_worker(src_dir, dest_dir, area_threshold, num_transform,
+                keep_orig_img, labelmap_dict=None):
+    """
+    Initialize a worker process with its own augmentation sequence, which is
+    reseeded for each task.
+    """
+    _worker.update(sequence=create_sequence(), src_dir=src_dir,
+                   dest_dir=dest_dir, area_threshold=area_threshold,
+                   num_transform=num_transform, keep_orig_img=keep_orig_img,
+                   labelmap_dict=labelmap_dict)
+
+
+def transform_image(task):
+    """Augment a single image and save the results.
+
+    Parameters
+    ----------
+    task : tuple
+        `(img, width, height, labels, bboxes, num_duplicates, seed)`, where
+        `labels` and `bboxes` are the deduplicated labels and boxes of the
+        image. The sequence is seeded with `seed` for this image, so that
+        results do not depend on which worker processes it.
+
+    Returns
+    -------
+    filenames : list
+        Names of the saved images, one per kept image.
+    bboxes : list
+        Bounding boxes of each saved image, in the same order as `filenames`.
+    skipped : int
+        Number of generated images skipped.
+    records : list
+        TFRecord records of saved images, built from the encoded bytes
+        directly. Empty if no label map was given to `init_worker`.
+
+    """
+    img, width, height, labels, bboxes, num_duplicates, seed = task
+    sequence = _worker["sequence"]
+    sequence.reseed(seed)
+    src_dir = _worker["src_dir"]
+    dest_dir = _worker["dest_dir"]
+    area_threshold = _worker["area_threshold"]
+    labelmap_dict = _worker["labelmap_dict"]
+
+    name, ext = os.path.splitext(img)
+    img_shape = (height, width)
+    img_area = img_shape[0] * img_shape[1]
+    bboxes_iaa = BoundingBoxesOnImage.from_xyxy_array(bboxes, shape=img_shape)
+
+    filenames_out, bboxes_out, records = [], [], []
+    skipped = 0
+    suffix = 0
+    img_array = cv2.imread(os.path.join(src_dir, img))
+
+    # If keeping original image and the bounding boxes satisfy the threshold condition.
+    if _worker["keep_orig_img"] and all(cal_bboxes_fraction(img_area, bboxes) >= area_threshold):
+        filenames_out.append(img)
+        bboxes_out.append(bboxes)
+        # Copy the original file instead of encoding the image again
+        encoded = im_util.save_img(img_array, os.path.join(dest_dir, img),
+                                   src_path=os.path.join(src_dir, img),
+                                   modified=False,
+                                   return_encoded=labelmap_dict is not None)
+        if labelmap_dict is not None:
+            records.append(create_record(img, encoded, width, height, labels,
+                                         bboxes, labelmap_dict))
+
+    # Augment all copies of the image in a single batch
+    num_copies = _worker["num_transform"] * num_duplicates
+    transformed_imgs, transformed_bboxes_list = sequence(
+        images=[img_array] * num_copies,
+        bounding_boxes=[bboxes_iaa] * num_copies)
+
+    for transformed_img, transformed_bboxes in zip(transformed_imgs,
+                                                   transformed_bboxes_list):
+        for transformed_bbox in transformed_bboxes.bounding_boxes:
+            if not transformed_bbox.is_fully_within_image(transformed_img):
+                skipped += 1
+                break
+
+        else:
+            transformed_bboxes = transformed_bboxes.to_xyxy_array(dtype=np.int32)
+            if any(cal_bboxes_fraction(img_area, transformed_bboxes) < area_threshold):
+                skipped += 1
+                continue
+
+            transformed_name = name + "_{}".format(suffix) + ext
+            transformed_path = os.path.join(dest_dir, transformed_name)
+            # When the file exists
+            while os.path.isfile(transformed_path):
+                suffix += 1
+                transformed_name = name + "_{}".format(suffix) + ext
+                transformed_path = os.path.join(dest_dir, transformed_name)
+
+            filenames_out.append(transformed_name)
+            bboxes_out.append(transformed_bboxes)
+
+            encoded = im_util.save_img(transformed_img, transformed_path)
+            if labelmap_dict is not None:
+                records.append(create_record(transformed_name, encoded, width,
+                                             height, labels, transformed_bboxes,
+                                             labelmap_dict))
+            suffix += 1
+
+    return filenames_out, bboxes_out, skipped, records
+
+
 # Function to transform all images in src_dir, save transformed images to dest_dir,
 # update images data in df and save it to csv_output_dir.
 
@@ -56,78 +162,98 @@ def transform(csv_input_path, src_dir,
               dest_dir, area_threshold,
               csv_output_path=None,
               num_transform=5, test_mode=False,
-              keep_orig_img=False):
+              keep_orig_img=False, num_workers=None,
+              seed=None, classes=None, tfrecord_path=None,
+              labelmap_dict=None, num_shards=1, limit=None):
 
-    df = pd.read_csv(csv_input_path)
+    # Only load objects of the desired classes
+    filters = None if classes is None else [("class", "in", classes)]
+    df = read_annotations(csv_input_path, filters=filters)
     df_drop_duplicates = df.drop_duplicates()
     print(">>> Original df: {} objects".format(df.shape[0]))
     print(">>> Dropped-duplicates df: {} objects".format(df_drop_duplicates.shape[0]))
-    df_out = pd.DataFrame(columns=df.columns)
-    img_list = sorted(df.filename.unique())
-
-    skip_gen_img = 0
 
-    sequence = create_sequence()
+    # Index the deduplicated rows by filename once, instead of filtering
+    # the whole dataframe for every image.
+    order, img_list, starts, ends = get_filename_index(df_drop_duplicates)
+    num_rows = df.filename.value_counts().reindex(img_list).to_numpy()
+    widths = df_drop_duplicates.width.to_numpy()[order][starts]
+    heights = df_drop_duplicates.height.to_numpy()[order][starts]
+    labels = df_drop_duplicates["class"].to_numpy()[order]
+    bboxes = df_drop_duplicates.loc[:, BBOX_COLS].to_numpy(dtype=np.int32)[order]
 
     if test_mode:
         img_list = img_list[:30]
         print(">>> Testing with 30 images.")
+    elif limit is not None:
+        img_list = img_list[:limit]
+        print(">>> Limited to {} images.".format(len(img_list)))
     else:
         expected = (num_transform + 1) * df.shape[0] if keep_orig_img else num_transform * df.shape[0]
         print('>>> Number of expected objects: {}'.format(expected))
 
-    with tqdm(img_list, unit="imgs") as t:
-        for img in t:
-            t.set_postfix(skipped_gen_imgs=skip_gen_img)
-            if not img.lower().endswith("jpg"):
-                continue
-
-            name, ext = os.path.splitext(img)
-
-            img_data = df_drop_duplicates[df_drop_duplicates.filename == img]
-            num_duplicates = int(df[df.filename == img].shape[0] / img_data.shape[0])
-            img_shape = (img_data.iloc[0, 2], img_data.iloc[0, 1])
-            img_area =  img_shape[0] * img_shape[1]
-
-            bboxes = np.asarray(img_data.iloc[:, 4:], dtype=np.int)
-            bboxes_iaa = BoundingBoxesOnImage.from_xyxy_array(bboxes, shape=img_shape)
-
-            suffix = 0
-            img_array = cv2.imread(os.path.join(src_dir, img))
-
-            # If keeping original image and the bounding boxes satisfy the threshold condition.
-            if keep_orig_img and all(cal_bboxes_fraction(img_area, bboxes) >= area_threshold):
-                df_out = df_out.append(img_data, ignore_index=True)
-                cv2.imwrite(os.path.join(dest_dir, img), img_array)
-
-            for _ in range(num_transform * num_duplicates):
-                transformed_img, transformed_bboxes = sequence(image=img_array, bounding_boxes=bboxes_iaa)
-
-                for transformed_bbox in transformed_bboxes.bounding_boxes:
-                    if not transformed_bbox.is_fully_within_image(transformed_img):
-                        skip_gen_img += 1
-                        break
-
-                else:
-                    transformed_bboxes = transformed_bboxes.to_xyxy_array(dtype=np.int)
-                    if any(cal_bboxes_fraction(img_area, transformed_bboxes) < area_threshold):
-                        skip_gen_img += 1
-                        continue
+    if seed is None:
+        seed = np.random.randint(0, 2 ** 31 - 1)
+    tasks = []
+    for i, img in enumerate(img_list):
+        if not img.lower().endswith("jpg"):
+            continue
+        start, end = starts[i], ends[i]
+        num_duplicates = int(num_rows[i] / (end - start))
+        tasks.append((img, widths[i], heights[i], labels[start:end],
+                      bboxes[start:end], num_duplicates, seed + i))
+
+    # Accumulate results by column and build the output dataframe only once.
+    filenames_out, labels_out, bboxes_out = [], [], []
+    widths_out, heights_out = [], []
+    skip_gen_img = 0
 
-                    transformed_name = name + "_{}".format(suffix) + ext
-                    transformed_path = os.path.join(dest_dir, transformed_name)
-                    # When the file exists
-                    while os.path.isfile(transformed_path):
-                        suffix += 1
-                        transformed_name = name + "_{}".format(suffix) + ext
-                        transformed_path = os.path.join(dest_dir, transformed_name)
+    # Write TFRecord shards as images are generated
+    if tfrecord_path is not None:
+        if labelmap_dict is None:
+            # Map classes to index starting from 1
+            labelmap_dict = {cl: i + 1 for i, cl
+                             in enumerate(sorted(df["class"].unique()))}
+        writer = ShardedTFRecordWriter(tfrecord_path, num_shards)
+    else:
+        labelmap_dict = None
+        writer = None
+
+    initargs = (src_dir, dest_dir, area_threshold, num_transform,
+                keep_orig_img, labelmap_dict)
+
+    with Pool(num_workers, initializer=init_worker, initargs=initargs) as pool, \
+            tqdm(total=len(tasks), unit="imgs") as t:
+        results = pool.imap(transform_image, tasks, chunksize=4)
+        for task, (filenames, img_bboxes, skipped, records) in zip(tasks, results):
+            if writer is not None:
+                for record in records:
+                    writer.write_record(record)
+            _, width, height, img_labels, _, _, _ = task
+            for filename, bbox in zip(filenames, img_bboxes):
+                num_bboxes = bbox.shape[0]
+                filenames_out.append(np.full(num_bboxes, filename, dtype=object))
+                labels_out.append(img_labels)
+                bboxes_out.append(bbox)
+                widths_out.append(np.full(num_bboxes, width))
+                heights_out.append(np.full(num_bboxes, height))
+
+            skip_gen_img += skipped
+            t.set_postfix(skipped_gen_imgs=skip_gen_img)
+            t.update()
 
+    if writer is not None:
+        writer.close()
 
-                    transformed_data = copy_data(img_data, transformed_name, transformed_bboxes)
-                    df_out = df_out.append(transformed_data, ignore_index=True)
+    if bboxes_out:
+        df_out = pd.DataFrame({"filename": np.concatenate(filenames_out),
+                               "width": np.concatenate(widths_out),
+                               "height": np.concatenate(heights_out),
+                               "class": np.concatenate(labels_out)})
+        df_out[BBOX_COLS] = np.concatenate(bboxes_out)
+    else:
+        df_out = pd.DataFrame(columns=OUTPUT_COLS)
 
-                    cv2.imwrite(os.path.join(dest_dir, transformed_name), transformed_img)
-                    suffix += 1
     print('''
 =================================
 Total images processed: {}
@@ -140,10 +266,10 @@ Total generated images skipped: {}
            skip_gen_img))
 
     # Shuffle the DataFrame
-    df_out = df_out.sample(frac=1.0).reset_index(drop=True)
+    df_out = df_out.sample(frac=1.0, random_state=seed).reset_index(drop=True)
     if csv_output_path is not None:
-        df_out.to_csv(csv_output_path, index=False)
-    return df
+        write_annotations(df_out, csv_output_path)
+    return df_out
 
 
 def main(args):
@@ -153,20 +279,25 @@ def main(args):
     test_mode = args.test_mode
     keep_orig_img = args.keep_orig_image
     area_threshold = args.area_threshold
+    if args.labelmap_path is None:
+        labelmap_dict = None
+    else:
+        labelmap_dict = labelmap_util.get_label_map_dict(args.labelmap_path)
 
     # Transform data and generate tfrecord files.
-    for csv, folder_name in zip(["train_labels.csv"], ["combined"]):
+    for csv, folder_name in zip([args.input_path], [args.img_folder]):
         csv_in = os.path.join(src_dir, csv)
-        csv_out = os.path.join(dest_dir, csv)
+        csv_out = os.path.join(dest_dir, os.path.basename(csv))
         src = os.path.join(src_dir, folder_name)
         dest = os.path.join(dest_dir, "train")
+        tf_record_out = os.path.join(dest_dir, "train" + ".record")
 
         # Remove old generated images
         if os.path.isdir(dest):
             rmtree(dest)
         os.mkdir(dest)
 
-        # Transform images.
+        # Transform images and generate tfrecord from the encoded images.
         transform(csv_input_path=csv_in,
                   src_dir=src,
                   dest_dir=dest,
@@ -174,13 +305,18 @@ def main(args):
                   csv_output_path=csv_out,
                   num_transform=num_transform,
                   test_mode=test_mode,
-                  keep_orig_img=keep_orig_img)
+                  keep_orig_img=keep_orig_img,
+                  num_workers=args.num_workers,
+                  seed=args.seed,
+                  classes=args.classes,
+                  tfrecord_path=tf_record_out,
+                  labelmap_dict=labelmap_dict,
+                  num_shards=args.num_shards,
+                  limit=args.limit)
 
-        print("Successfully generated images to {} and csv file to {} ...".format(dest, csv_out))
+        print("Successfully generated images to {}, csv file to {} and tfrecord "
+              "to {} ...".format(dest, csv_out, tf_record_out))
 
-        # Generate tfrecord.
-        tf_record_out = os.path.join(dest_dir, "train" + ".record")
-        os.system("python generate_tfrecord.py --csv_input={} --image_dir={} --output_path={}".format(csv_out, dest, tf_record_out))
 
 def parse_arguments(argv):
     parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
@@ -193,13 +329,34 @@ def parse_arguments(argv):
         help='Number of transformed images per image.')
     parser.add_argument('area_threshold', type=float,
         help='Minimum percentage of area allowed of bounding box with relative to the image.')
+    parser.add_argument('--input_path', type=str, default='train_labels.csv',
+        help='Path to the annotations (csv file, Parquet file or annotation '
+             'store), relative to `src_dir`. Generated annotations are saved '
+             'under the same name and format in `dest_dir`.')
+    parser.add_argument('--img_folder', type=str, default='combined',
+        help='Folder of images in `src_dir`.')
     parser.add_argument('--test_mode', action="store_true",
         help='Whether to enter test mode.')
     parser.add_argument('--batch_size', type=int, default=128,
         help='Number of images to perform augmentation at a time.')
     parser.add_argument('--keep_orig_image', action="store_true",
         help='Whether to include the original image.')
+    parser.add_argument('--num_workers', type=int, default=None,
+        help='Number of processes to perform augmentation. '
+             'If not specified, all CPUs will be used.')
+    parser.add_argument('--seed', type=int, default=None,
+        help='Random seed. The i-th image is augmented with seed `seed + i`, '
+             'so that results do not depend on the number of workers.')
+    parser.add_argument('--labelmap_path', type=str, default=None,
+        help='Path to the label map used to encode classes in tfrecord. If not '
+             'specified, classes are numbered from 1 in alphabetical order.')
+    parser.add_argument('--num_shards', type=int, default=1,
+        help='Number of tfrecord shards.')
+    parser.add_argument('--classes', type=str, nargs='+', default=None,
+        help='If specified, only objects of these classes will be loaded. '
+             'This is fast with Parquet input.')
+    cli_util.add_arguments(parser, limit=True)
     return parser.parse_args(argv)
 
 if __name__ == '__main__':
-    main(parse_arguments(sys.argv[1:]))
+    cli_util.run(main, parse_arguments(sys.argv[1:]))
@@ -0,0 +1,56 @@
+import sys
+import argparse
+
+from tqdm import tqdm
+
+from vebits_api import labelmap_util
+from vebits_api.annotation_util import read_annotations
+from vebits_api.tfrecord_util import df_to_tfrecords
+from vebits_api import cli_util
+
+DESCRIPTION = """This writes images and their labels to TFRecord file(s) of
+Tensorflow Object Detection API format. Tensorflow is not required.
+"""
+
+
+def main(args):
+    df = read_annotations(args.csv_input)
+    if args.labelmap_path is None:
+        # Map classes to index starting from 1
+        labelmap_dict = {cl: i + 1 for i, cl
+                         in enumerate(sorted(df["class"].unique()))}
+    else:
+        labelmap_dict = labelmap_util.get_label_map_dict(args.labelmap_path)
+
+    with tqdm(total=df.filename.nunique()) as t:
+        for num_written in df_to_tfrecords(df, args.image_dir,
+                                           args.output_path, labelmap_dict,
+                                           num_shards=args.num_shards,
+                                           num_workers=args.num_workers):
+            t.update(num_written)
+
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        description=DESCRIPTION)
+
+    parser.add_argument('--csv_input', type=str, required=True,
+        help='Path to the csv file or annotation store.')
+    parser.add_argument('--image_dir', type=str, required=True,
+        help='Directory to images.')
+    parser.add_argument('--output_path', type=str, required=True,
+        help='Path to the output tfrecord file.')
+    parser.add_argument('--labelmap_path', type=str, default=None,
+        help='Path to the label map. If not specified, classes are numbered '
+             'from 1 in alphabetical order.')
+    parser.add_argument('--num_shards', type=int, default=1,
+        help='Number of shards, each written by a separate process.')
+    parser.add_argument('--num_workers', type=int, default=None,
+        help='Number of processes. If not specified, all CPUs will be used.')
+
+    cli_util.add_arguments(parser)
+    return parser.parse_args(argv)
+
+if __name__ == '__main__':
+    cli_util.run(main, parse_arguments(sys.argv[1:]))
@@ -8,6 +8,8 @@ import numpy as np
 import cv2
 
 from vebits_api import others_util, bbox_util, vis_util, labelmap_util
+from vebits_api.annotation_util import read_annotations
+from vebits_api import cli_util
 
 DESCRIPTION = """This script loads in a csv file containing dataset data. List
 of images will be then generated. Images will be loaded one by one, visualized
@@ -18,7 +20,7 @@ respectively, `w` to copy displaying image to specified folder and `q` to quit.
 
 def main(args):
     # Read csv and generate image list
-    df = pd.read_csv(args.csv_path)
+    df = read_annotations(args.csv_path)
     img_list = df.filename.unique()
     num_imgs = len(img_list)
     # Read arguments
@@ -66,7 +68,7 @@ def parse_arguments(argv):
     parser.add_argument('dataset_dir', type=str,
         help='Directory to the dataset.')
     parser.add_argument('csv_path', type=str,
-        help='Path to the csv file.')
+        help='Path to the csv file or annotation store.')
     parser.add_argument('labelmap_path', type=str,
         help='Path to the labelmap.')
     parser.add_argument('incorrect_dir', type=str,
@@ -75,7 +77,8 @@ def parse_arguments(argv):
     parser.add_argument('--start', type=int, default=0,
         help='Starting point. Default=0 (i.e. no image has been processed.)')
 
+    cli_util.add_arguments(parser)
     return parser.parse_args(argv)
 
 if __name__ == '__main__':
-    main(parse_arguments(sys.argv[1:]))
+    cli_util.run(main, parse_arguments(sys.argv[1:]))
@@ -4,6 +4,7 @@ import sys
 import argparse
 from tqdm import tqdm
 from vebits_api.xml_util import prune_label_and_save
+from vebits_api import cli_util
 import glob
 
 
@@ -38,7 +39,8 @@ def parse_arguments(argv):
     parser.add_argument('num_to_keep', type=int,
         help='Number of objects of `label` to keep.')
 
+    cli_util.add_arguments(parser)
     return parser.parse_args(argv)
 
 if __name__ == '__main__':
-    main(parse_arguments(sys.argv[1:]))
+    cli_util.run(main, parse_arguments(sys.argv[1:]))
@@ -11,6 +11,9 @@ import imgaug as ia
 import imgaug.augmenters as iaa
 from imgaug.augmentables.bbs import BoundingBox, BoundingBoxesOnImage
 
+from vebits_api.annotation_util import read_annotations, write_annotations
+from vebits_api import cli_util
+
 def create_sequence():
     aug_1 = iaa.Pad(
         percent=((0.15, 0.3), (0.15, 0.3), (0.15, 0.3), (0.15, 0.3)),
@@ -65,16 +68,18 @@ def main(args):
     aug_1, aug_2, aug_3 = create_sequence()
     batch_size = args.batch_size
 
-    df = pd.read_csv(csv_input_path).sort_values("filename")
+    # Only load images of the desired shape
+    filters = None
     if args.width is not None and args.height is not None:
-        df = df[(df.width == args.width) & (df.height == args.height)]
+        filters = [("width", "==", args.width), ("height", "==", args.height)]
+    df = read_annotations(csv_input_path, filters=filters).sort_values("filename")
     df_out = pd.DataFrame(columns=df.columns)
     img_list = df.filename.unique()
 
     assert df.width.nunique() == 1
     assert df.height.nunique() == 1
 
-    img_shape = (df.loc[0, "height"], df.loc[0, "width"])
+    img_shape = (df.height.iloc[0], df.width.iloc[0])
 
     for index in tqdm(range(ceil(img_list.shape[0] / batch_size))):
         imgs_name = img_list[index * batch_size:(index + 1) * batch_size]
@@ -103,18 +108,19 @@ def main(args):
 
             df_out = pd.concat([df_out, df_aug], ignore_index=True)
 
-    df_out.to_csv(csv_output_path, index=False)
+    write_annotations(df_out, csv_output_path)
 
 
 def parse_arguments(argv):
     parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
 
     parser.add_argument('csv_input_path', type=str,
-        help='Path to the original csv file.')
+        help='Path to the original csv file or annotation store.')
     parser.add_argument('src_dir', type=str,
         help='Directory to the original images.')
     parser.add_argument('csv_output_path', type=str,
-        help='Path to which the result csv file will be saved.')
+        help='Path to which the result csv file will be saved. If it does not '
+             'end with .csv, an annotation store will be saved instead.')
     parser.add_argument('dest_dir', type=str,
         help='Directory to which all padded images will be saved.')
     parser.add_argument('--batch_size', type=int, default=32,
@@ -128,7 +134,8 @@ def parse_arguments(argv):
         Default=None means that it will sample all images\
         (and raise Error if all images are not of the same shape).')
 
+    cli_util.add_arguments(parser)
     return parser.parse_args(argv)
 
 if __name__ == '__main__':
-    main(parse_arguments(sys.argv[1:]))
+    cli_util.run(main, parse_arguments(sys.argv[1:]))
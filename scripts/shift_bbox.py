@@ -3,6 +3,8 @@ import sys
 import argparse
 from xml_util import shift_bboxes_and_save
 
+from vebits_api import cli_util
+
 def main(args):
     xml_src_dir = args.xml_src_dir
     xml_dest_dir = args.xml_dest_dir
@@ -34,7 +36,8 @@ def parse_arguments(argv):
     parser.add_argument('y_value', type=int,
         help='value to shift along the y-axis.')
 
+    cli_util.add_arguments(parser)
     return parser.parse_args(argv)
 
 if __name__ == '__main__':
-    main(parse_arguments(sys.argv[1:]))
+    cli_util.run(main, parse_arguments(sys.argv[1:]))
@@ -0,0 +1,142 @@
+import os
+import sys
+import time
+import argparse
+
+import cv2
+import numpy as np
+
+from vebits_api import cli_util, detector_util, im_util
+
+DESCRIPTION = """This benchmarks `detector_util.ModelPool` with different
+numbers of sessions and intra-op threads per session on the same batches, and
+reports the combination with the highest throughput. Use it to choose
+`--num_sessions` and `--intra_op_threads` of detection scripts on a given
+machine. By default, each batch is split among sessions as done by detection
+scripts (`ModelPool.detect_objects`), so use the same `--batch_size` as
+them. With `--mode map`, whole batches are run concurrently instead, one per
+session (`ModelPool.map`), which detection scripts do not do.
+"""
+
+
+def load_batches(img_dir, batch_size, num_batches, img_size):
+    """
+    Return `num_batches` batches of images from `img_dir`, or of random
+    images if `img_dir` is None. Real images are preferable, since
+    post-processing (e.g. non-max suppression) depends on the content.
+    """
+    height, width = img_size
+    if img_dir is None:
+        rng = np.random.RandomState(0)
+        imgs = rng.randint(0, 256, (batch_size, height, width, 3),
+                           dtype=np.uint8)
+    else:
+        img_names = sorted(img_name for img_name in os.listdir(img_dir)
+                           if img_name.lower().endswith((".jpg", ".png")))
+        imgs = np.stack([
+            im_util.resize_padding(cv2.imread(os.path.join(img_dir, img_name)),
+                                   img_size)
+            for img_name in img_names[:batch_size]])
+    # Cycle through the same images, so that all batches have the same size
+    indices = np.arange(batch_size * num_batches) % len(imgs)
+    return [imgs[indices[i * batch_size:(i + 1) * batch_size]]
+            for i in range(num_batches)]
+
+
+def benchmark(graph, batches, num_sessions, intra_op_threads,
+              inter_op_threads, mode="split"):
+    """
+    Return throughput in images per second of a `ModelPool` running
+    `batches`, after warming up each session. `mode` is "split" to split each
+    batch among sessions, or "map" to run whole batches concurrently.
+    """
+    pool = detector_util.ModelPool(graph, num_sessions,
+                                   intra_op_threads=intra_op_threads,
+                                   inter_op_threads=inter_op_threads)
+    try:
+        if mode == "split":
+            for _ in range(num_sessions):
+                pool.detect_objects(batches[0])
+        else:
+            for _ in pool.map(batches[:1] * num_sessions):
+                pass
+        start = time.perf_counter()
+        if mode == "split":
+            for batch in batches:
+                pool.detect_objects(batch)
+        else:
+            for _ in pool.map(batches):
+                pass
+        elapsed = time.perf_counter() - start
+    finally:
+        pool.close()
+    return sum(len(batch) for batch in batches) / elapsed
+
+
+def main(args):
+    graph = detector_util.load_graph_tf(args.inference_graph_path)
+    batches = load_batches(args.img_dir, args.batch_size, args.num_batches,
+                           (args.height, args.width))
+    num_cpus = os.cpu_count() or 1
+
+    results = []
+    print(">>> Mode: {}".format(args.mode))
+    print("{:>12} {:>16} {:>12}".format("sessions", "threads/session",
+                                         "imgs/s"))
+    for num_sessions in args.num_sessions:
+        if args.intra_op_threads is None:
+            threads_list = [max(1, num_cpus // num_sessions)]
+        else:
+            threads_list = args.intra_op_threads
+        for intra_op_threads in threads_list:
+            throughput = benchmark(graph, batches, num_sessions,
+                                   intra_op_threads, args.inter_op_threads,
+                                   args.mode)
+            results.append((throughput, num_sessions, intra_op_threads))
+            print("{:>12} {:>16} {:>12.2f}".format(num_sessions,
+                                                    intra_op_threads,
+                                                    throughput))
+            sys.stdout.flush()
+
+    throughput, num_sessions, intra_op_threads = max(results)
+    print(">>> Best: {} session(s) x {} thread(s), {:.2f} imgs/s".format(
+        num_sessions, intra_op_threads, throughput))
+
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        description=DESCRIPTION)
+
+    parser.add_argument('inference_graph_path', type=str,
+        help='Path to the inference graph.')
+    parser.add_argument('--img_dir', type=str, default=None,
+        help='Directory of sample images. If not specified, random images '
+             'are used.')
+    parser.add_argument('--num_sessions', type=int, nargs='+',
+        default=[1, 2, 4, 8],
+        help='Numbers of sessions to try.')
+    parser.add_argument('--intra_op_threads', type=int, nargs='+',
+        default=None,
+        help='Numbers of intra-op threads per session to try. If not '
+             'specified, cores are divided evenly among sessions.')
+    parser.add_argument('--inter_op_threads', type=int, default=1,
+        help='Number of inter-op threads per session.')
+    parser.add_argument('--batch_size', type=int, default=8,
+        help='Number of images per batch.')
+    parser.add_argument('--mode', type=str, default='split',
+        choices=['split', 'map'],
+        help='"split" splits each batch among sessions, as detection scripts '
+             'do with `--num_sessions`. "map" runs whole batches '
+             'concurrently, one per session.')
+    parser.add_argument('--num_batches', type=int, default=32,
+        help='Number of batches timed per combination.')
+    parser.add_argument('--height', type=int, default=480,
+        help='Height of images.')
+    parser.add_argument('--width', type=int, default=640,
+        help='Width of images.')
+    cli_util.add_arguments(parser)
+    return parser.parse_args(argv)
+
+if __name__ == '__main__':
+    cli_util.run(main, parse_arguments(sys.argv[1:]))
@@ -0,0 +1,103 @@
+import sys
+import time
+import argparse
+
+import cv2
+
+from vebits_api import cli_util
+from vebits_api.motion_util import MOTION_METHODS, MotionGate
+
+DESCRIPTION = """This runs `motion_util.MotionGate` with different thresholds
+on a video of a fixed camera, and reports the fraction of frames whose
+detection would be skipped, and thus the inference load saved, by
+`detector_util.Model(..., motion_gate=...)`. Use it to choose the highest
+threshold which still detects all relevant motion, e.g. by checking that
+`--save_path` shows the expected frames.
+"""
+
+
+def read_frames(video_path, gate, limit=None):
+    """
+    Return frames of `video_path` preprocessed by `gate`, and the mean time
+    in milliseconds to preprocess a full frame.
+    """
+    video = cv2.VideoCapture(video_path)
+    frames = []
+    elapsed = 0.0
+    try:
+        while limit is None or len(frames) < limit:
+            ret, frame = video.read()
+            if not ret:
+                break
+            start = time.perf_counter()
+            frames.append(gate.preprocess(frame))
+            elapsed += time.perf_counter() - start
+    finally:
+        video.release()
+    return frames, 1e3 * elapsed / max(len(frames), 1)
+
+
+def main(args):
+    def create_gate(threshold):
+        # Frames are preprocessed once, so that they are not blurred again
+        return MotionGate(threshold, args.refresh_interval, args.width,
+                          args.pixel_threshold, blur=0, method=args.method)
+
+    reader = MotionGate(width=args.width, blur=args.blur)
+    frames, preprocess_time = read_frames(args.video_path, reader,
+                                          args.limit)
+    print(">>> Read {} frames ({:.3f} ms/frame to downscale)".format(
+        len(frames), preprocess_time))
+
+    print("{:>12} {:>10} {:>10} {:>12} {:>14}".format(
+        "threshold", "detected", "skipped", "skip ratio", "gate(ms/frame)"))
+    for threshold in args.thresholds:
+        gate = create_gate(threshold)
+        start = time.perf_counter()
+        detected = [gate.should_detect(frame) for frame in frames]
+        elapsed = time.perf_counter() - start
+        print("{:>12g} {:>10} {:>10} {:>12.2%} {:>14.3f}".format(
+            threshold, gate.num_detected, gate.num_skipped, gate.skip_ratio,
+            1e3 * elapsed / max(len(frames), 1) + preprocess_time))
+        sys.stdout.flush()
+
+    if args.save_path is not None:
+        # Frames detected with the last threshold
+        with open(args.save_path, "w") as f:
+            for i, is_detected in enumerate(detected):
+                if is_detected:
+                    f.write("{}\n".format(i))
+        print(">>> Indices of frames detected with threshold {:g} written "
+              "to {}".format(args.thresholds[-1], args.save_path))
+
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        description=DESCRIPTION)
+
+    parser.add_argument('video_path', type=str,
+        help='Path to a video of a fixed camera.')
+    parser.add_argument('--thresholds', type=float, nargs='+',
+        default=[0.001, 0.0025, 0.005, 0.01, 0.02, 0.05],
+        help='Fractions of changed pixels above which frames are detected.')
+    parser.add_argument('--refresh_interval', type=int, default=30,
+        help='Maximum number of frames between two detections.')
+    parser.add_argument('--method', type=str, default='diff',
+        choices=MOTION_METHODS,
+        help='Motion score: difference with the last detected frame, or '
+             'MOG2 background subtraction.')
+    parser.add_argument('--width', type=int, default=160,
+        help='Width to which frames are downscaled.')
+    parser.add_argument('--pixel_threshold', type=int, default=25,
+        help='Minimum difference of gray levels of a changed pixel.')
+    parser.add_argument('--blur', type=int, default=5,
+        help='Size of the Gaussian kernel smoothing downscaled frames.')
+    parser.add_argument('--save_path', type=str, default=None,
+        help='If specified, write indices of frames detected with the last '
+             'threshold to this path.')
+    cli_util.add_arguments(parser, limit=True)
+    return parser.parse_args(argv)
+
+if __name__ == '__main__':
+    cli_util.run(main, parse_arguments(sys.argv[1:]))
@@ -1,36 +1,22 @@
 import os
-import glob
-import pandas as pd
-import xml.etree.ElementTree as ET
 import sys
 import argparse
 
+from vebits_api.annotation_util import read_voc_dir, write_annotations
+from vebits_api import cli_util
 
-def xml_to_csv(path):
-    xml_list = []
-    for xml_file in glob.glob(path + '/*.xml'):
-        tree = ET.parse(xml_file)
-        root = tree.getroot()
-        for member in root.findall('object'):
-            value = (root.find('filename').text,
-                     int(float(root.find('size')[0].text)),
-                     int(float(root.find('size')[1].text)),
-                     member[0].text,
-                     int(member[4][0].text),
-                     int(member[4][1].text),
-                     int(member[4][2].text),
-                     int(member[4][3].text)
-                     )
-            xml_list.append(value)
-    column_name = ['filename', 'width', 'height', 'class', 'xmin', 'ymin', 'xmax', 'ymax']
-    xml_df = pd.DataFrame(xml_list, columns=column_name)
-    return xml_df
+
+def xml_to_csv(path, num_workers=None):
+    return read_voc_dir(path, num_workers)
 
 
 def main(args):
     image_path = os.path.join(os.getcwd(), args.src_dir)
-    xml_df = xml_to_csv(image_path)
-    xml_df.to_csv(args.dest_path, index=None)
+    xml_df = xml_to_csv(image_path, args.num_workers)
+    # Parquet files are partitioned into row groups by source folder
+    if args.dest_path.lower().endswith(".parquet"):
+        xml_df["folder"] = args.src_dir
+    write_annotations(xml_df, args.dest_path)
     print('Successfully converted xml to csv.')
 
 
@@ -40,9 +26,14 @@ def parse_arguments(argv):
     parser.add_argument('src_dir', type=str,
         help='Directory to all the images and their labels.')
     parser.add_argument('dest_path', type=str,
-        help='Path to which the csv file will be saved.')
+        help='Path to which the csv file will be saved. If it does not end '
+             'with .csv, an annotation store will be saved instead.')
+    parser.add_argument('--num_workers', type=int, default=None,
+        help='Number of processes used to parse xml files. '
+             'If not specified, all CPUs will be used.')
 
+    cli_util.add_arguments(parser)
     return parser.parse_args(argv)
 
 if __name__ == '__main__':
-    main(parse_arguments(sys.argv[1:]))
+    cli_util.run(main, parse_arguments(sys.argv[1:]))
@@ -3,11 +3,21 @@ from __future__ import absolute_import
 
 # from vebits_api.vebits_api import *
 
+from . import annotation_util
 from . import bbox_util
 from . import detector_util
+from . import eval_util
+from . import hash_util
 from . import im_util
+from . import index_util
+from . import integrity_util
 from . import labelmap_util
+from . import motion_util
 from . import others_util
+from . import shm_util
+from . import stats_util
+from . import tfrecord_util
+from . import timing_util
 from . import vis_util
 from . import xml_util
 
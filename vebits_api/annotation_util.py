@@ -0,0 +1,480 @@
+"""Compact, memory-mappable storage of bounding box annotations, and
+converters from/to csv files, Parquet files and PASCAL VOC *.xml files."""
+
+import os
+import glob
+import json
+import operator
+from multiprocessing import Pool
+
+import numpy as np
+import pandas as pd
+# Try importing Arrow for Parquet files
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    pa_imported = True
+except ModuleNotFoundError:
+    print("No pyarrow installation found.")
+    pa_imported = False
+
+from .bbox_util import BBOX_COLS, get_filename_index
+from .others_util import check_import
+from .xml_util import create_xml_files, read_xml_file
+
+CSV_COLS = ["filename", "width", "height", "class"] + BBOX_COLS
+STORE_VERSION = 1
+STORE_META = "meta.json"
+# Operators supported by `filters` when data is loaded into pandas first
+FILTER_OPS = {"==": operator.eq, "=": operator.eq, "!=": operator.ne,
+              "<": operator.lt, "<=": operator.le,
+              ">": operator.gt, ">=": operator.ge}
+
+
+def _write_npy(path, array):
+    np.save(path, np.ascontiguousarray(array), allow_pickle=False)
+
+
+def _coord_dtype(boxes):
+    # Use int16 coordinates whenever they fit, which halves the storage size
+    info = np.iinfo(np.int16)
+    if boxes.size == 0 or (boxes.min() >= info.min and boxes.max() <= info.max):
+        return np.int16
+    return np.int32
+
+
+class AnnotationStore():
+    """Columnar storage of bounding boxes. Filenames and classes are
+    dictionary-encoded, coordinates are stored as int16/int32 and rows are
+    sorted by filename, so that bounding boxes of each image are contiguous
+    and can be looked up through a row-range index.
+
+    On disk, a store is a directory of *.npy files that can be read via
+    memory-mapping, so that loading is almost instantaneous regardless of
+    the number of bounding boxes.
+
+    Parameters
+    ----------
+    filenames : array-like
+        Sorted unique filenames, of shape (n_images,).
+    sizes : array-like
+        `(width, height)` of each image, of shape (n_images, 2).
+    offsets : array-like
+        Bounding boxes of `filenames[i]` are rows `offsets[i]:offsets[i + 1]`,
+        of shape (n_images + 1,).
+    classes : array-like
+        Unique class names.
+    class_ids : array-like
+        Index into `classes` of each bounding box, of shape (n_boxes,).
+    boxes : array-like
+        `xmin, ymin, xmax, ymax` of each bounding box, of shape (n_boxes, 4).
+
+    """
+    def __init__(self, filenames, sizes, offsets, classes, class_ids, boxes):
+        self.filenames = filenames
+        self.sizes = sizes
+        self.offsets = offsets
+        self.classes = classes
+        self.class_ids = class_ids
+        self.boxes = boxes
+        self._filename_index = None
+
+    def __len__(self):
+        return self.boxes.shape[0]
+
+    @property
+    def num_images(self):
+        return len(self.filenames)
+
+    # Functions for reading data
+    @classmethod
+    def from_dataframe(cls, df):
+        """
+        Create a store from a dataframe with columns `filename, width,
+        height, class, xmin, ymin, xmax, ymax`.
+        """
+        order, filenames, starts, ends = get_filename_index(df)
+        sizes = df.loc[:, ["width", "height"]].to_numpy()[order][starts]
+        offsets = np.append(starts, len(df)).astype(np.int64)
+
+        class_ids, classes = pd.factorize(df["class"].to_numpy()[order],
+                                          sort=True)
+        boxes = df.loc[:, BBOX_COLS].to_numpy(dtype=np.int64)[order]
+
+        return cls(filenames=np.asarray(filenames, dtype=object),
+                   sizes=sizes.astype(np.int32),
+                   offsets=offsets,
+                   classes=np.asarray(classes, dtype=object),
+                   class_ids=class_ids.astype(np.int16),
+                   boxes=boxes.astype(_coord_dtype(boxes)))
+
+    @classmethod
+    def from_csv(cls, csv_path):
+        return cls.from_dataframe(pd.read_csv(csv_path))
+
+    @classmethod
+    def from_voc_dir(cls, xml_dir, num_workers=None):
+        """
+        Create a store from all *.xml files of PASCAL VOC format in
+        `xml_dir`, parsed by `num_workers` processes.
+        """
+        return cls.from_dataframe(read_voc_dir(xml_dir, num_workers))
+
+    @classmethod
+    def load(cls, store_dir, mmap=True):
+        """
+        Load a store saved by `save`. If `mmap` is True, arrays are
+        memory-mapped and only read from disk when accessed.
+        """
+        mmap_mode = "r" if mmap else None
+
+        def load_npy(name):
+            return np.load(os.path.join(store_dir, name + ".npy"),
+                           mmap_mode=mmap_mode, allow_pickle=False)
+
+        with open(os.path.join(store_dir, STORE_META)) as f:
+            meta = json.load(f)
+        if meta["version"] != STORE_VERSION:
+            raise ValueError("Unsupported annotation store version: "
+                             "{}".format(meta["version"]))
+
+        return cls(filenames=_EncodedStrings(load_npy("filename_bytes"),
+                                             load_npy("filename_offsets")),
+                   sizes=load_npy("sizes"),
+                   offsets=load_npy("offsets"),
+                   classes=np.asarray(meta["classes"], dtype=object),
+                   class_ids=load_npy("class_ids"),
+                   boxes=load_npy("boxes"))
+
+    # Functions for outputting data
+    def save(self, store_dir):
+        if not os.path.isdir(store_dir):
+            os.makedirs(store_dir)
+        # Filenames are stored as a single utf-8 buffer plus offsets
+        encoded = [str(filename).encode("utf-8") for filename in self.filenames]
+        filename_offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        filename_offsets[1:] = np.cumsum([len(name) for name in encoded])
+        filename_bytes = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+
+        arrays = {"filename_bytes": filename_bytes,
+                  "filename_offsets": filename_offsets,
+                  "sizes": self.sizes,
+                  "offsets": self.offsets,
+                  "class_ids": self.class_ids,
+                  "boxes": self.boxes}
+        for name, array in arrays.items():
+            _write_npy(os.path.join(store_dir, name + ".npy"), array)
+
+        meta = {"version": STORE_VERSION,
+                "classes": [str(cl) for cl in self.classes],
+                "num_images": self.num_images,
+                "num_boxes": len(self)}
+        with open(os.path.join(store_dir, STORE_META), "w") as f:
+            json.dump(meta, f)
+
+    def to_dataframe(self):
+        """
+        Return a dataframe with columns `filename, width, height, class,
+        xmin, ymin, xmax, ymax`. Filenames and classes stay encoded as
+        categoricals, so that only one string per image is decoded instead
+        of one per bounding box.
+        """
+        counts = np.diff(self.offsets)
+        image_ids = np.repeat(np.arange(self.num_images, dtype=np.int32),
+                              counts)
+        sizes = np.asarray(self.sizes)[image_ids]
+
+        df = pd.DataFrame({
+            "filename": pd.Categorical.from_codes(
+                image_ids, categories=self.filenames[:]),
+            "width": sizes[:, 0],
+            "height": sizes[:, 1],
+            "class": pd.Categorical.from_codes(
+                np.asarray(self.class_ids), categories=self.classes)})
+        df[BBOX_COLS] = np.asarray(self.boxes, dtype=np.int32)
+        return df
+
+    def to_csv(self, csv_path):
+        self.to_dataframe().to_csv(csv_path, index=False)
+
+    def to_voc_dir(self, img_dir, dest_dir=None,
+                   num_workers=None, chunk_size=256, callback=None):
+        """
+        Write one *.xml file of PASCAL VOC format per image. See
+        `xml_util.create_xml_files` for details of the arguments. Return
+        number of xml files written.
+        """
+        labels = self.classes[np.asarray(self.class_ids)]
+        return create_xml_files(self.filenames[:], self.sizes[:, 0],
+                                self.sizes[:, 1], labels,
+                                np.asarray(self.boxes),
+                                self.offsets[:-1], self.offsets[1:],
+                                img_dir, dest_dir, num_workers, chunk_size,
+                                callback)
+
+    # Functions for querying data
+    def get_index(self, filename):
+        """
+        Return index of `filename`, or raise KeyError if not found.
+        """
+        if self._filename_index is None:
+            self._filename_index = {name: i for i, name
+                                    in enumerate(self.filenames[:])}
+        return self._filename_index[filename]
+
+    def get(self, filename):
+        """
+        Return `(width, height), labels, boxes` of image `filename`.
+        """
+        i = self.get_index(filename)
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return (tuple(self.sizes[i]), self.classes[self.class_ids[start:end]],
+                np.asarray(self.boxes[start:end], dtype=np.int32))
+
+
+class _EncodedStrings():
+    """
+    Read-only sequence of strings stored as a single utf-8 buffer plus
+    offsets. Strings are only decoded when accessed.
+    """
+    def __init__(self, buffer, offsets):
+        self.buffer = buffer
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def _decode(self, i):
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return bytes(self.buffer[start:end]).decode("utf-8")
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                return np.array([self._decode(i)
+                                 for i in range(start, stop, step)],
+                                dtype=object)
+            # Copy the bytes of all strings at once, instead of one numpy
+            # slice per string
+            offsets = np.asarray(self.offsets[start:stop + 1]).tolist()
+            if len(offsets) < 2:
+                return np.array([], dtype=object)
+            buffer = bytes(self.buffer[offsets[0]:offsets[-1]])
+            base = offsets[0]
+            return np.array([buffer[begin - base:end - base].decode("utf-8")
+                             for begin, end in zip(offsets[:-1],
+                                                   offsets[1:])],
+                            dtype=object)
+        if index < 0:
+            index += len(self)
+        return self._decode(index)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self._decode(i)
+
+
+def _read_xml_file(xml_path):
+    filename, width, height, labels, boxes = read_xml_file(xml_path)
+    return [(filename, width, height, label) + box
+            for label, box in zip(labels, boxes)]
+
+
+def read_voc_dir(xml_dir, num_workers=None, chunk_size=256):
+    """
+    Read all *.xml files of PASCAL VOC format in `xml_dir` into a dataframe
+    with the same layout as csv files, using `num_workers` processes.
+    """
+    xml_paths = sorted(glob.glob(os.path.join(xml_dir, "*.xml")))
+    rows = []
+    if num_workers == 1:
+        for xml_path in xml_paths:
+            rows.extend(_read_xml_file(xml_path))
+    else:
+        with Pool(num_workers) as pool:
+            for xml_rows in pool.imap(_read_xml_file, xml_paths,
+                                      chunksize=chunk_size):
+                rows.extend(xml_rows)
+    return pd.DataFrame(rows, columns=CSV_COLS)
+
+
+@check_import([pa_imported], ["pyarrow"])
+def write_parquet(df, parquet_path, folder_col="folder"):
+    """Write a dataframe of annotations to a Parquet file with compact
+    dtypes: int32 sizes and coordinates, dictionary-encoded classes.
+
+    Rows are sorted by filename, so that min/max statistics of each row
+    group can be used to skip row groups when filtering by filename. If
+    `df` has a column `folder_col` (source folder of each image), each
+    folder is written to its own row group(s).
+    """
+    df = df.copy()
+    for col in ["width", "height"] + BBOX_COLS:
+        df[col] = df[col].astype(np.int32)
+    df["class"] = df["class"].astype("category")
+
+    with_folder = folder_col is not None and folder_col in df.columns
+    sort_cols = [folder_col, "filename"] if with_folder else ["filename"]
+    df = df.sort_values(sort_cols, kind="stable").reset_index(drop=True)
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    if not with_folder:
+        pq.write_table(table, parquet_path)
+        return
+
+    folders = df[folder_col].to_numpy()
+    boundaries = np.flatnonzero(folders[1:] != folders[:-1]) + 1
+    starts = np.append(0, boundaries)
+    ends = np.append(boundaries, len(df))
+    with pq.ParquetWriter(parquet_path, table.schema) as writer:
+        for start, end in zip(starts, ends):
+            writer.write_table(table.slice(start, end - start))
+
+
+def _to_arrow_filters(filters):
+    arrow_filters = []
+    for col, op, value in filters:
+        if op == "in":
+            value = list(value)
+        arrow_filters.append((col, op, value))
+    return arrow_filters
+
+
+@check_import([pa_imported], ["pyarrow"])
+def read_parquet(parquet_path, columns=None, filters=None):
+    """Read annotations from a Parquet file written by `write_parquet`.
+
+    Parameters
+    ----------
+    columns : list
+        Columns to read. If None, read all columns.
+    filters : list
+        List of `(column, op, value)` tuples, where `op` is one of `==`,
+        `!=`, `<`, `<=`, `>`, `>=`, `in`, `not in`. These are pushed down
+        to the reader, so row groups that cannot match are never read.
+
+    """
+    if filters:
+        filters = _to_arrow_filters(filters)
+    else:
+        filters = None
+    table = pq.read_table(parquet_path, columns=columns, filters=filters)
+    return table.to_pandas()
+
+
+def apply_filters(df, filters):
+    """
+    Filter rows of `df` given a list of `(column, op, value)` tuples, with
+    the same semantics as `read_parquet`.
+    """
+    mask = np.ones(df.shape[0], dtype=bool)
+    for col, op, value in filters:
+        if op == "in":
+            mask &= df[col].isin(value).to_numpy()
+        elif op == "not in":
+            mask &= ~df[col].isin(value).to_numpy()
+        else:
+            mask &= FILTER_OPS[op](df[col], value).to_numpy()
+    return df[mask]
+
+
+def is_store(path):
+    return os.path.isfile(os.path.join(path, STORE_META))
+
+
+def read_annotations(path, num_workers=None, filters=None):
+    """Read annotations into a dataframe with columns `filename, width,
+    height, class, xmin, ymin, xmax, ymax`.
+
+    Parameters
+    ----------
+    path : str
+        Path to either a csv file, a Parquet file (`*.parquet`), a directory
+        of an `AnnotationStore` or a directory of *.xml files of PASCAL VOC
+        format.
+    num_workers : int
+        Number of processes used to parse *.xml files.
+    filters : list
+        List of `(column, op, value)` tuples to select rows, e.g.
+        `[("class", "in", ["phone"])]`. See `read_parquet` for details. For
+        Parquet files, filters are pushed down to the reader.
+
+    """
+    if os.path.isdir(path):
+        if is_store(path):
+            df = AnnotationStore.load(path).to_dataframe()
+        else:
+            df = read_voc_dir(path, num_workers)
+    elif path.lower().endswith(".parquet"):
+        return read_parquet(path, filters=filters)
+    else:
+        df = pd.read_csv(path)
+
+    if filters:
+        df = apply_filters(df, filters)
+    return df
+
+
+def iter_annotations(path, chunk_size=1000000, num_workers=None):
+    """Read annotations by chunks of about `chunk_size` rows, so that tables
+    larger than memory can be processed. Same formats as `read_annotations`.
+    Note that bounding boxes of an image may span several chunks.
+
+    Returns
+    -------
+    generator
+        Yields dataframes with columns `filename, width, height, class,
+        xmin, ymin, xmax, ymax`.
+
+    """
+    if os.path.isdir(path):
+        if is_store(path):
+            # Only the rows of each chunk are read from the memory-map
+            store = AnnotationStore.load(path)
+            for start in range(0, len(store), chunk_size):
+                rows = np.arange(start, min(start + chunk_size, len(store)))
+                images = np.searchsorted(store.offsets, rows, side="right") - 1
+                first, last = images[0], images[-1] + 1
+                filenames = np.asarray(store.filenames[first:last],
+                                       dtype=object)
+                sizes = np.asarray(store.sizes[first:last])
+                local = images - first
+                df = pd.DataFrame({
+                    "filename": filenames[local],
+                    "width": sizes[local, 0],
+                    "height": sizes[local, 1],
+                    "class": store.classes[np.asarray(
+                        store.class_ids[rows[0]:rows[-1] + 1])]})
+                df[BBOX_COLS] = np.asarray(store.boxes[rows[0]:rows[-1] + 1],
+                                           dtype=np.int32)
+                yield df
+        else:
+            df = read_voc_dir(path, num_workers)
+            for start in range(0, len(df), chunk_size):
+                yield df.iloc[start:start + chunk_size]
+    elif path.lower().endswith(".parquet"):
+        yield from _iter_parquet(path, chunk_size)
+    else:
+        yield from pd.read_csv(path, chunksize=chunk_size)
+
+
+@check_import([pa_imported], ["pyarrow"])
+def _iter_parquet(parquet_path, chunk_size):
+    for batch in pq.ParquetFile(parquet_path).iter_batches(
+            batch_size=chunk_size):
+        yield batch.to_pandas()
+
+
+def write_annotations(df, path):
+    """
+    Write a dataframe of annotations to `path`, either as a csv file if
+    `path` ends with `.csv`, a Parquet file if `path` ends with `.parquet`,
+    or as an `AnnotationStore` directory otherwise.
+    """
+    if path.lower().endswith(".csv"):
+        df.to_csv(path, index=False)
+    elif path.lower().endswith(".parquet"):
+        write_parquet(df, path)
+    else:
+        AnnotationStore.from_dataframe(df).save(path)
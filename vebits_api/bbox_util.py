@@ -2,16 +2,16 @@ import numpy as np
 import pandas as pd
 
 from .others_util import raise_type_error, convert, assert_type
-from .xml_util import create_xml_file
+from .xml_util import create_xml_file, create_xml_files
 
 BBOX_COLS = ["xmin", "ymin", "xmax", "ymax"]
 
 
 def get_bboxes_array(data, bbox_cols=BBOX_COLS):
     if isinstance(data, pd.DataFrame):
-        return df.loc[:, bbox_cols].to_numpy(dtype=np.int32)
+        return data.loc[:, bbox_cols].to_numpy(dtype=np.int32)
     elif isinstance(data, pd.Series):
-        return df.loc[bbox_cols].to_numpy(dtype=np.int32)
+        return data.loc[bbox_cols].to_numpy(dtype=np.int32)
     elif isinstance(data, BBox) or isinstance(data, BBoxes):
         return data.to_xyxy_array()
     else:
@@ -42,23 +42,31 @@ def get_mask(boxes, scores, classes,
              classes_to_keep, confidence_threshold):
     score_mask = scores_mask(scores, confidence_threshold)
     if classes_to_keep != "all" and classes_to_keep is not None:
-        class_mask = classes_mask(classes, cls)
+        class_mask = classes_mask(classes, classes_to_keep)
         return score_mask * class_mask
     else:
         return score_mask
 
 
 def filter_boxes(boxes, scores, classes, classes_to_keep,
-                 confidence_threshold, img_size):
+                 confidence_threshold, img_size,
+                 box_format="normalized_yxyx"):
     """
-    This function is used to process bounding boxes returned by Tensorflow
-    Object Detection API only.
+    This function is used to process bounding boxes returned by detector
+    backends (see `detector_util.Backend`). By default, boxes are those of
+    Tensorflow Object Detection API, i.e. `ymin, xmin, ymax, xmax` relative
+    to `img_size`. If `box_format` is "pixel_xyxy", boxes are already
+    `xmin, ymin, xmax, ymax` in pixels and are only filtered.
     """
     mask = get_mask(boxes, scores, classes,
                     classes_to_keep, confidence_threshold)
     boxes = boxes[mask]
     scores = scores[mask]
     classes = classes[mask]
+    if box_format == "pixel_xyxy":
+        return boxes.astype(np.int32), scores, classes.astype(np.int32)
+    elif box_format != "normalized_yxyx":
+        raise ValueError("Unknown box format: {}".format(box_format))
     # Because `boxes` is of floating points with relative to image size,
     # we need to convert it back to coordinates.
     height, width = img_size
@@ -125,6 +133,97 @@ def iou(bbox_1, bbox_2):
         return _iou(bbox_1, bbox_2)
 
 
+def areas(boxes):
+    """
+    Vectorized version of `area`. Return areas of boxes of shape (n, 4) in
+    `xmin, ymin, xmax, ymax` format. Degenerate boxes have an area of 0.
+    """
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    return (np.clip(boxes[:, 2] - boxes[:, 0], 0, None)
+            * np.clip(boxes[:, 3] - boxes[:, 1], 0, None))
+
+
+def intersection_matrix(boxes_1, boxes_2):
+    """
+    Vectorized version of `intersection`, computing intersection areas of all
+    pairs of boxes of shape (n, 4) and (m, 4) in `xmin, ymin, xmax, ymax`
+    format. Return an array of shape (n, m).
+    """
+    boxes_1 = np.asarray(boxes_1, dtype=np.float64).reshape(-1, 4)
+    boxes_2 = np.asarray(boxes_2, dtype=np.float64).reshape(-1, 4)
+    xA = np.maximum(boxes_1[:, None, 0], boxes_2[None, :, 0])
+    yA = np.maximum(boxes_1[:, None, 1], boxes_2[None, :, 1])
+    xB = np.minimum(boxes_1[:, None, 2], boxes_2[None, :, 2])
+    yB = np.minimum(boxes_1[:, None, 3], boxes_2[None, :, 3])
+    return np.clip(xB - xA, 0, None) * np.clip(yB - yA, 0, None)
+
+
+def iou_matrix(boxes_1, boxes_2):
+    """Vectorized version of `iou`, computing IoU of all pairs of boxes.
+
+    Parameters
+    ----------
+    boxes_1 : array-like
+        Array of shape (n, 4) in `xmin, ymin, xmax, ymax` format.
+    boxes_2 : array-like
+        Array of shape (m, 4) in `xmin, ymin, xmax, ymax` format.
+
+    Returns
+    -------
+    ndarray
+        Array of shape (n, m). IoU is 0 when the union is empty.
+
+    """
+    inter = intersection_matrix(boxes_1, boxes_2)
+    union = areas(boxes_1)[:, None] + areas(boxes_2)[None, :] - inter
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(union > 0, inter / union, 0.0)
+
+
+def non_max_suppression(boxes, scores, iou_threshold=0.5, classes=None,
+                        max_output=None):
+    """Greedy non-maximum suppression: boxes are kept by decreasing score,
+    and each kept box suppresses the remaining boxes overlapping it by more
+    than `iou_threshold`.
+
+    Parameters
+    ----------
+    boxes : array-like
+        Array of shape (n, 4) in `xmin, ymin, xmax, ymax` format.
+    scores : array-like
+        Array of shape (n,).
+    iou_threshold : float
+    classes : array-like
+        Array of shape (n,). If specified, boxes only suppress boxes of the
+        same class.
+    max_output : int
+        If specified, maximum number of boxes kept.
+
+    Returns
+    -------
+    ndarray
+        Indices of kept boxes, by decreasing score.
+
+    """
+    scores = np.asarray(scores).reshape(-1)
+    order = np.argsort(-scores, kind="stable")
+    ious = iou_matrix(np.asarray(boxes).reshape(-1, 4)[order],
+                      np.asarray(boxes).reshape(-1, 4)[order])
+    if classes is not None:
+        classes = np.asarray(classes).reshape(-1)[order]
+        ious[classes[:, None] != classes[None, :]] = 0
+    suppressed = np.zeros(len(order), dtype=bool)
+    keep = []
+    for i in range(len(order)):
+        if suppressed[i]:
+            continue
+        keep.append(i)
+        if max_output is not None and len(keep) >= max_output:
+            break
+        suppressed |= ious[i] > iou_threshold
+    return order[keep]
+
+
 def boxes_padding_inverse(bboxes, img_size, img_size_orig):
     """This function is used to calculate the coordinates of the bounding boxes
     before its corresponding image is resized by `resize_padding` function given
@@ -156,6 +255,75 @@ def boxes_padding_inverse(bboxes, img_size, img_size_orig):
     return bboxes_orig
 
 
+def get_filename_index(df):
+    """Sort bounding boxes by filename once and compute the contiguous row
+    range of each image. This avoids boolean masking the whole dataframe
+    for every single image, which is O(images x rows).
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Dataframe of bounding boxes with a `filename` column.
+
+    Returns
+    -------
+    order : ndarray
+        Indices (positions) that sort `df` by filename. Rows of the same
+        filename keep their original relative order.
+    filenames : ndarray
+        Sorted unique filenames.
+    starts, ends : ndarray
+        Rows of `filenames[i]` are `df.iloc[order[starts[i]:ends[i]]]`.
+
+    """
+    codes, filenames = pd.factorize(df["filename"], sort=True)
+    order = np.argsort(codes, kind="stable")
+    ends = np.cumsum(np.bincount(codes, minlength=len(filenames)))
+    starts = ends - np.bincount(codes, minlength=len(filenames))
+    return order, np.asarray(filenames), starts, ends
+
+
+def df_to_xml_files(df, img_dir, dest_dir=None,
+                    num_workers=None, chunk_size=256, callback=None):
+    """Convert a dataframe of bounding boxes into *.xml files of PASCAL VOC
+    format, one per image. Columnar arrays are extracted once and the files
+    are written in parallel by chunk.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Dataframe with columns `filename, width, height, class, xmin, ymin,
+        xmax, ymax`.
+    img_dir : str
+        Directory to images, used to fill in the `path` field.
+    dest_dir : str
+        Directory to which all xml files will be saved. If None, `img_dir`
+        will be used.
+    num_workers : int
+        Number of processes to write files. If None, use all CPUs. If 1,
+        files will be written in the calling process.
+    chunk_size : int
+        Number of xml files written per task.
+    callback : callable
+        If specified, called with the number of xml files written by each
+        finished chunk. This is useful to track progress.
+
+    Returns
+    -------
+    int
+        Number of xml files written.
+
+    """
+    order, filenames, starts, ends = get_filename_index(df)
+    widths = df["width"].to_numpy()[order][starts]
+    heights = df["height"].to_numpy()[order][starts]
+    labels = df["class"].to_numpy()[order]
+    boxes = df.loc[:, BBOX_COLS].to_numpy(dtype=np.int32)[order]
+
+    return create_xml_files(filenames, widths, heights, labels, boxes,
+                            starts, ends, img_dir, dest_dir,
+                            num_workers, chunk_size, callback)
+
 
 class BBox():
     def __init__(self, label=None, bbox_array=None, bbox_series=None):
@@ -0,0 +1,109 @@
+"""Options shared by scripts to profile a run: `--profile` (cProfile),
+`--trace` (Chrome trace of stages timed by `timing_util`) and `--limit`
+(process a subset of inputs).
+
+Examples
+--------
+In a script:
+
+>>> def parse_arguments(argv):
+...     parser = argparse.ArgumentParser()
+...     ...
+...     cli_util.add_arguments(parser, limit=True)
+...     return parser.parse_args(argv)
+>>> if __name__ == '__main__':
+...     cli_util.run(main, parse_arguments(sys.argv[1:]))
+
+Scripts do not fork or install signal handlers for profiling, so a sampling
+profiler such as py-spy can also be attached to any run
+(`py-spy record -o profile.svg -- python script.py ...`).
+
+"""
+
+import sys
+import time
+import pstats
+import cProfile
+from itertools import islice
+
+from . import timing_util
+
+
+def add_arguments(parser, limit=False):
+    """
+    Add profiling options to an `argparse.ArgumentParser`. If `limit` is True,
+    also add `--limit`, which the script must pass to `limit_items`.
+    """
+    group = parser.add_argument_group("profiling")
+    group.add_argument('--profile', type=str, default=None,
+        help='If specified, profile the run with cProfile, dump statistics '
+             'to this path (readable by `pstats` or snakeviz) and print the '
+             'most expensive functions. Only the main thread is profiled.')
+    group.add_argument('--profile_top', type=int, default=30,
+        help='Number of functions printed with `--profile`.')
+    group.add_argument('--profile_sort', type=str, default='cumulative',
+        choices=['cumulative', 'tottime', 'ncalls'],
+        help='Sort order of functions printed with `--profile`.')
+    group.add_argument('--trace', type=str, default=None,
+        help='If specified, time processing stages (decode, inference, '
+             'write, ...) and write them as Chrome trace events to this '
+             'path, viewable in chrome://tracing or ui.perfetto.dev.')
+    if limit:
+        group.add_argument('--limit', type=int, default=None,
+            help='If specified, only process this many inputs (e.g. images '
+                 'or frames) from each source, to profile a representative '
+                 'subset of a run.')
+    return parser
+
+
+def limit_items(iterable, limit):
+    """
+    Return the first `limit` items of `iterable`, or `iterable` itself if
+    `limit` is None.
+    """
+    if limit is None:
+        return iterable
+    if isinstance(iterable, (list, tuple)):
+        return iterable[:limit]
+    return islice(iterable, limit)
+
+
+def run(main, args):
+    """
+    Call `main(args)`, profiled and/or traced according to options added by
+    `add_arguments`. Results are written even if `main` raises (e.g. on
+    KeyboardInterrupt), so that an interrupted run can still be diagnosed.
+    """
+    profile_path = getattr(args, "profile", None)
+    trace_path = getattr(args, "trace", None)
+
+    tracer = None
+    if trace_path is not None:
+        tracer = timing_util.ChromeTracer()
+        timing_util.TIMER.add_hook(tracer)
+        timing_util.enable()
+    profiler = None
+    if profile_path is not None:
+        profiler = cProfile.Profile()
+
+    start = time.perf_counter()
+    try:
+        if profiler is not None:
+            return profiler.runcall(main, args)
+        return main(args)
+    finally:
+        end = time.perf_counter()
+        if tracer is not None:
+            # Span of the whole run, so that stages can be seen in context
+            tracer("main", start, end)
+            timing_util.TIMER.remove_hook(tracer)
+            tracer.write(trace_path)
+            print(">>> Trace of {} spans written to {}{}".format(
+                len(tracer.events), trace_path,
+                "" if tracer.num_dropped == 0
+                else " ({} dropped)".format(tracer.num_dropped)))
+        if profiler is not None:
+            profiler.dump_stats(profile_path)
+            stats = pstats.Stats(profiler, stream=sys.stdout)
+            stats.sort_stats(args.profile_sort).print_stats(args.profile_top)
+            print(">>> Profile written to {}".format(profile_path))
@@ -3,15 +3,18 @@
 from . import bbox_util
 from . import im_util
 from . import labelmap_util
+from . import shm_util
+from . import timing_util
 from . import vis_util
-from .others_util import check_import
+from .others_util import check_import, get_classes
 
 import os
 import sys
 import time
-from threading import Thread, Lock
-from multiprocessing import Process
-from queue import Queue
+import atexit
+from threading import Thread, Lock, Event
+from multiprocessing import Process, get_context
+from queue import Queue, Empty
 from datetime import datetime
 from collections import defaultdict
 
@@ -36,10 +39,83 @@ from multiprocessing.pool import ThreadPool
 pool = ThreadPool()
 
 
-# Load Tensorflow inference graph into memory
 @check_import([tf_imported], ["tensorflow"])
-def load_inference_graph_tf(inference_graph_path):
-    # load frozen tensorflow model into memory
+def get_session_config(intra_op_threads=None, inter_op_threads=None,
+                       optimization_level=None, allow_growth=False,
+                       per_session_threads=False):
+    """Create a Tensorflow session configuration.
+
+    Parameters
+    ----------
+    intra_op_threads : int
+        Number of threads used to parallelize a single operation (e.g. a
+        convolution). If None, Tensorflow uses all cores, which competes with
+        threads decoding and encoding images.
+    inter_op_threads : int
+        Number of threads used to run independent operations in parallel.
+    optimization_level : int
+        Level of graph optimizations (constant folding, common subexpression
+        elimination, ...): 0 (`tf.OptimizerOptions.L1`, default) or -1
+        (`tf.OptimizerOptions.L0`, none). If None, use Tensorflow's default.
+    allow_growth : bool
+        Whether to allocate GPU memory as needed, instead of all at once.
+    per_session_threads : bool
+        Whether this session has its own thread pools. By default, thread
+        pools are global and sized by the first session created in the
+        process.
+
+    Returns
+    -------
+    tf.ConfigProto
+
+    """
+    config = tf.ConfigProto()
+    if intra_op_threads is not None:
+        config.intra_op_parallelism_threads = intra_op_threads
+    if inter_op_threads is not None:
+        config.inter_op_parallelism_threads = inter_op_threads
+    if optimization_level is not None:
+        config.graph_options.optimizer_options.opt_level = optimization_level
+    config.gpu_options.allow_growth = allow_growth
+    config.use_per_session_threads = per_session_threads
+    return config
+
+
+@check_import([tf_imported], ["tensorflow"])
+def warm_up(tensors, shapes=((1, 480, 640, 3),), num_runs=1):
+    """Run a Tensorflow model on dummy batches, so that memory allocation and
+    kernel selection happen before real inputs arrive. The first run of a
+    session is usually several times slower than the following ones.
+
+    Parameters
+    ----------
+    tensors : dict
+        Tensors returned by `load_inference_graph_tf`.
+    shapes : list of tuple
+        Shapes `(batch_size, height, width, 3)` of batches expected, each of
+        which is run `num_runs` times.
+
+    Returns
+    -------
+    float
+        Warm-up time in seconds.
+
+    """
+    start = time.perf_counter()
+    with timing_util.stage("warm_up"):
+        for shape in shapes:
+            imgs = np.zeros(shape, dtype=np.uint8)
+            for _ in range(num_runs):
+                detect_objects_tf(imgs, tensors)
+    return time.perf_counter() - start
+
+
+@check_import([tf_imported], ["tensorflow"])
+def load_graph_tf(inference_graph_path):
+    """
+    Load a frozen Tensorflow inference graph into a `tf.Graph`, which can be
+    shared by several sessions (see `create_session_tf`).
+    """
     detection_graph = tf.Graph()
     with detection_graph.as_default():
         od_graph_def = tf.GraphDef()
@@ -47,7 +123,18 @@ def load_inference_graph_tf(inference_graph_path):
             serialized_graph = fid.read()
             od_graph_def.ParseFromString(serialized_graph)
             tf.import_graph_def(od_graph_def, name='')
-        sess = tf.Session(graph=detection_graph)
+    return detection_graph
+
+
+@check_import([tf_imported], ["tensorflow"])
+def create_session_tf(detection_graph, session_config=None):
+    """
+    Create a session of a graph loaded by `load_graph_tf`. Return the
+    session and tensors used for making inference.
+    """
+    if isinstance(session_config, dict):
+        session_config = get_session_config(**session_config)
+    sess = tf.Session(graph=detection_graph, config=session_config)
 
     image_tensor = detection_graph.get_tensor_by_name('image_tensor:0')
     detection_boxes = detection_graph.get_tensor_by_name('detection_boxes:0')
@@ -64,6 +151,74 @@ def load_inference_graph_tf(inference_graph_path):
         "detection_classes": detection_classes,
         "num_detections": num_detections
     }
+    return tensors
+
+
+# Load Tensorflow inference graph into memory
+@check_import([tf_imported], ["tensorflow"])
+def load_inference_graph_tf(inference_graph_path, session_config=None,
+                            warm_up_shapes=None, verbose=True,
+                            num_sessions=1, num_processes=0):
+    """Load a frozen Tensorflow Object Detection API inference graph.
+
+    Parameters
+    ----------
+    inference_graph_path : str
+    session_config : tf.ConfigProto or dict
+        Session configuration, or keyword arguments of `get_session_config`.
+        If None, use Tensorflow's defaults.
+    warm_up_shapes : list of tuple
+        If not None, warm up the session with dummy batches of these shapes
+        (see `warm_up`).
+    verbose : bool
+        Whether to print loading and warm-up times.
+    num_sessions : int
+        If greater than 1, load a `ModelPool` of this many sessions, among
+        which each batch is split. `session_config` must then be None or a
+        dictionary.
+    num_processes : int
+        If greater than 0, load a `ModelProcessPool` of this many worker
+        processes instead, among which each batch is split. The first shape
+        of `warm_up_shapes` is then required, and is the largest batch
+        shape.
+
+    Returns
+    -------
+    tensors : dict
+        Session, tensors used for making inference (or `model_pool`), as well
+        as `load_time` and `warm_up_time` in seconds.
+
+    """
+    if num_processes > 0:
+        if warm_up_shapes is None:
+            raise ValueError("`warm_up_shapes` is required to allocate shared "
+                             "memory of worker processes.")
+        pool = ModelProcessPool(inference_graph_path, warm_up_shapes[0],
+                                num_processes, session_config)
+        if verbose:
+            print(">>> Loaded {} in {} processes in {:.2f}s (warm-up: "
+                  "{:.2f}s)".format(inference_graph_path, num_processes,
+                                    pool.load_time, pool.warm_up_time))
+        return {"model_pool": pool, "load_time": pool.load_time,
+                "warm_up_time": pool.warm_up_time}
+
+    start = time.perf_counter()
+    # load frozen tensorflow model into memory
+    detection_graph = load_graph_tf(inference_graph_path)
+    if num_sessions > 1:
+        tensors = {"model_pool": ModelPool(detection_graph, num_sessions,
+                                           session_config=session_config)}
+    else:
+        tensors = create_session_tf(detection_graph, session_config)
+    tensors["load_time"] = time.perf_counter() - start
+
+    tensors["warm_up_time"] = 0.0
+    if warm_up_shapes is not None:
+        tensors["warm_up_time"] = warm_up(tensors, warm_up_shapes)
+    if verbose:
+        print(">>> Loaded {} in {:.2f}s (warm-up: {:.2f}s)".format(
+            inference_graph_path, tensors["load_time"],
+            tensors["warm_up_time"]))
 
     return tensors
 
@@ -100,9 +255,10 @@ def load_inference_graph_yolo(inference_graph_path, meta_path,
 
 
 # Load a frozen infrerence graph into memory
-@check_import([tf_imported, df_imported], ["tensorflow", "darkflow"])
 def load_inference_graph(inference_graph_path, meta_path=None,
-                         gpu_usage=0.95, confidence_threshold=0.5):
+                         gpu_usage=0.95, confidence_threshold=0.5,
+                         session_config=None, warm_up_shapes=None,
+                         num_sessions=1, num_processes=0):
     """Interface to load either Tensorflow or Darknet's YOLO inference graph
     into memory.
 
@@ -117,6 +273,12 @@ def load_inference_graph(inference_graph_path, meta_path=None,
         Used for YOLO graph when meta_path is specified. 95% of GPU memory
         will be used by default.
     confidence_threshold: float
+    session_config : tf.ConfigProto or dict
+        Used for Tensorflow graph. See `load_inference_graph_tf`.
+    warm_up_shapes : list of tuple
+        Used for Tensorflow graph. See `load_inference_graph_tf`.
+    num_sessions, num_processes : int
+        Used for Tensorflow graph. See `load_inference_graph_tf`.
 
     Returns
     -------
@@ -125,17 +287,22 @@ def load_inference_graph(inference_graph_path, meta_path=None,
 
     """
     if meta_path is None:
-        return load_inference_graph_tf(inference_graph_path)
+        return load_inference_graph_tf(inference_graph_path, session_config,
+                                       warm_up_shapes,
+                                       num_sessions=num_sessions,
+                                       num_processes=num_processes)
     else:
         return load_inference_graph_yolo(inference_graph_path,
                                          meta_path, gpu_usage,
                                          confidence_threshold)
 
 
-@check_import([tf_imported, df_imported], ["tensorflow", "darkflow"])
 def load_tensors(inference_graph_path, labelmap_path,
                  num_classes=None, meta_path=None,
-                 gpu_usage=0.95, confidence_threshold=0.5):
+                 gpu_usage=0.95, confidence_threshold=0.5,
+                 session_config=None, warm_up_shapes=None,
+                 num_sessions=1, num_processes=0,
+                 backend=None, backend_kwargs=None):
     """Interface to load either Tensorflow or Darknet's YOLO inference graph as
     well as other information such as label map into memory.
 
@@ -152,6 +319,17 @@ def load_tensors(inference_graph_path, labelmap_path,
         If not None, YOLO inference graph will be loaded.
     confidence_threshold: float
         Confidence threshold.
+    session_config : tf.ConfigProto or dict
+        Used for Tensorflow graph. See `load_inference_graph_tf`.
+    warm_up_shapes : list of tuple
+        Used for Tensorflow graph. See `load_inference_graph_tf`.
+    num_sessions, num_processes : int
+        Used for Tensorflow graph. See `load_inference_graph_tf`.
+    backend : str
+        If specified, load the model with this registered backend (see
+        `load_backend`) instead, with `meta_path` as its config path and
+        `backend_kwargs` as its options. Other options are then ignored.
+    backend_kwargs : dict
 
     Returns
     -------
@@ -159,8 +337,15 @@ def load_tensors(inference_graph_path, labelmap_path,
         List of tensors used for making inference.
 
     """
-    tensors = load_inference_graph(inference_graph_path, meta_path,
-                                   gpu_usage, confidence_threshold)
+    if backend is None:
+        tensors = load_inference_graph(inference_graph_path, meta_path,
+                                       gpu_usage, confidence_threshold,
+                                       session_config, warm_up_shapes,
+                                       num_sessions, num_processes)
+    else:
+        tensors = {"backend": load_backend(backend, inference_graph_path,
+                                           meta_path,
+                                           **(backend_kwargs or {}))}
     labelmap_dict = labelmap_util.get_label_map_dict(labelmap_path)
     labelmap_dict_inverse = labelmap_util.get_label_map_dict_inverse(
         labelmap_dict)
@@ -179,6 +364,8 @@ def load_tensors(inference_graph_path, labelmap_path,
 
 @check_import([tf_imported], ["tensorflow"])
 def detect_objects_tf(imgs, tensors):
+    if "model_pool" in tensors:
+        return tensors["model_pool"].detect_objects(imgs)
     sess = tensors["sess"]
     image_tensor = tensors["image_tensor"]
     detection_boxes = tensors["detection_boxes"]
@@ -273,30 +460,967 @@ def process_box(box, img_size_feed, img_size_orig, threshold):
     return None
 
 
-@check_import([tf_imported, df_imported], ["tensorflow", "darkflow"])
 def detect_objects(img, tensors):
+    """
+    Detect objects on an image or a batch of images with the backend of
+    `tensors` (see `get_backend`). Boxes are in the format of the backend
+    (see `Backend.box_format`).
+    """
     dims = img.ndim
     if dims == 3:
         img = np.expand_dims(img, axis=0)
-    # Detect by yolo
-    if "yolo_net" in tensors:
-        boxes, scores, classes = detect_objects_yolo(img, tensors)
-    # Detect by Tensorflow API
-    else:
-        boxes, scores, classes = detect_objects_tf(img, tensors)
+    boxes, scores, classes = get_backend(tensors).detect_objects(img)
     if dims == 3:
         return boxes[0], scores[0], classes[0]
     else:
         return boxes, scores, classes
 
 
+class ModelPool():
+    """Several sessions of the same frozen Tensorflow graph, each with its own
+    intra-op thread pool, among which batches are load-balanced. On machines
+    with many cores, a few sessions with fewer threads each are usually
+    faster than a single session, whose operations do not scale to all
+    cores. See `scripts/tune_model_pool.py` to choose the number of sessions
+    and threads.
+
+    Sessions share the same `tf.Graph`, so the graph is parsed and stored
+    only once. `sess.run` is thread-safe and releases the GIL, so sessions
+    are run from threads.
+
+    Parameters
+    ----------
+    graph : str or tf.Graph
+        Path to a frozen inference graph, or a graph loaded by
+        `load_graph_tf`.
+    num_sessions : int
+    intra_op_threads : int
+        Number of threads of each session. If None, use that of
+        `session_config`, or divide cores evenly among sessions.
+    inter_op_threads : int
+    session_config : dict
+        Other keyword arguments of `get_session_config`. Thread options
+        override those of `session_config`.
+
+    Examples
+    --------
+    >>> pool = ModelPool(inference_graph_path, num_sessions=4)
+    >>> boxes, scores, classes = pool.detect_objects(imgs)
+    >>> for boxes, scores, classes in pool.map(batches):
+    ...     pass
+
+    """
+    @check_import([tf_imported], ["tensorflow"])
+    def __init__(self, graph, num_sessions=2, intra_op_threads=None,
+                 inter_op_threads=None, session_config=None):
+        if isinstance(graph, str):
+            graph = load_graph_tf(graph)
+        session_config = dict(session_config or {})
+        if intra_op_threads is None:
+            intra_op_threads = session_config.get("intra_op_threads")
+        if intra_op_threads is None:
+            intra_op_threads = max(1, (os.cpu_count() or 1) // num_sessions)
+        if inter_op_threads is None:
+            inter_op_threads = session_config.get("inter_op_threads")
+        config = dict(session_config, intra_op_threads=intra_op_threads,
+                      inter_op_threads=inter_op_threads,
+                      per_session_threads=True)
+
+        self.graph = graph
+        self.num_sessions = num_sessions
+        self.intra_op_threads = intra_op_threads
+        self.sessions = [create_session_tf(graph, config)
+                         for _ in range(num_sessions)]
+        # Sessions not running. Each call takes one, so that sessions are
+        # shared by all threads using the pool.
+        self.idle = Queue()
+        for tensors in self.sessions:
+            self.idle.put(tensors)
+        self.pool = ThreadPool(num_sessions)
+
+    def __len__(self):
+        return self.num_sessions
+
+    def _run(self, imgs):
+        tensors = self.idle.get()
+        try:
+            return detect_objects_tf(imgs, tensors)
+        finally:
+            self.idle.put(tensors)
+
+    def detect_objects(self, imgs):
+        """
+        Detect objects on a batch of images, split into one chunk per
+        session. Return boxes, scores and classes as `detect_objects_tf`.
+        """
+        num_chunks = min(self.num_sessions, len(imgs))
+        if num_chunks <= 1:
+            return self._run(imgs)
+        results = self.pool.map(self._run, np.array_split(imgs, num_chunks))
+        boxes, scores, classes = zip(*results)
+        return (np.concatenate(boxes), np.concatenate(scores),
+                np.concatenate(classes))
+
+    def map(self, batches):
+        """
+        Detect objects on an iterable of batches, each run as a whole by the
+        next idle session. Yield `(boxes, scores, classes)` of each batch, in
+        order.
+        """
+        return self.pool.imap(self._run, batches)
+
+    def close(self):
+        self.pool.close()
+        for tensors in self.sessions:
+            tensors["sess"].close()
+
+
+def run_model_worker(worker_id, inference_graph_path, session_config,
+                     warm_up_shapes, inputs, results, tasks, outcomes):
+    """
+    Target of processes of `ModelProcessPool`. Load a session, then detect
+    objects on batches in slots of `inputs` given by `tasks`, and write
+    boxes, scores and classes to the same slots of `results`.
+    """
+    try:
+        tensors = load_inference_graph_tf(inference_graph_path,
+                                          session_config, warm_up_shapes,
+                                          verbose=False)
+    except Exception as e:
+        outcomes.put(("failed", worker_id, repr(e)))
+        return
+    outcomes.put(("ready", worker_id,
+                  (tensors["load_time"], tensors["warm_up_time"])))
+    max_detections = results.shape[2]
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        task_id, slot, num_imgs = task
+        try:
+            boxes, scores, classes = detect_objects_tf(
+                inputs.array[slot, :num_imgs], tensors)
+            num_detections = min(boxes.shape[1], max_detections)
+            result = results.array[slot]
+            result[:num_imgs, :num_detections, :4] = \
+                boxes[:, :num_detections]
+            result[:num_imgs, :num_detections, 4] = \
+                scores[:, :num_detections]
+            result[:num_imgs, :num_detections, 5] = \
+                classes[:, :num_detections]
+            outcomes.put(("done", task_id, num_detections))
+        except Exception as e:
+            outcomes.put(("error", task_id, repr(e)))
+    tensors["sess"].close()
+    inputs.close()
+    results.close()
+
+
+class ModelProcessPool():
+    """Worker processes, each owning a session of the same frozen Tensorflow
+    graph, so that Tensorflow and post-processing in the parent process do
+    not share one GIL. Batches are written to shared memory slots, and
+    workers write boxes, scores and classes to a preallocated shared result
+    buffer, so that neither images nor results are pickled. Idle workers take
+    the next batch, which balances the load.
+
+    Workers are started with the "spawn" method, since Tensorflow is not
+    fork-safe, and load their session in parallel.
+
+    Parameters
+    ----------
+    inference_graph_path : str
+    input_shape : tuple
+        `(max_batch_size, height, width, 3)`: images must be of this size.
+        Larger batches are split.
+    num_workers : int
+    session_config : dict
+        Keyword arguments of `get_session_config` for each worker. If
+        `intra_op_threads` is not specified, cores are divided evenly among
+        workers.
+    max_detections : int
+        Maximum number of detections per image returned.
+    warm_up : bool
+        Whether workers warm up with a batch of `input_shape`.
+    check_interval : float
+        Interval in seconds at which workers are checked to be alive while
+        waiting for them. If a worker dies (e.g. killed for lack of memory),
+        the pool is broken: waiting and later tasks raise RuntimeError.
+
+    Examples
+    --------
+    >>> pool = ModelProcessPool(inference_graph_path, (8, 480, 640, 3))
+    >>> boxes, scores, classes = pool.detect_objects(imgs)
+    >>> pool.close()
+
+    """
+    @check_import([tf_imported], ["tensorflow"])
+    def __init__(self, inference_graph_path, input_shape, num_workers=2,
+                 session_config=None, max_detections=100, warm_up=True,
+                 check_interval=1.0):
+        session_config = dict(session_config or {})
+        if session_config.get("intra_op_threads") is None:
+            session_config["intra_op_threads"] = max(
+                1, (os.cpu_count() or 1) // num_workers)
+        self.input_shape = tuple(input_shape)
+        self.max_batch_size = self.input_shape[0]
+        self.num_workers = num_workers
+        self.check_interval = check_interval
+        # Two slots per worker, so that a batch can be written while the
+        # previous one is processed
+        # Slots are only acquired and released by this process
+        num_slots = 2 * num_workers
+        self.inputs = shm_util.SharedArray((num_slots,) + self.input_shape,
+                                           np.uint8)
+        self.free_slots = Queue()
+        for slot in range(num_slots):
+            self.free_slots.put(slot)
+        # Each detection is stored as `ymin, xmin, ymax, xmax, score, class`
+        self.results = shm_util.SharedArray(
+            (num_slots, self.max_batch_size, max_detections, 6), np.float32)
+
+        context = get_context("spawn")
+        self.tasks = context.Queue()
+        self.outcomes = context.Queue()
+        self.closed = False
+        # Outcomes are dispatched to callers waiting for their task by a
+        # collector thread, so that the pool can be used from many threads
+        self._lock = Lock()
+        self._waiting = {}
+        self._num_tasks = 0
+        # Set when a worker died, after which no task can complete
+        self.error = None
+        self.collector = None
+        # Make sure that workers are stopped and shared memory is freed
+        atexit.register(self.close)
+        warm_up_shapes = [self.input_shape] if warm_up else None
+        self.processes = [
+            context.Process(target=run_model_worker,
+                            args=(i, inference_graph_path, session_config,
+                                  warm_up_shapes, self.inputs, self.results,
+                                  self.tasks, self.outcomes),
+                            name="model_worker_{}".format(i), daemon=True)
+            for i in range(num_workers)]
+        for process in self.processes:
+            process.start()
+
+        # Wait until all workers are ready
+        self.load_time, self.warm_up_time = 0.0, 0.0
+        for _ in range(num_workers):
+            outcome = self._get_outcome()
+            if outcome is None:
+                self.close()
+                raise self.error
+            status, worker_id, info = outcome
+            if status == "failed":
+                self.close()
+                raise RuntimeError("Model worker {} failed to load: "
+                                   "{}".format(worker_id, info))
+            self.load_time = max(self.load_time, info[0])
+            self.warm_up_time = max(self.warm_up_time, info[1])
+
+        self.collector = Thread(target=self._collect, daemon=True)
+        self.collector.start()
+
+    def __len__(self):
+        return self.num_workers
+
+    def _get_outcome(self):
+        """
+        Wait for the next outcome of workers, checking regularly that they
+        are all alive. If one died, set `error` and return None.
+        """
+        while True:
+            try:
+                return self.outcomes.get(timeout=self.check_interval)
+            except Empty:
+                if self.closed:
+                    # Workers are being stopped on purpose
+                    continue
+                for process in self.processes:
+                    if not process.is_alive():
+                        self.error = RuntimeError(
+                            "Model worker {} died with exit code {}".format(
+                                process.name, process.exitcode))
+                        return None
+
+    def _fail_waiting(self, error):
+        """
+        Fail all tasks still waiting for their outcome with `error`.
+        """
+        with self._lock:
+            tasks = [task for task in self._waiting.values()
+                     if len(task) == 3]
+        for task in tasks:
+            event, slot = task[:2]
+            task.append(error)
+            self.free_slots.put(slot)
+            event.set()
+
+    def _collect(self):
+        while True:
+            outcome = self._get_outcome()
+            if outcome is None:
+                if self.error is not None:
+                    self._fail_waiting(self.error)
+                break
+            status, task_id, info = outcome
+            with self._lock:
+                task = self._waiting[task_id]
+            event, slot, num_imgs = task[:3]
+            if status == "done":
+                # Copy results out, which are small, so that the slot can be
+                # reused right away
+                result = self.results.array[slot, :num_imgs, :info]
+                task.append((result[..., :4].copy(), result[..., 4].copy(),
+                             result[..., 5].astype(np.int32)))
+            else:
+                task.append(RuntimeError("Model worker failed: "
+                                         "{}".format(info)))
+            self.free_slots.put(slot)
+            event.set()
+
+    def submit(self, imgs):
+        """
+        Write a batch of at most `max_batch_size` images to a free slot and
+        queue it for detection. Block until a slot is free. Return the ID
+        of the task, to be passed to `result`.
+        """
+        if len(imgs) > self.max_batch_size:
+            raise ValueError("Batch of {} images is larger than the maximum "
+                             "batch size {}".format(len(imgs),
+                                                    self.max_batch_size))
+        if tuple(imgs.shape[1:]) != self.input_shape[1:]:
+            raise ValueError("Images must be of shape {}, got shape {} "
+                             "instead".format(self.input_shape[1:],
+                                              imgs.shape[1:]))
+        if self.error is not None:
+            raise self.error
+        slot = self.free_slots.get()
+        self.inputs.array[slot, :len(imgs)] = imgs
+        event = Event()
+        with self._lock:
+            if self.error is not None:
+                self.free_slots.put(slot)
+                raise self.error
+            task_id = self._num_tasks
+            self._num_tasks += 1
+            self._waiting[task_id] = [event, slot, len(imgs)]
+        self.tasks.put((task_id, slot, len(imgs)))
+        return task_id
+
+    def result(self, task_id):
+        """
+        Wait for the batch submitted as `task_id` and return its boxes,
+        scores and classes.
+        """
+        with self._lock:
+            event = self._waiting[task_id][0]
+        event.wait()
+        with self._lock:
+            outcome = self._waiting.pop(task_id)[3]
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    def detect_objects(self, imgs):
+        """
+        Detect objects on a batch of images, split among workers. Return
+        boxes, scores and classes as `detect_objects_tf`.
+        """
+        num_chunks = max(min(self.num_workers, len(imgs)),
+                         -(-len(imgs) // self.max_batch_size))
+        task_ids = [self.submit(chunk)
+                    for chunk in np.array_split(imgs, num_chunks)]
+        results = [self.result(task_id) for task_id in task_ids]
+        if len(results) == 1:
+            return results[0]
+        boxes, scores, classes = zip(*results)
+        return (np.concatenate(boxes), np.concatenate(scores),
+                np.concatenate(classes))
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        for _ in self.processes:
+            self.tasks.put(None)
+        for process in self.processes:
+            if process.pid is None:
+                continue
+            process.join(timeout=10)
+            if process.is_alive():
+                process.terminate()
+        if self.collector is not None:
+            self.outcomes.put(None)
+            self.collector.join()
+        # Callers still waiting would otherwise block forever
+        self._fail_waiting(RuntimeError("Model process pool closed"))
+        self.inputs.close()
+        self.results.close()
+
+
+# Registry of detector backends, by name
+BACKENDS = {}
+
+
+def register_backend(name):
+    """
+    Class decorator registering a subclass of `Backend` under `name`, so that
+    it can be loaded by `load_backend(name, ...)` and selected by scripts.
+    """
+    def wrapper(cls):
+        if name in BACKENDS:
+            raise ValueError("Backend {} is already registered.".format(name))
+        cls.name = name
+        BACKENDS[name] = cls
+        return cls
+    return wrapper
+
+
+def load_backend(name, model_path, config_path=None, **kwargs):
+    """Load a registered backend.
+
+    Parameters
+    ----------
+    name : str
+        Name of the backend, e.g. "tf" or "yolo". See `BACKENDS`.
+    model_path : str
+        Path to the model, e.g. a frozen inference graph.
+    config_path : str
+        Path to a file describing the model, if the backend needs one (e.g.
+        the meta file of Darkflow).
+    **kwargs
+        Options of the backend. See `load` of each backend.
+
+    Returns
+    -------
+    Backend
+
+    """
+    if name not in BACKENDS:
+        raise ValueError("Unknown backend: {}. Registered backends: "
+                         "{}.".format(name, ", ".join(sorted(BACKENDS))))
+    return BACKENDS[name].load(model_path, config_path, **kwargs)
+
+
+class Backend():
+    """Common batch interface of detector backends. Detection is split into
+    `preprocess` (e.g. resizing and normalization), `infer` (running the
+    model) and `postprocess` (e.g. decoding outputs into boxes), each timed as
+    a stage named after the backend (e.g. "tf.infer"), so that backends can be
+    profiled and compared on the same inputs.
+
+    Subclasses are registered with `register_backend` and implement `load`
+    and `infer`, and `preprocess` and `postprocess` if needed.
+
+    Attributes
+    ----------
+    name : str
+        Name under which the backend is registered.
+    box_format : str
+        Format of boxes returned by `detect_objects`: "normalized_yxyx"
+        (`ymin, xmin, ymax, xmax` relative to image size, as returned by
+        Tensorflow Object Detection API) or "pixel_xyxy" (`xmin, ymin, xmax,
+        ymax` in pixels). Classes start from 1 in both cases.
+    tensors : dict
+        Objects needed for making inference, e.g. a session.
+
+    """
+    name = None
+    box_format = "normalized_yxyx"
+
+    def __init__(self, tensors):
+        self.tensors = tensors
+
+    @classmethod
+    def load(cls, model_path, config_path=None, **kwargs):
+        raise NotImplementedError
+
+    def preprocess(self, imgs):
+        """
+        Return inputs of `infer` from a batch of images of shape
+        (batch_size, height, width, 3).
+        """
+        return imgs
+
+    def infer(self, inputs):
+        raise NotImplementedError
+
+    def postprocess(self, outputs, imgs):
+        """
+        Return `boxes, scores, classes` of each image of `imgs` from outputs
+        of `infer`.
+        """
+        return outputs
+
+    def detect_objects(self, imgs):
+        with timing_util.stage(self.name + ".preprocess"):
+            inputs = self.preprocess(imgs)
+        with timing_util.stage(self.name + ".infer"):
+            outputs = self.infer(inputs)
+        with timing_util.stage(self.name + ".postprocess"):
+            return self.postprocess(outputs, imgs)
+
+    def close(self):
+        """
+        Release resources held by the backend, e.g. worker processes.
+        """
+        pass
+
+
+@register_backend("tf")
+class TFBackend(Backend):
+    """Tensorflow Object Detection API frozen graph, run by a single session,
+    a `ModelPool` or a `ModelProcessPool`. The graph resizes and decodes
+    images itself, so `preprocess` and `postprocess` do nothing.
+    """
+    box_format = "normalized_yxyx"
+
+    @classmethod
+    @check_import([tf_imported], ["tensorflow"])
+    def load(cls, model_path, config_path=None, **kwargs):
+        """
+        See `load_inference_graph_tf` for `kwargs`. `config_path` is unused.
+        """
+        return cls(load_inference_graph_tf(model_path, **kwargs))
+
+    def infer(self, inputs):
+        return detect_objects_tf(inputs, self.tensors)
+
+    def close(self):
+        if "model_pool" in self.tensors:
+            self.tensors["model_pool"].close()
+
+
+@register_backend("yolo")
+class YOLOBackend(Backend):
+    """Darkflow's YOLO graph. Images are letterboxed and detections are
+    filtered by the confidence threshold given at loading time.
+    """
+    box_format = "pixel_xyxy"
+
+    @classmethod
+    @check_import([df_imported], ["darkflow"])
+    def load(cls, model_path, config_path=None, **kwargs):
+        """
+        `config_path` is the meta file generated by using option `--savepb`
+        of Darkflow. See `load_inference_graph_yolo` for `kwargs`.
+        """
+        return cls(load_inference_graph_yolo(model_path, config_path,
+                                             **kwargs))
+
+    def infer(self, inputs):
+        return detect_objects_yolo(inputs, self.tensors)
+
+
+def read_darknet_input_size(cfg_path):
+    """
+    Return `(height, width)` of the input of a network from the `[net]`
+    section of its Darknet cfg file.
+    """
+    size = {}
+    section = None
+    with open(cfg_path) as f:
+        for line in f:
+            line = line.split("#")[0].strip()
+            if line.startswith("["):
+                section = line
+            elif section == "[net]" and "=" in line:
+                key, value = [s.strip() for s in line.split("=", 1)]
+                if key in ("height", "width"):
+                    size[key] = int(value)
+    return size.get("height", 416), size.get("width", 416)
+
+
+@register_backend("cv2_dnn")
+class CV2DNNBackend(Backend):
+    """OpenCV DNN module running Darknet's YOLO cfg/weights or Tensorflow
+    Object Detection API frozen graphs on CPU, without Tensorflow or
+    Darkflow. Images of a batch are converted at once by
+    `cv2.dnn.blobFromImages` and run in a single forward pass.
+
+    Parameters
+    ----------
+    net : cv2.dnn_Net
+    framework : str
+        "darknet" or "tensorflow", which determines how outputs are decoded.
+    input_size : tuple
+        `(height, width)` to which images are resized.
+    scale : float
+        Multiplier of pixel values. If None, 1/255 for Darknet and 1 for
+        Tensorflow (whose graphs normalize images themselves).
+    confidence_threshold : float
+        Detections with lower scores are discarded before non-max
+        suppression. Keep it at most the threshold used to filter boxes
+        afterwards.
+    nms_threshold : float
+        IoU threshold of non-max suppression of YOLO detections. Tensorflow
+        graphs apply non-max suppression themselves.
+    max_detections : int
+        Number of detections returned per image. Outputs are padded with
+        zero scores, as those of Tensorflow Object Detection API.
+
+    """
+    box_format = "pixel_xyxy"
+
+    def __init__(self, net, framework, input_size, scale=None,
+                 confidence_threshold=0.25, nms_threshold=0.45,
+                 max_detections=100):
+        Backend.__init__(self, {"net": net})
+        if framework not in ("darknet", "tensorflow"):
+            raise ValueError("Unknown framework: {}".format(framework))
+        self.net = net
+        self.framework = framework
+        self.input_size = tuple(input_size)
+        if scale is None:
+            scale = 1 / 255. if framework == "darknet" else 1.
+        self.scale = scale
+        self.confidence_threshold = confidence_threshold
+        self.nms_threshold = nms_threshold
+        self.max_detections = max_detections
+        if framework == "darknet":
+            self.output_names = net.getUnconnectedOutLayersNames()
+        else:
+            self.output_names = None
+
+    @classmethod
+    def load(cls, model_path, config_path=None, input_size=None, **kwargs):
+        """Load a network with `cv2.dnn.readNet`.
+
+        Parameters
+        ----------
+        model_path : str
+            Darknet weights (`*.weights`) or Tensorflow frozen graph
+            (`*.pb`).
+        config_path : str
+            Darknet cfg file (required), or text graph of a Tensorflow
+            Object Detection API model generated by OpenCV's
+            `tf_text_graph_*.py` scripts.
+        input_size : tuple
+            `(height, width)` of inputs. If None, read from the cfg file for
+            Darknet, and (300, 300) (SSD's default) for Tensorflow.
+        **kwargs
+            See `CV2DNNBackend`.
+
+        """
+        if model_path.endswith(".weights"):
+            framework = "darknet"
+            if config_path is None:
+                raise ValueError("Darknet models need a cfg file.")
+            if input_size is None:
+                input_size = read_darknet_input_size(config_path)
+        else:
+            framework = "tensorflow"
+            if input_size is None:
+                input_size = (300, 300)
+        net = cv2.dnn.readNet(model_path, config_path or "")
+        net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+        net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+        return cls(net, framework, input_size, **kwargs)
+
+    def preprocess(self, imgs):
+        height, width = self.input_size
+        # Images are read by OpenCV in BGR order, while both kinds of models
+        # are trained on RGB images
+        return cv2.dnn.blobFromImages(list(imgs), self.scale, (width, height),
+                                      swapRB=True, crop=False)
+
+    def infer(self, inputs):
+        self.net.setInput(inputs)
+        if self.output_names is None:
+            return self.net.forward()
+        return self.net.forward(self.output_names)
+
+    def _decode_darknet(self, outputs, i, num_imgs):
+        rows = np.concatenate([
+            output.reshape(num_imgs, -1, output.shape[-1])[i]
+            for output in outputs])
+        class_scores = rows[:, 5:]
+        classes = class_scores.argmax(axis=1)
+        scores = class_scores[np.arange(len(rows)), classes]
+        mask = scores > self.confidence_threshold
+        rows, scores, classes = rows[mask], scores[mask], classes[mask]
+        # Centers and sizes are relative to the (stretched) input
+        boxes = np.concatenate([rows[:, :2] - rows[:, 2:4] / 2,
+                                rows[:, :2] + rows[:, 2:4] / 2], axis=1)
+        keep = bbox_util.non_max_suppression(boxes, scores,
+                                             self.nms_threshold, classes,
+                                             self.max_detections)
+        # This API uses class index starting from 1
+        return boxes[keep], scores[keep], classes[keep] + 1
+
+    def _decode_tensorflow(self, outputs, i):
+        # Rows of `image_id, class, score, xmin, ymin, xmax, ymax`, where
+        # classes start from 1 as in the label map (0 is the background)
+        rows = outputs.reshape(-1, 7)
+        rows = rows[(rows[:, 0] == i)
+                    & (rows[:, 2] > self.confidence_threshold)]
+        rows = rows[np.argsort(-rows[:, 2], kind="stable")]
+        rows = rows[:self.max_detections]
+        return rows[:, 3:7], rows[:, 2], rows[:, 1].astype(np.int32)
+
+    def postprocess(self, outputs, imgs):
+        num_imgs = len(imgs)
+        boxes = np.zeros((num_imgs, self.max_detections, 4), dtype=np.float32)
+        scores = np.zeros((num_imgs, self.max_detections), dtype=np.float32)
+        classes = np.zeros((num_imgs, self.max_detections), dtype=np.int32)
+        for i, img in enumerate(imgs):
+            if self.framework == "darknet":
+                b, s, c = self._decode_darknet(outputs, i, num_imgs)
+            else:
+                b, s, c = self._decode_tensorflow(outputs, i)
+            height, width = img.shape[:2]
+            n = len(s)
+            boxes[i, :n] = np.clip(b, 0, 1) * [width, height, width, height]
+            scores[i, :n] = s
+            classes[i, :n] = c
+        return boxes, scores, classes
+
+
+class TiledBackend(Backend):
+    """Wrap a backend to detect objects on overlapping tiles of images (see
+    `im_util.get_tiles`) at full resolution, instead of on downsampled
+    images, so that small objects are not lost. Tiles of all images of a
+    batch are run in a single call of the wrapped backend, then boxes are
+    mapped back to image coordinates and merged across tiles by non-max
+    suppression.
+
+    Parameters
+    ----------
+    backend : Backend
+        Backend run on tiles.
+    tile_size : tuple
+        `(height, width)` of tiles.
+    overlap : int
+        Minimum overlap in pixels between adjacent tiles. It should be at
+        least the size of objects, so that each object lies entirely in some
+        tile.
+    rois : array-like
+        Regions of interest of shape (n, 4) in `xmin, ymin, xmax, ymax`
+        format. If specified, only these regions are tiled, and detections
+        whose center is outside all of them are discarded.
+    include_full_image : bool
+        Whether to also detect on each whole image resized to `tile_size`,
+        so that objects larger than tiles are detected too.
+    confidence_threshold : float
+        Detections with lower scores are discarded before merging.
+    nms_threshold : float
+        IoU threshold of non-max suppression across tiles. Boxes cut by the
+        edge of a tile are also discarded if more than this fraction of
+        their area is inside another box of the same class.
+    edge_margin : int
+        Boxes closer than this (in pixels) to an edge of their tile inside
+        the image are considered cut by it.
+    max_detections : int
+        Number of detections returned per image. Outputs are padded with
+        zero scores, as those of Tensorflow Object Detection API.
+
+    Examples
+    --------
+    >>> tensors = load_tensors(inference_graph_path, labelmap_path)
+    >>> tensors["backend"] = TiledBackend(get_backend(tensors), (640, 640))
+    >>> boxes, scores, classes = detect_objects(frame_4k, tensors)
+
+    """
+    name = "tiled"
+    box_format = "pixel_xyxy"
+
+    def __init__(self, backend, tile_size=(640, 640), overlap=64, rois=None,
+                 include_full_image=False, confidence_threshold=0.25,
+                 nms_threshold=0.5, edge_margin=4, max_detections=100):
+        Backend.__init__(self, backend.tensors)
+        self.backend = backend
+        self.tile_size = tuple(tile_size)
+        self.overlap = overlap
+        self.rois = (None if rois is None
+                     else np.asarray(rois, dtype=np.int64).reshape(-1, 4))
+        self.include_full_image = include_full_image
+        self.confidence_threshold = confidence_threshold
+        self.nms_threshold = nms_threshold
+        self.edge_margin = edge_margin
+        self.max_detections = max_detections
+        # Tiles of each image size
+        self._tiles = {}
+
+    def get_tiles(self, img_size):
+        img_size = tuple(img_size)
+        if img_size not in self._tiles:
+            self._tiles[img_size] = im_util.get_tiles(
+                img_size, self.tile_size, self.overlap, self.rois)
+        return self._tiles[img_size]
+
+    def num_inputs(self, img_size):
+        """
+        Return the number of inputs of the wrapped backend per image of size
+        `img_size`, e.g. to allocate a `ModelProcessPool`.
+        """
+        return len(self.get_tiles(img_size)) + int(self.include_full_image)
+
+    def preprocess(self, imgs):
+        height, width = imgs.shape[1:3]
+        tile_height = min(self.tile_size[0], height)
+        tile_width = min(self.tile_size[1], width)
+        inputs = [img[ymin:ymax, xmin:xmax] for img in imgs
+                  for xmin, ymin, xmax, ymax in self.get_tiles((height,
+                                                                width))]
+        if self.include_full_image:
+            inputs.extend(cv2.resize(img, (tile_width, tile_height))
+                          for img in imgs)
+        if len(inputs) == 0:
+            return np.zeros((0, tile_height, tile_width) + imgs.shape[3:],
+                            dtype=imgs.dtype)
+        return np.stack(inputs)
+
+    def infer(self, inputs):
+        if len(inputs) == 0:
+            return None
+        return self.backend.detect_objects(inputs)
+
+    def _to_pixel_xyxy(self, boxes, size):
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        if self.backend.box_format == "normalized_yxyx":
+            height, width = size
+            boxes = boxes[:, [1, 0, 3, 2]] * [width, height, width, height]
+        return boxes
+
+    def _covered(self, boxes, classes, truncated, candidates):
+        """
+        Return a mask of boxes cut by the edge of a tile which lie mostly
+        inside another box of the same class among `candidates`.
+        """
+        covered = np.zeros(len(boxes), dtype=bool)
+        if not truncated.any() or not candidates.any():
+            return covered
+        inter = bbox_util.intersection_matrix(boxes[truncated],
+                                              boxes[candidates])
+        same = (np.flatnonzero(truncated)[:, None]
+                == np.flatnonzero(candidates)[None, :])
+        inter[same] = 0
+        inter[classes[truncated][:, None] != classes[candidates][None, :]] = 0
+        covered[truncated] = (inter.max(axis=1) > self.nms_threshold
+                              * bbox_util.areas(boxes[truncated]))
+        return covered
+
+    def _merge(self, boxes, scores, classes, truncated):
+        mask = scores > self.confidence_threshold
+        if self.rois is not None:
+            centers_x = (boxes[:, 0] + boxes[:, 2]) / 2
+            centers_y = (boxes[:, 1] + boxes[:, 3]) / 2
+            mask &= np.any(
+                (centers_x[:, None] >= self.rois[None, :, 0])
+                & (centers_y[:, None] >= self.rois[None, :, 1])
+                & (centers_x[:, None] < self.rois[None, :, 2])
+                & (centers_y[:, None] < self.rois[None, :, 3]), axis=1)
+        boxes, scores = boxes[mask], scores[mask]
+        classes, truncated = classes[mask], truncated[mask]
+        # A part of an object cut by the edge of a tile may have a high IoU
+        # and score with the whole object seen by an overlapping tile, so it
+        # is discarded before non-max suppression if it lies mostly inside
+        # a whole box of the same class, lest it suppresses that box
+        mask = ~self._covered(boxes, classes, truncated, ~truncated)
+        boxes, scores = boxes[mask], scores[mask]
+        classes, truncated = classes[mask], truncated[mask]
+        keep = bbox_util.non_max_suppression(boxes, scores,
+                                             self.nms_threshold, classes)
+        boxes, scores = boxes[keep], scores[keep]
+        classes, truncated = classes[keep], truncated[keep]
+        # Parts of an object cut by edges of different tiles have a low IoU
+        # with each other, so they are discarded after non-max suppression if
+        # they lie mostly inside another kept box of the same class
+        mask = ~self._covered(boxes, classes, truncated,
+                              np.ones(len(boxes), dtype=bool))
+        boxes, scores, classes = boxes[mask], scores[mask], classes[mask]
+        n = min(len(scores), self.max_detections)
+        return boxes[:n], scores[:n], classes[:n]
+
+    def postprocess(self, outputs, imgs):
+        num_imgs, height, width = imgs.shape[:3]
+        tiles = self.get_tiles((height, width))
+        num_tiles = len(tiles)
+        tile_size = (min(self.tile_size[0], height),
+                     min(self.tile_size[1], width))
+        # Edges of tiles inside images, at which objects may be cut
+        inner_edges = np.stack([tiles[:, 0] > 0, tiles[:, 1] > 0,
+                                tiles[:, 2] < width, tiles[:, 3] < height],
+                               axis=1)
+
+        boxes = np.zeros((num_imgs, self.max_detections, 4), dtype=np.float32)
+        scores = np.zeros((num_imgs, self.max_detections), dtype=np.float32)
+        classes = np.zeros((num_imgs, self.max_detections), dtype=np.int32)
+        if outputs is None:
+            return boxes, scores, classes
+        tile_boxes, tile_scores, tile_classes = outputs
+
+        for i in range(num_imgs):
+            parts = []
+            for k, tile in enumerate(tiles):
+                j = i * num_tiles + k
+                b = self._to_pixel_xyxy(tile_boxes[j], tile_size)
+                truncated = np.any(inner_edges[k] & np.concatenate(
+                    [b[:, :2] <= self.edge_margin,
+                     b[:, 2:] >= np.subtract(tile_size[::-1],
+                                             self.edge_margin)], axis=1),
+                    axis=1)
+                parts.append((b + tile[[0, 1, 0, 1]], tile_scores[j],
+                              tile_classes[j], truncated))
+            if self.include_full_image:
+                j = num_imgs * num_tiles + i
+                scale = [width / tile_size[1], height / tile_size[0]] * 2
+                b = self._to_pixel_xyxy(tile_boxes[j], tile_size) * scale
+                parts.append((b, tile_scores[j], tile_classes[j],
+                              np.zeros(len(b), dtype=bool)))
+            b, s, c = self._merge(
+                np.concatenate([p[0] for p in parts] + [np.zeros((0, 4))]),
+                np.concatenate([np.asarray(p[1], dtype=np.float64)
+                                .reshape(-1) for p in parts] + [[]]),
+                np.concatenate([np.asarray(p[2], dtype=np.int32)
+                                .reshape(-1) for p in parts]
+                               + [np.zeros(0, dtype=np.int32)]),
+                np.concatenate([p[3] for p in parts]
+                               + [np.zeros(0, dtype=bool)]))
+            n = len(s)
+            boxes[i, :n] = b
+            scores[i, :n] = s
+            classes[i, :n] = c
+        return boxes, scores, classes
+
+    def close(self):
+        self.backend.close()
+
+
+def get_backend(tensors):
+    """
+    Return the backend of `tensors`: `tensors["backend"]` if it was loaded by
+    `load_tensors(..., backend=...)`, and otherwise a backend wrapping tensors
+    loaded by `load_inference_graph`, which is cached in `tensors`.
+    """
+    backend = tensors.get("backend")
+    if backend is None:
+        if "yolo_net" in tensors:
+            backend = YOLOBackend(tensors)
+        else:
+            backend = TFBackend(tensors)
+        tensors["backend"] = backend
+    return backend
+
+
 class TFModel():
     @check_import([tf_imported], ["tensorflow"])
     def __init__(self, inference_graph_path, labelmap_path,
                  confidence_threshold=0.5,
-                 class_to_be_detected="all"):
-        self.tensors = load_tensors(inference_graph_path, labelmap_path)
-        self.cls = class_to_be_detected
+                 class_to_be_detected="all",
+                 session_config=None, warm_up_shapes=None):
+        """
+        See `load_inference_graph_tf` for `session_config` and
+        `warm_up_shapes`.
+        """
+        self.tensors = load_tensors(inference_graph_path, labelmap_path,
+                                    session_config=session_config,
+                                    warm_up_shapes=warm_up_shapes)
+        self.cls = get_classes(class_to_be_detected,
+                               self.tensors["labelmap_dict"])
         self.threshold = confidence_threshold
 
     def detect_objects_on_single_image(self, img):
@@ -315,10 +1439,9 @@ class TFModel():
         self.img = img.copy()
         img_size = img.shape[:2]
         boxes, scores, classes = detect_objects(img, self.tensors)
-        boxes, scores, classes = bbox_util.filter_boxes(boxes, scores,
-                                                        classes, self.cls,
-                                                        self.threshold,
-                                                        img_size)
+        with timing_util.stage("postprocess"):
+            boxes, scores, classes = bbox_util.filter_boxes(
+                boxes, scores, classes, self.cls, self.threshold, img_size)
 
         self.boxes, self.scores, self.classes = boxes, scores, classes
         return boxes, scores, classes
@@ -328,8 +1451,10 @@ class TFModel():
         Note that this function returns a new annotated image. The original
         image fed to the model will not be affected.
         """
-        return vis_util.draw_boxes_on_image(self.img, self.boxes, self.classes,
-                                            self.tensors["labelmap_dict"])
+        with timing_util.stage("draw"):
+            return vis_util.draw_boxes_on_image(self.img, self.boxes,
+                                                self.classes,
+                                                self.tensors["labelmap_dict"])
 
 
 class YOLOModel():
@@ -368,37 +1493,89 @@ class YOLOModel():
         Note that this function returns a new annotated image. The original
         image fed to the model will not be affected.
         """
-        return vis_util.draw_boxes_on_image(self.img, self.boxes, self.classes,
-                                            self.tensors["labelmap_dict"])
+        with timing_util.stage("draw"):
+            return vis_util.draw_boxes_on_image(self.img, self.boxes,
+                                                self.classes,
+                                                self.tensors["labelmap_dict"])
 
 
 class Model():
+    """Detector loaded with any registered backend (see `BACKENDS`), whose
+    detections are filtered by confidence and classes and returned as pixel
+    coordinates `xmin, ymin, xmax, ymax`.
     """
-    This model wraps up TFModel and YOLOModel for the sake of simplicity.
-    """
-    @check_import([tf_imported, df_imported], ["tensorflow", "darkflow"])
     def __init__(self, inference_graph_path, labelmap_path,
-                 meta_path, confidence_threshold=0.5,
-                 class_to_be_detected="all", gpu_usage=0.95):
+                 meta_path=None, confidence_threshold=0.5,
+                 class_to_be_detected="all", gpu_usage=0.95,
+                 session_config=None, warm_up_shapes=None,
+                 backend=None, backend_kwargs=None, motion_gate=None):
         """
-        If `meta_path` is specified, YOLOModel will be loaded. Otherwise,
-        Tensorflow Object Detection API model will be loaded.
+        If `backend` is not specified, YOLOModel's backend ("yolo") is used
+        if `meta_path` is specified, and TFModel's backend ("tf") otherwise,
+        with `session_config` and `warm_up_shapes`. See `load_tensors`.
+
+        If `motion_gate` (a `motion_util.MotionGate`) is specified, images
+        are assumed to be consecutive frames of a fixed camera, and previous
+        detections are reused for frames without motion.
         """
-        if meta_path is None:
-            TFModel.__init__(self, inference_graph_path, labelmap_path,
-                             confidence_threshold, class_to_be_detected)
-            self.model = TFModel
-        else:
-            YOLOModel.__init__(self, inference_graph_path, labelmap_path,
-                               meta_path, confidence_threshold,
-                               class_to_be_detected, gpu_usage)
-            self.model = YOLOModel
+        if backend is None:
+            backend = "tf" if meta_path is None else "yolo"
+            if backend_kwargs is None:
+                if backend == "tf":
+                    backend_kwargs = {"session_config": session_config,
+                                      "warm_up_shapes": warm_up_shapes}
+                else:
+                    backend_kwargs = {
+                        "gpu_usage": gpu_usage,
+                        "confidence_threshold": confidence_threshold}
+        self.tensors = load_tensors(inference_graph_path, labelmap_path,
+                                    meta_path=meta_path, backend=backend,
+                                    backend_kwargs=backend_kwargs)
+        self.backend = self.tensors["backend"]
+        self.cls = get_classes(class_to_be_detected,
+                               self.tensors["labelmap_dict"])
+        self.threshold = confidence_threshold
+        self.motion_gate = motion_gate
 
     def detect_objects_on_single_image(self, img):
-        return self.model.detect_objects_on_single_image(self, img)
+        """
+        Parameters
+        ----------
+        img : ndarray
+            Image to be detected. Can only be one image.
+
+        Returns
+        -------
+        boxes, scores, classes: ndarrays
+            Return coordinates, confidence scores and labels of bounding boxes.
+
+        """
+        self.img = img.copy()
+        if (self.motion_gate is not None
+                and not self.motion_gate.should_detect(img)):
+            return self.boxes, self.scores, self.classes
+        boxes, scores, classes = detect_objects(img, self.tensors)
+        with timing_util.stage("postprocess"):
+            boxes, scores, classes = bbox_util.filter_boxes(
+                np.asarray(boxes).reshape(-1, 4), np.asarray(scores),
+                np.asarray(classes), self.cls, self.threshold,
+                img.shape[:2], box_format=self.backend.box_format)
+
+        self.boxes, self.scores, self.classes = boxes, scores, classes
+        return boxes, scores, classes
 
     def draw_boxes_on_recent_image(self):
-        return self.model.draw_boxes_on_recent_image(self)
+        """
+        Note that this function returns a new annotated image. The original
+        image fed to the model will not be affected.
+        """
+        with timing_util.stage("draw"):
+            return vis_util.draw_boxes_on_image(self.img, self.boxes,
+                                                self.classes,
+                                                self.tensors["labelmap_dict"])
+
+    def close(self):
+        self.backend.close()
 
 
 def is_queueing(queue, terminate_signal,
@@ -538,7 +1715,8 @@ class VideoStream:
         """
         Return False if end of streaming.
         """
-        self.ret, self.frame = self.src.read()
+        with timing_util.stage("decode"):
+            self.ret, self.frame = self.src.read()
         if self.ret:
             self.count += 1
         else:
@@ -605,9 +1783,10 @@ class VideoStream:
         if frame is None:
             frame = self.frame
         # Resize frame
-        if self.diff:
-            frame = self.resize_func(frame)
-        self.out.write(frame)
+        with timing_util.stage("write"):
+            if self.diff:
+                frame = self.resize_func(frame)
+            self.out.write(frame)
     # Release utilities
     def release_in(self):
         self.src.release()
@@ -643,7 +1822,8 @@ class MultiThreadingVideoStream(VideoStream):
 
     def grab(self):
         # Read and add frame to the queue
-        self.ret, self.frame = self.src.read()
+        with timing_util.stage("decode"):
+            self.ret, self.frame = self.src.read()
         if self.ret:
             self.count += 1
             self.Q.put(self.frame, self.count)
@@ -689,6 +1869,111 @@ class MultiThreadingVideoStream(VideoStream):
             thread.join()
 
 
+def decode_frames(src, frame_queue, src_width=640, src_height=480):
+    """
+    Read frames from `src` and put them into a `shm_util.SharedFrameQueue`.
+    This is used as the target of decoder processes. Frames whose shape
+    differs from the frame pool are resized.
+    """
+    stream = cv2.VideoCapture(src)
+    if isinstance(src, int):
+        stream.set(3, src_width)
+        stream.set(4, src_height)
+    height, width = frame_queue.pool.frame_shape[:2]
+    count = -1
+
+    while True:
+        ret, frame = stream.read()
+        if not ret:
+            break
+        count += 1
+        if frame.shape[:2] != (height, width):
+            frame = cv2.resize(frame, (width, height))
+        frame_queue.put(frame, count)
+
+    stream.release()
+    frame_queue.put_end()
+
+
+class MultiProcessingVideoStream(VideoStream):
+    """Video streaming with decoding in a separate process. Decoded frames
+    are passed through shared memory, so they are never pickled.
+
+    Parameters
+    ----------
+    queue_size : int
+        Number of frame slots in shared memory.
+    copy : bool
+        If True, iterating returns a copy of each frame and its slot is
+        released immediately. If False, iterating returns a view of the
+        shared memory, which is only valid until the next frame is grabbed.
+
+    """
+    def __init__(self, src, src_width=640, src_height=480,
+                 queue_size=128, copy=True):
+        # Super init
+        super().__init__(src, src_width, src_height)
+        # Frames are decoded by the child process
+        self.release_in()
+        self.copy = copy
+        self.slot = None
+        self.closed = False
+
+        pool = shm_util.SharedFramePool(
+            queue_size, (self.src_height, self.src_width, 3))
+        self.Q = shm_util.SharedFrameQueue(pool)
+        self.process = CustomProcess(target=decode_frames,
+                                     args=(src, self.Q, src_width, src_height),
+                                     name="decoder")
+        self.process.start()
+
+    def grab(self):
+        # Release the slot of the previous frame
+        self.release_slot()
+        frame, count, slot = self.Q.get()
+        if frame is None:
+            self.terminate = True
+            self.frame = None
+            return self.frame
+
+        self.count = count
+        if self.copy:
+            self.frame = frame.copy()
+            self.Q.release(slot)
+        else:
+            self.frame = frame
+            self.slot = slot
+        return self.frame
+
+    def grab_slot(self):
+        """
+        Return `(slot, count)` of the next frame without reading it, so that
+        the slot can be passed on to other processes, which then read the
+        frame by `self.Q.pool.get(slot)` and release it by
+        `self.Q.pool.release(slot)`. Return `(None, None)` at the end.
+        """
+        slot, count = self.Q.queue.get()
+        if slot is None:
+            self.terminate = True
+        return slot, count
+
+    def release_slot(self):
+        if self.slot is not None:
+            self.Q.release(self.slot)
+            self.slot = None
+
+    def stop(self):
+        if self.closed:
+            return
+        self.closed = True
+        super().stop()
+        if self.process.is_alive():
+            self.process.terminate()
+        self.process.join()
+        self.frame = None
+        self.Q.close()
+
+
 class CustomThread(Thread):
     """
     This custom class is used to monitor multiple threads using IDs.
@@ -722,7 +2007,7 @@ class CustomProcess(Process):
 
     def __init__(self, *args, verbose=1, name="", **kwargs):
         if verbose:
-            print("Initializing {} thread ID {}".format(name, self.id))
+            print("Initializing {} process ID {}".format(name, self.id))
         super().__init__(*args, **kwargs)
 
 
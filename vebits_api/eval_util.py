@@ -0,0 +1,334 @@
+"""Evaluation of object detectors: matching of predictions with ground truth,
+precision/recall and average precision (AP) at multiple IoU thresholds, in
+the style of PASCAL VOC and COCO."""
+
+import numpy as np
+
+from .bbox_util import BBOX_COLS, get_filename_index, iou_matrix
+
+COCO_IOU_THRESHOLDS = np.linspace(0.5, 0.95, 10)
+# Recall values at which precision is sampled by COCO
+COCO_RECALL_THRESHOLDS = np.linspace(0, 1, 101)
+
+
+def match_detections(pred_boxes, pred_scores, pred_labels, gt_boxes,
+                     gt_labels, iou_thresholds, gt_ignore=None):
+    """Greedily match predictions of a single image with ground truth boxes
+    of the same class, by decreasing score, as done by COCO: each prediction
+    is matched with the unmatched ground truth box with the highest IoU, if
+    this IoU is at least the threshold.
+
+    Parameters
+    ----------
+    pred_boxes : array-like
+        Array of shape (n, 4) in `xmin, ymin, xmax, ymax` format.
+    pred_scores, pred_labels : array-like
+        Arrays of shape (n,).
+    gt_boxes : array-like
+        Array of shape (m, 4) in `xmin, ymin, xmax, ymax` format.
+    gt_labels : array-like
+        Array of shape (m,).
+    iou_thresholds : array-like
+        Array of shape (t,).
+    gt_ignore : array-like
+        Boolean array of shape (m,), e.g. `difficult` flags of PASCAL VOC.
+        Predictions matched with these boxes, any number of them, are neither
+        true nor false positives.
+
+    Returns
+    -------
+    order : ndarray
+        Indices of predictions sorted by decreasing score.
+    tp : ndarray
+        Boolean array of shape (t, n): whether each prediction (in `order`)
+        is a true positive at each threshold.
+    ignored : ndarray
+        Boolean array of shape (t, n): whether each prediction (in `order`)
+        is matched with an ignored box.
+
+    """
+    thresholds = np.asarray(iou_thresholds, dtype=np.float64)
+    order = np.argsort(-np.asarray(pred_scores), kind="stable")
+    num_preds, num_gts = len(order), len(gt_labels)
+    tp = np.zeros((len(thresholds), num_preds), dtype=bool)
+    ignored = np.zeros((len(thresholds), num_preds), dtype=bool)
+    if num_preds == 0 or num_gts == 0:
+        return order, tp, ignored
+
+    pred_labels = np.asarray(pred_labels)[order]
+    ious = iou_matrix(np.asarray(pred_boxes).reshape(-1, 4)[order], gt_boxes)
+    # Predictions can only be matched with boxes of the same class
+    ious[pred_labels[:, None] != np.asarray(gt_labels)[None, :]] = -1
+    gt_ignore = (np.zeros(num_gts, dtype=bool) if gt_ignore is None
+                 else np.asarray(gt_ignore, dtype=bool))
+
+    # Matched ground truth boxes, for each threshold
+    matched = np.zeros((len(thresholds), num_gts), dtype=bool)
+    rows = np.arange(len(thresholds))
+    for i in np.flatnonzero(ious.max(axis=1) >= thresholds.min()):
+        # IoU with available boxes, for all thresholds at once. Ignored boxes
+        # are only used if no regular box matches, as done by COCO.
+        candidates = np.where(matched, -1.0, ious[i][None, :])
+        regular = np.where(gt_ignore[None, :], -1.0, candidates)
+        best = regular.argmax(axis=1)
+        best_iou = regular[rows, best]
+        use_ignored = best_iou < thresholds
+        if gt_ignore.any():
+            best_ignored = candidates.argmax(axis=1)
+            best = np.where(use_ignored, best_ignored, best)
+            best_iou = np.where(use_ignored, candidates[rows, best_ignored],
+                                best_iou)
+        is_match = best_iou >= thresholds
+        is_ignored = is_match & gt_ignore[best]
+        # Ignored boxes stay available, so that all predictions matched with
+        # them are ignored, as done by PASCAL VOC and COCO
+        is_tp = is_match & ~is_ignored
+        matched[rows[is_tp], best[is_tp]] = True
+        tp[:, i] = is_tp
+        ignored[:, i] = is_ignored
+    return order, tp, ignored
+
+
+def average_precision(tp, num_gts, method="coco"):
+    """Compute AP from true positive flags of predictions sorted by
+    decreasing score.
+
+    Parameters
+    ----------
+    tp : array-like
+        Boolean array of shape (n,).
+    num_gts : int
+        Number of (non-ignored) ground truth boxes.
+    method : str
+        "coco" for 101-point interpolation, "voc" for the area under the
+        interpolated precision/recall curve (PASCAL VOC 2010 and later).
+
+    """
+    if num_gts == 0:
+        return np.nan
+    tp = np.asarray(tp, dtype=bool)
+    if len(tp) == 0:
+        return 0.0
+    tp_cum = np.cumsum(tp)
+    fp_cum = np.cumsum(~tp)
+    recall = tp_cum / num_gts
+    precision = tp_cum / (tp_cum + fp_cum)
+    # Interpolated precision: max precision at any higher recall
+    precision = np.maximum.accumulate(precision[::-1])[::-1]
+
+    if method == "coco":
+        indices = np.searchsorted(recall, COCO_RECALL_THRESHOLDS, side="left")
+        valid = indices < len(precision)
+        return float(np.where(valid, precision[np.minimum(
+            indices, len(precision) - 1)], 0.0).mean())
+    elif method == "voc":
+        recall = np.r_[0.0, recall]
+        return float(np.sum((recall[1:] - recall[:-1]) * precision))
+    else:
+        raise ValueError("Unknown AP method: {}".format(method))
+
+
+class DetectionEvaluator():
+    """Accumulate matched predictions image by image (or batch by batch), so
+    that evaluation can run inline with detection, then compute precision,
+    recall and AP per class and IoU threshold.
+
+    Parameters
+    ----------
+    iou_thresholds : array-like
+        IoU thresholds. Defaults to COCO thresholds, 0.5:0.05:0.95.
+    method : str
+        See `average_precision`.
+
+    Examples
+    --------
+    >>> evaluator = DetectionEvaluator()
+    >>> for img, gt_boxes, gt_labels in dataset:
+    ...     boxes, scores, classes = detect(img)
+    ...     evaluator.add(boxes, scores, classes, gt_boxes, gt_labels)
+    >>> results = evaluator.evaluate()
+
+    """
+    def __init__(self, iou_thresholds=COCO_IOU_THRESHOLDS, method="coco"):
+        self.iou_thresholds = np.atleast_1d(
+            np.asarray(iou_thresholds, dtype=np.float64))
+        self.method = method
+        self.num_images = 0
+        # Per-image arrays, concatenated when evaluating
+        self._scores = []
+        self._labels = []
+        self._tp = []
+        self._ignored = []
+        self._gt_labels = []
+
+    def add(self, pred_boxes, pred_scores, pred_labels, gt_boxes, gt_labels,
+            gt_ignore=None):
+        """
+        Add predictions and ground truth of a single image. See
+        `match_detections` for details of the arguments.
+        """
+        pred_scores = np.asarray(pred_scores, dtype=np.float64).reshape(-1)
+        pred_labels = np.asarray(pred_labels).reshape(-1)
+        gt_labels = np.asarray(gt_labels).reshape(-1)
+        gt_boxes = np.asarray(gt_boxes, dtype=np.float64).reshape(-1, 4)
+        order, tp, ignored = match_detections(
+            pred_boxes, pred_scores, pred_labels, gt_boxes, gt_labels,
+            self.iou_thresholds, gt_ignore)
+
+        self.num_images += 1
+        self._scores.append(pred_scores[order])
+        self._labels.append(pred_labels[order])
+        self._tp.append(tp)
+        self._ignored.append(ignored)
+        if gt_ignore is not None:
+            gt_labels = gt_labels[~np.asarray(gt_ignore, dtype=bool)]
+        self._gt_labels.append(gt_labels)
+
+    def add_batch(self, pred_boxes, pred_scores, pred_labels, gt_boxes,
+                  gt_labels, gt_ignore=None):
+        """
+        Same as `add`, but each argument is a sequence with one element per
+        image, e.g. outputs of `detector_util.detect_objects` converted with
+        `tf_boxes_to_xyxy`.
+        """
+        if gt_ignore is None:
+            gt_ignore = [None] * len(gt_labels)
+        for args in zip(pred_boxes, pred_scores, pred_labels, gt_boxes,
+                        gt_labels, gt_ignore):
+            self.add(*args)
+
+    def merge(self, other):
+        """
+        Add results accumulated by another evaluator, e.g. of another worker.
+        """
+        if not np.array_equal(self.iou_thresholds, other.iou_thresholds):
+            raise ValueError("Cannot merge evaluators with different IoU "
+                             "thresholds")
+        self.num_images += other.num_images
+        for name in ["_scores", "_labels", "_tp", "_ignored", "_gt_labels"]:
+            getattr(self, name).extend(getattr(other, name))
+        return self
+
+    def evaluate(self):
+        """Compute metrics over everything added so far.
+
+        Returns
+        -------
+        dict
+            `AP` (mean over classes and thresholds), `AP@<threshold>` (mean
+            over classes) for each threshold, and `per_class`, mapping each
+            class (as a string) to its number of ground truth boxes, predictions, AP at
+            each threshold, and precision and recall at the first threshold
+            (considering all predictions). Classes without ground truth boxes
+            are excluded from means.
+
+        """
+        num_thresholds = len(self.iou_thresholds)
+        scores = np.concatenate(self._scores + [np.empty(0)])
+        labels = np.concatenate(self._labels + [np.empty(0, dtype=object)])
+        tp = np.concatenate(self._tp + [np.empty((num_thresholds, 0),
+                                                 dtype=bool)], axis=1)
+        ignored = np.concatenate(self._ignored + [np.empty(
+            (num_thresholds, 0), dtype=bool)], axis=1)
+        gt_labels = np.concatenate(self._gt_labels
+                                   + [np.empty(0, dtype=object)])
+
+        # Classes are compared as strings, so that labels may be of any type
+        labels = labels.astype(str)
+        gt_classes, gt_counts = np.unique(gt_labels.astype(str),
+                                          return_counts=True)
+        gt_counts = dict(zip(gt_classes, gt_counts))
+        classes = np.union1d(np.unique(labels), gt_classes)
+        # Sort all predictions once by class, then by decreasing score
+        order = np.lexsort((-scores, labels))
+        labels = labels[order]
+        tp, ignored = tp[:, order], ignored[:, order]
+
+        per_class = {}
+        aps = np.full((len(classes), num_thresholds), np.nan)
+        for c, cl in enumerate(classes):
+            start = np.searchsorted(labels, cl, side="left")
+            end = np.searchsorted(labels, cl, side="right")
+            num_gts = int(gt_counts.get(cl, 0))
+            for t in range(num_thresholds):
+                # Predictions matched with ignored boxes are discarded
+                kept = ~ignored[t, start:end]
+                aps[c, t] = average_precision(tp[t, start:end][kept],
+                                              num_gts, self.method)
+            kept = ~ignored[0, start:end]
+            num_tp = int(tp[0, start:end][kept].sum())
+            num_preds = int(kept.sum())
+            per_class[str(cl)] = {
+                "num_gts": num_gts,
+                "num_preds": num_preds,
+                "AP": aps[c].tolist(),
+                "precision": num_tp / num_preds if num_preds else 0.0,
+                "recall": num_tp / num_gts if num_gts else np.nan}
+
+        results = {"num_images": self.num_images,
+                   "AP": float(np.nanmean(aps)) if np.isfinite(aps).any()
+                   else np.nan}
+        for t, threshold in enumerate(self.iou_thresholds):
+            column = aps[:, t]
+            results["AP@{:.2f}".format(threshold)] = (
+                float(np.nanmean(column)) if np.isfinite(column).any()
+                else np.nan)
+        results["per_class"] = per_class
+        return results
+
+
+def tf_boxes_to_xyxy(boxes, img_size):
+    """
+    Convert boxes returned by Tensorflow Object Detection API (relative
+    `ymin, xmin, ymax, xmax`) to pixel `xmin, ymin, xmax, ymax`. `img_size`
+    is `(height, width)`.
+    """
+    height, width = img_size
+    boxes = np.asarray(boxes, dtype=np.float64)
+    return boxes[..., [1, 0, 3, 2]] * [width, height, width, height]
+
+
+def evaluate_dataframes(gt_df, pred_df, iou_thresholds=COCO_IOU_THRESHOLDS,
+                        method="coco"):
+    """Evaluate predictions against ground truth, both given as dataframes
+    with columns `filename, class, xmin, ymin, xmax, ymax` (e.g. read by
+    `annotation_util.read_annotations`). `pred_df` must also have a column
+    `score`. If `gt_df` has a column `difficult`, these boxes are ignored.
+
+    Returns
+    -------
+    dict
+        See `DetectionEvaluator.evaluate`.
+
+    """
+    evaluator = DetectionEvaluator(iou_thresholds, method)
+
+    gt_order, gt_names, gt_starts, gt_ends = get_filename_index(gt_df)
+    gt_boxes = gt_df.loc[:, BBOX_COLS].to_numpy(dtype=np.float64)[gt_order]
+    gt_labels = gt_df["class"].to_numpy()[gt_order]
+    gt_ignore = (gt_df["difficult"].to_numpy(dtype=bool)[gt_order]
+                 if "difficult" in gt_df.columns else None)
+
+    pred_order, pred_names, pred_starts, pred_ends = get_filename_index(
+        pred_df)
+    pred_boxes = pred_df.loc[:, BBOX_COLS].to_numpy(
+        dtype=np.float64)[pred_order]
+    pred_scores = pred_df["score"].to_numpy(dtype=np.float64)[pred_order]
+    pred_labels = pred_df["class"].to_numpy()[pred_order]
+    pred_index = {name: i for i, name in enumerate(pred_names)}
+    empty = slice(0, 0)
+
+    # Images with ground truth boxes
+    for i, name in enumerate(gt_names):
+        gt = slice(gt_starts[i], gt_ends[i])
+        j = pred_index.pop(name, None)
+        pred = empty if j is None else slice(pred_starts[j], pred_ends[j])
+        evaluator.add(pred_boxes[pred], pred_scores[pred], pred_labels[pred],
+                      gt_boxes[gt], gt_labels[gt],
+                      None if gt_ignore is None else gt_ignore[gt])
+    # Images with predictions only: all predictions are false positives
+    for j in pred_index.values():
+        pred = slice(pred_starts[j], pred_ends[j])
+        evaluator.add(pred_boxes[pred], pred_scores[pred], pred_labels[pred],
+                      gt_boxes[empty], gt_labels[empty])
+    return evaluator.evaluate()
@@ -0,0 +1,352 @@
+"""Perceptual hashes of images and fast lookup of near-duplicates, e.g. to drop
+near-identical frames when extracting images from videos."""
+
+import cv2
+import numpy as np
+import pandas as pd
+
+# Weights used to pack 64 bits into an integer
+_BIT_WEIGHTS = 1 << np.arange(63, -1, -1, dtype=np.uint64)
+
+
+def _downsample(img, width, height):
+    """
+    Downsample an image to grayscale `(height, width)`. A bilinear resize to
+    4x the target size first makes the final area resize use an integer
+    factor, which is an order of magnitude faster than a direct area resize
+    of a large frame.
+    """
+    if img.shape[0] > 4 * height and img.shape[1] > 4 * width:
+        img = cv2.resize(img, (4 * width, 4 * height),
+                         interpolation=cv2.INTER_LINEAR)
+    img = cv2.resize(img, (width, height), interpolation=cv2.INTER_AREA)
+    if img.ndim == 3:
+        return cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    return img
+
+
+def _pack_bits(bits):
+    return int(np.bitwise_or.reduce(_BIT_WEIGHTS[bits.ravel()]))
+
+
+def average_hash(img):
+    """
+    Compute the 64-bit average hash of an image: each bit tells whether a
+    pixel of the 8x8 downsampled image is brighter than the mean.
+    """
+    small = _downsample(img, 8, 8)
+    return _pack_bits(small > small.mean())
+
+
+def difference_hash(img):
+    """
+    Compute the 64-bit difference hash of an image: each bit tells whether a
+    pixel of the 9x8 downsampled image is brighter than its right neighbor.
+    """
+    small = _downsample(img, 9, 8)
+    small = small.astype(np.int16)
+    return _pack_bits(small[:, :-1] > small[:, 1:])
+
+
+def dct_hash(img):
+    """
+    Compute the 64-bit DCT (perceptual) hash of an image: each bit tells
+    whether a low-frequency DCT coefficient of the 32x32 downsampled image is
+    larger than the median. It is the most robust to small changes in
+    brightness, compression and noise.
+    """
+    small = _downsample(img, 32, 32)
+    coeffs = cv2.dct(small.astype(np.float32))[:8, :8].ravel()
+    # Ignore the DC coefficient when computing the median
+    return _pack_bits(coeffs > np.median(coeffs[1:]))
+
+
+HASH_FUNCTIONS = {
+    "average": average_hash,
+    "difference": difference_hash,
+    "dct": dct_hash,
+}
+
+
+def hamming_distance(hash_1, hash_2):
+    return bin(hash_1 ^ hash_2).count("1")
+
+
+class MultiIndexHashTable():
+    """Table of 64-bit hashes supporting queries of hashes within a Hamming
+    distance `threshold`.
+
+    Hashes are split into `threshold + 1` disjoint chunks of bits, and each
+    chunk is indexed in its own dictionary. By the pigeonhole principle, two
+    hashes within distance `threshold` share at least one chunk exactly, so
+    a query only compares hashes found in one of its chunk buckets instead of
+    the whole table.
+
+    Parameters
+    ----------
+    threshold : int
+        Maximum Hamming distance of near-duplicates.
+
+    """
+    def __init__(self, threshold, num_bits=64):
+        self.threshold = threshold
+        num_chunks = min(threshold + 1, num_bits)
+        # Boundaries of the chunks, as evenly sized as possible
+        bounds = np.linspace(0, num_bits, num_chunks + 1).astype(int)
+        self.chunks = [(int(start), (1 << int(end - start)) - 1)
+                       for start, end in zip(bounds[:-1], bounds[1:])]
+        self.tables = [{} for _ in self.chunks]
+        self.hashes = []
+        self.items = []
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def _keys(self, hash_value):
+        return [(hash_value >> shift) & mask for shift, mask in self.chunks]
+
+    def add(self, hash_value, item=None):
+        """
+        Add a hash, with an optional associated item (e.g. a file name).
+        """
+        index = len(self.hashes)
+        self.hashes.append(hash_value)
+        self.items.append(item)
+        for table, key in zip(self.tables, self._keys(hash_value)):
+            table.setdefault(key, []).append(index)
+
+    def query(self, hash_value):
+        """Find hashes within distance `threshold` of `hash_value`.
+
+        Returns
+        -------
+        list of (distance, hash, item)
+            Sorted by distance.
+
+        """
+        candidates = set()
+        for table, key in zip(self.tables, self._keys(hash_value)):
+            candidates.update(table.get(key, ()))
+
+        results = []
+        for index in candidates:
+            distance = hamming_distance(hash_value, self.hashes[index])
+            if distance <= self.threshold:
+                results.append((distance, self.hashes[index],
+                                self.items[index]))
+        return sorted(results, key=lambda result: result[0])
+
+    def contains_near(self, hash_value):
+        """
+        Same as `bool(query(hash_value))`, but return as soon as a match is
+        found.
+        """
+        for table, key in zip(self.tables, self._keys(hash_value)):
+            for index in table.get(key, ()):
+                if hamming_distance(hash_value,
+                                    self.hashes[index]) <= self.threshold:
+                    return True
+        return False
+
+
+class FrameDeduplicator():
+    """Drop frames that are near-duplicates of frames kept so far.
+
+    Parameters
+    ----------
+    threshold : int
+        Maximum Hamming distance between hashes of two frames to be
+        considered near-duplicates. 0 only drops (almost) exact duplicates.
+    hash_func : str
+        One of "average", "difference" and "dct".
+
+    Examples
+    --------
+    >>> dedup = FrameDeduplicator(threshold=4)
+    >>> kept = [frame for frame in frames if dedup.keep(frame)]
+
+    """
+    def __init__(self, threshold=4, hash_func="dct"):
+        self.hash_func = HASH_FUNCTIONS[hash_func]
+        self.table = MultiIndexHashTable(threshold)
+        self.num_kept = 0
+        self.num_dropped = 0
+        # Hash of the last frame passed to `keep`
+        self.last_hash = None
+
+    def keep(self, frame, item=None):
+        """
+        Return True if `frame` is not a near-duplicate of any frame kept so
+        far, in which case it is recorded. Return False otherwise.
+        """
+        hash_value = self.hash_func(frame)
+        self.last_hash = hash_value
+        if self.table.contains_near(hash_value):
+            self.num_dropped += 1
+            return False
+        self.add(hash_value, item)
+        return True
+
+    def add(self, hash_value, item=None):
+        """
+        Record the hash of a kept frame, e.g. to restore the state of an
+        interrupted run from the hashes of the frames it kept.
+        """
+        self.table.add(hash_value, item)
+        self.num_kept += 1
+
+
+# Masks used to count bits in parallel (SWAR popcount)
+_M1 = np.uint64(0x5555555555555555)
+_M2 = np.uint64(0x3333333333333333)
+_M4 = np.uint64(0x0F0F0F0F0F0F0F0F)
+_H01 = np.uint64(0x0101010101010101)
+
+
+def popcount(values):
+    """
+    Count set bits of each element of an array of 64-bit integers.
+    """
+    x = np.asarray(values, dtype=np.uint64)
+    x = x - ((x >> np.uint64(1)) & _M1)
+    x = (x & _M2) + ((x >> np.uint64(2)) & _M2)
+    x = (x + (x >> np.uint64(4))) & _M4
+    return ((x * _H01) >> np.uint64(56)).astype(np.int64)
+
+
+def to_hash_array(hashes):
+    """
+    Convert a sequence of hashes (python ints) to an array of np.uint64.
+    """
+    return np.fromiter((int(h) for h in hashes), dtype=np.uint64,
+                       count=len(hashes))
+
+
+def find_near_duplicate_pairs(hashes, threshold, max_bucket_size=None):
+    """Find all pairs of hashes within Hamming distance `threshold`, without
+    comparing all pairs.
+
+    Hashes are split into `threshold + 1` chunks, as in `MultiIndexHashTable`.
+    For each chunk, hashes are sorted by the value of that chunk, so that
+    hashes of the same bucket (i.e. equal chunk) are contiguous. Each hash is
+    then compared with the following hashes of its bucket, one offset at a
+    time, in a vectorized manner.
+
+    Parameters
+    ----------
+    hashes : array-like
+        Array of shape (n,) of 64-bit hashes.
+    threshold : int
+    max_bucket_size : int
+        If specified, buckets larger than this (typically hashes of blank
+        images) are skipped, so that the cost stays bounded.
+
+    Returns
+    -------
+    ndarray
+        Array of shape (m, 2) of unique pairs of indices `i < j`.
+
+    """
+    hashes = np.asarray(hashes, dtype=np.uint64)
+    n = len(hashes)
+    num_chunks = min(threshold + 1, 64)
+    bounds = np.linspace(0, 64, num_chunks + 1).astype(int)
+    pairs = [np.empty((0, 2), dtype=np.int64)]
+
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        mask = np.uint64((1 << int(end - start)) - 1)
+        keys = (hashes >> np.uint64(start)) & mask
+        order = np.argsort(keys, kind="stable")
+        sorted_keys = keys[order]
+        sorted_hashes = hashes[order]
+
+        # Positions followed by a hash of the same bucket
+        active = np.flatnonzero(sorted_keys[1:] == sorted_keys[:-1])
+        if max_bucket_size is not None:
+            bucket_ids = np.cumsum(np.r_[True, sorted_keys[1:]
+                                         != sorted_keys[:-1]]) - 1
+            bucket_sizes = np.bincount(bucket_ids)
+            active = active[bucket_sizes[bucket_ids[active]]
+                            <= max_bucket_size]
+
+        offset = 1
+        while active.size:
+            distances = popcount(sorted_hashes[active]
+                                 ^ sorted_hashes[active + offset])
+            close = active[distances <= threshold]
+            pairs.append(np.stack([order[close], order[close + offset]],
+                                  axis=1))
+            # Keep positions whose bucket extends to the next offset
+            offset += 1
+            active = active[active + offset < n]
+            active = active[sorted_keys[active + offset]
+                            == sorted_keys[active]]
+
+    pairs = np.sort(np.concatenate(pairs), axis=1)
+    return np.unique(pairs, axis=0)
+
+
+def cluster_pairs(num_items, pairs):
+    """Group items linked by `pairs` (e.g. near-duplicates) into clusters,
+    using union-find.
+
+    Returns
+    -------
+    ndarray
+        Array of shape (num_items,) containing, for each item, the smallest
+        index of its cluster.
+
+    """
+    parents = np.arange(num_items)
+
+    def find(i):
+        root = i
+        while parents[root] != root:
+            root = parents[root]
+        # Path compression
+        while parents[i] != root:
+            parents[i], i = root, parents[i]
+        return root
+
+    for i, j in pairs:
+        root_i, root_j = find(i), find(j)
+        if root_i != root_j:
+            parents[max(root_i, root_j)] = min(root_i, root_j)
+    # Point every item directly to its root
+    while True:
+        grandparents = parents[parents]
+        if np.array_equal(grandparents, parents):
+            return parents
+        parents = grandparents
+
+
+def find_duplicate_clusters(hashes, threshold, exact_keys=None,
+                            max_bucket_size=None):
+    """Cluster near-duplicate images, given their perceptual hashes.
+
+    Parameters
+    ----------
+    hashes : array-like
+        Array of shape (n,) of 64-bit perceptual hashes.
+    threshold : int
+        Maximum Hamming distance of near-duplicates.
+    exact_keys : array-like
+        Optional array of shape (n,) of keys (e.g. content hashes) such that
+        items with equal keys are always put in the same cluster.
+    max_bucket_size : int
+        See `find_near_duplicate_pairs`.
+
+    Returns
+    -------
+    ndarray
+        Array of shape (n,) containing, for each item, the smallest index of
+        its cluster. Items without duplicates are their own cluster.
+
+    """
+    pairs = [find_near_duplicate_pairs(hashes, threshold, max_bucket_size)]
+    if exact_keys is not None:
+        # Link each item to the first item with the same key
+        codes = pd.factorize(np.asarray(exact_keys))[0]
+        _, first = np.unique(codes, return_index=True)
+        pairs.append(np.stack([first[codes], np.arange(len(codes))], axis=1))
+    return cluster_pairs(len(hashes), np.concatenate(pairs))
@@ -1,9 +1,23 @@
+import os
+import shutil
+
 import cv2
 import numpy as np
 import imgaug as ia
 import imgaug.augmenters as iaa
+from imgaug.augmentables.batches import UnnormalizedBatch
 
 from .bbox_util import BBox, BBoxes
+from .job_util import atomic_path, atomic_write
+# Try importing fcntl for copy-on-write file copies (reflinks)
+try:
+    import fcntl
+    fcntl_imported = True
+except ModuleNotFoundError:
+    fcntl_imported = False
+
+# ioctl request to clone a file on Linux (btrfs, xfs, ...)
+FICLONE = 0x40049409
 
 
 def resize_padding(img, size, bboxes=None):
@@ -45,6 +59,65 @@ def resize_padding(img, size, bboxes=None):
         return canvas
 
 
+def _tile_starts(start, end, tile, overlap, length):
+    # Start coordinates of tiles covering `[start, end)` along an axis of
+    # `length` pixels. Tiles which would cross the end are shifted back.
+    if end - start <= tile:
+        center = (start + end) // 2
+        return [min(max(center - tile // 2, 0), length - tile)]
+    starts = list(range(start, end - tile, tile - overlap))
+    return starts + [end - tile]
+
+
+def get_tiles(img_size, tile_size, overlap=64, rois=None):
+    """Compute overlapping tiles of the same size covering an image, or only
+    regions of interest of it, e.g. to detect small objects in
+    high-resolution images without downsampling them.
+
+    Parameters
+    ----------
+    img_size : tuple-like
+        `(height, width)` of the image.
+    tile_size : tuple-like
+        `(height, width)` of tiles. Dimensions larger than the image are
+        reduced to that of the image.
+    overlap : int
+        Minimum overlap in pixels between adjacent tiles. Objects smaller
+        than it lie entirely in at least one tile.
+    rois : array-like
+        Regions of interest of shape (n, 4) in `xmin, ymin, xmax, ymax`
+        format. If None, tiles cover the whole image.
+
+    Returns
+    -------
+    ndarray
+        Tiles of shape (m, 4) in `xmin, ymin, xmax, ymax` format.
+
+    """
+    if overlap < 0 or overlap >= min(tile_size):
+        raise ValueError("Overlap must be non-negative and smaller than "
+                         "tiles, got {} for tiles of size {}.".format(
+                             overlap, tuple(tile_size)))
+    height, width = img_size
+    tile_height = min(tile_size[0], height)
+    tile_width = min(tile_size[1], width)
+    if rois is None:
+        rois = [[0, 0, width, height]]
+    tiles = []
+    for xmin, ymin, xmax, ymax in np.asarray(rois, dtype=np.int64):
+        xmin, xmax = max(xmin, 0), min(xmax, width)
+        ymin, ymax = max(ymin, 0), min(ymax, height)
+        if xmax <= xmin or ymax <= ymin:
+            continue
+        for y in _tile_starts(ymin, ymax, tile_height, overlap, height):
+            for x in _tile_starts(xmin, xmax, tile_width, overlap, width):
+                tiles.append([x, y, x + tile_width, y + tile_height])
+    if len(tiles) == 0:
+        return np.zeros((0, 4), dtype=np.int64)
+    # Overlapping regions of interest may share tiles
+    return np.unique(np.asarray(tiles, dtype=np.int64), axis=0)
+
+
 def create_sequence():
     """
     This function creates a sequence of image transformation (augmentation)
@@ -82,9 +155,195 @@ def create_sequence():
     return aug
 
 
-def save_imgs(imgs, img_save_paths):
+class AugmentationPool():
+    """Run an augmentation sequence on batches of images using multiple
+    processes, via imgaug's multicore pool. Instances can be called the same
+    way as an imgaug augmenter, so they can be used as a drop-in replacement.
+
+    Parameters
+    ----------
+    sequence : imgaug.augmenters.Augmenter
+        Augmentation sequence. If None, `create_sequence()` will be used.
+    num_workers : int
+        Number of worker processes. If None, use all CPUs but one. If 1,
+        augmentation is performed in the calling process.
+    seed : int
+        Seed of the pool. Each worker process is seeded deterministically
+        from this value, so that results are reproducible.
+    batch_size : int
+        Number of images sent to a worker at a time.
+
+    """
+    def __init__(self, sequence=None, num_workers=None,
+                 seed=None, batch_size=8):
+        self.sequence = create_sequence() if sequence is None else sequence
+        self.num_workers = num_workers
+        self.seed = seed
+        self.batch_size = batch_size
+        self.pool = None
+        # Worker processes are seeded by the pool itself
+        if num_workers == 1 and seed is not None:
+            self.sequence.reseed(seed)
+
+    def _get_pool(self):
+        # Start worker processes lazily
+        if self.pool is None:
+            self.pool = self.sequence.pool(processes=self.num_workers,
+                                           seed=self.seed)
+        return self.pool
+
+    def augment(self, images, bounding_boxes=None):
+        """Augment a list of images and optionally their bounding boxes.
+
+        Parameters
+        ----------
+        images : list of ndarray
+        bounding_boxes : list of imgaug.BoundingBoxesOnImage
+            If not None, it must have the same length as `images`.
+
+        Returns
+        -------
+        images_aug : list of ndarray
+        bounding_boxes_aug : list of imgaug.BoundingBoxesOnImage
+            Only returned if `bounding_boxes` is not None.
+
+        """
+        if self.num_workers == 1:
+            if bounding_boxes is None:
+                return self.sequence(images=images)
+            return self.sequence(images=images, bounding_boxes=bounding_boxes)
+
+        batches = []
+        for i in range(0, len(images), self.batch_size):
+            bboxes = None
+            if bounding_boxes is not None:
+                bboxes = bounding_boxes[i:i + self.batch_size]
+            batches.append(UnnormalizedBatch(
+                images=images[i:i + self.batch_size], bounding_boxes=bboxes))
+
+        images_aug, bounding_boxes_aug = [], []
+        for batch in self._get_pool().map_batches(batches):
+            images_aug.extend(batch.images_aug)
+            if bounding_boxes is not None:
+                bounding_boxes_aug.extend(batch.bounding_boxes_aug)
+
+        if bounding_boxes is None:
+            return images_aug
+        return images_aug, bounding_boxes_aug
+
+    def __call__(self, images, bounding_boxes=None):
+        return self.augment(images, bounding_boxes)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def read_encoded(img_path):
+    """
+    Return the content (encoded bytes) of an image file without decoding.
+    """
+    with open(img_path, "rb") as f:
+        return f.read()
+
+
+def copy_img(src_path, dest_path, hardlink=False):
+    """Copy an image file without decoding and re-encoding it. A copy-on-write
+    clone (reflink) is tried first, then a hard link if `hardlink` is True,
+    then a regular copy. The destination is written atomically.
+
+    Note that a hard link shares content with the source, so the destination
+    must never be modified in place afterwards.
+
+    Returns
+    -------
+    str
+        Method used: "reflink", "hardlink" or "copy", or "same" if
+        `dest_path` already is `src_path`, in which case nothing is done.
+
+    """
+    # Replacing the destination by a copy of itself would be wasted work
+    if os.path.exists(dest_path) and os.path.samefile(src_path, dest_path):
+        return "same"
+    with atomic_path(dest_path) as tmp_path:
+        if fcntl_imported:
+            try:
+                with open(src_path, "rb") as src, open(tmp_path, "wb") as dest:
+                    fcntl.ioctl(dest.fileno(), FICLONE, src.fileno())
+                return "reflink"
+            except OSError:
+                pass
+
+        if hardlink:
+            try:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                os.link(src_path, tmp_path)
+                return "hardlink"
+            except OSError:
+                pass
+
+        shutil.copyfile(src_path, tmp_path)
+        return "copy"
+
+
+def save_img(img, save_path, src_path=None, modified=True,
+             return_encoded=True):
+    """Save an image and return its encoded bytes, so that they can be reused
+    (e.g. written to TFRecord files) without reading or encoding the image
+    again.
+
+    Parameters
+    ----------
+    img : ndarray
+    save_path : str
+        The image is encoded according to the extension of `save_path`.
+    src_path : str
+        Path to the file `img` was read from. If `modified` is False and it
+        has the same extension as `save_path`, the file is copied by
+        `copy_img` instead, which saves one encoding and avoids quality loss.
+    modified : bool
+        Whether `img` was modified since it was read from `src_path`.
+    return_encoded : bool
+        If False, return None, which avoids reading the copied file.
+
+    """
+    ext = os.path.splitext(save_path)[1]
+    if (not modified and src_path is not None
+            and os.path.splitext(src_path)[1].lower() == ext.lower()):
+        copy_img(src_path, save_path)
+        return read_encoded(save_path) if return_encoded else None
+
+    ret, encoded = cv2.imencode(ext, img)
+    if not ret:
+        raise ValueError("Cannot encode image to {}".format(save_path))
+    encoded = encoded.tobytes()
+    atomic_write(save_path, encoded)
+    return encoded
+
+
+def save_imgs(imgs, img_save_paths, img_src_paths=None):
     """
-    Convenience function used to save images by batch.
+    Convenience function used to save images by batch. `img_src_paths`, if
+    specified, contains for each image the path to the file it was read from
+    if it is unmodified, or None otherwise (see `save_img`). Images are
+    written atomically, so that an interrupted batch never leaves truncated
+    files behind.
     """
-    for img, save_path in zip(imgs, img_save_paths):
-        cv2.imwrite(save_path, img)
+    if img_src_paths is None:
+        img_src_paths = [None] * len(img_save_paths)
+    for img, save_path, src_path in zip(imgs, img_save_paths, img_src_paths):
+        if src_path is None:
+            with atomic_path(save_path) as tmp_path:
+                cv2.imwrite(tmp_path, img)
+        else:
+            save_img(img, save_path, src_path, modified=False,
+                     return_encoded=False)
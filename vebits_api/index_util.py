@@ -0,0 +1,274 @@
+"""Persistent index of the images of a dataset, updated incrementally, so that
+scripts only need to process new or changed files."""
+
+import os
+import hashlib
+from multiprocessing import Pool
+
+import cv2
+import numpy as np
+import pandas as pd
+
+from .hash_util import dct_hash
+from .integrity_util import read_image_size
+
+IMG_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+INDEX_NAME = ".vebits_index.csv"
+INDEX_COLS = ["path", "size", "mtime_ns", "hash",
+              "height", "width", "annotation", "phash"]
+INT_COLS = ["size", "mtime_ns", "height", "width"]
+# Prefix of columns storing, for each consumer (e.g. a script), the hash of
+# each file at the time it was last processed by that consumer.
+DONE_PREFIX = "done:"
+
+
+def hash_file(path, chunk_size=1 << 20):
+    """
+    Return the hex digest of the content of a file.
+    """
+    hasher = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def scan_dir(root_dir, extensions=IMG_EXTENSIONS):
+    """Recursively list files of `root_dir` with their size and modification
+    time, using only `stat` calls.
+
+    Returns
+    -------
+    pd.DataFrame
+        Columns `path` (relative to `root_dir`), `size`, `mtime_ns`.
+
+    """
+    paths, sizes, mtimes = [], [], []
+    dirs = [""]
+    while dirs:
+        rel_dir = dirs.pop()
+        with os.scandir(os.path.join(root_dir, rel_dir)) as it:
+            for entry in it:
+                rel_path = os.path.join(rel_dir, entry.name)
+                if entry.is_dir():
+                    dirs.append(rel_path)
+                elif entry.name.lower().endswith(extensions):
+                    stat = entry.stat()
+                    paths.append(rel_path)
+                    sizes.append(stat.st_size)
+                    mtimes.append(stat.st_mtime_ns)
+    return pd.DataFrame({"path": paths,
+                         "size": np.asarray(sizes, dtype=np.int64),
+                         "mtime_ns": np.asarray(mtimes, dtype=np.int64)})
+
+
+def perceptual_hash_file(path, size=None):
+    """
+    Compute the DCT hash (see `hash_util.dct_hash`) of an image file, or
+    return None if it cannot be decoded. If `size` (height, width) is known,
+    JPEG images are decoded at a reduced scale, which is much faster.
+    """
+    flag = cv2.IMREAD_GRAYSCALE
+    if size is not None:
+        # Largest reduction keeping at least 64 pixels on the shortest side
+        for factor, reduced_flag in ((8, cv2.IMREAD_REDUCED_GRAYSCALE_8),
+                                     (4, cv2.IMREAD_REDUCED_GRAYSCALE_4),
+                                     (2, cv2.IMREAD_REDUCED_GRAYSCALE_2)):
+            if min(size) // factor >= 64:
+                flag = reduced_flag
+                break
+    img = cv2.imread(path, flag)
+    return None if img is None else dct_hash(img)
+
+
+def describe_file(args):
+    """
+    Worker function used to compute hash and image size of a file, and
+    optionally its perceptual hash. Return `(hash, height, width, phash)`.
+    If `content` is False, only the perceptual hash is computed.
+    """
+    root_dir, rel_path, content, perceptual = args
+    path = os.path.join(root_dir, rel_path)
+    try:
+        size = read_image_size(path)
+    except OSError:
+        size = None
+    height, width = (-1, -1) if size is None else size
+    file_hash = hash_file(path) if content else None
+    phash = perceptual_hash_file(path, size) if perceptual else None
+    return file_hash, height, width, phash
+
+
+def read_index(index_path):
+    """
+    Read an index file written by `DatasetIndex.save`. Values are parsed
+    explicitly, so that e.g. content hashes made only of digits stay strings
+    and perceptual hashes keep all their 64 bits.
+    """
+    df = pd.read_csv(index_path, dtype=str, keep_default_na=False,
+                     na_values=[""])
+    for col in INT_COLS:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col]).astype(np.int64)
+    if "phash" in df.columns:
+        df["phash"] = pd.Series(
+            [None if pd.isna(h) else int(h) for h in df["phash"]],
+            index=df.index, dtype=object)
+    return df
+
+
+class DatasetIndex():
+    """Index of the images under `root_dir`, stored in a single csv file, so
+    that loading an index never executes code from it. For each image it
+    records relative path, file size, modification time, content hash, image
+    size, path to its *.xml annotation file, if any, and optionally its
+    perceptual hash (see `update`).
+
+    `update` only hashes files whose size or modification time changed since
+    the last update, so rescans of an unchanged dataset only cost one `stat`
+    per file. Scripts (consumers) can then ask for files they have not
+    processed yet with `pending`, and record progress with `mark_done`.
+
+    Parameters
+    ----------
+    root_dir : str
+    index_path : str
+        Path to the index file. If None, `root_dir/.vebits_index.csv`.
+    extensions : tuple of str
+        Extensions of files to be indexed.
+
+    """
+    def __init__(self, root_dir, index_path=None, extensions=IMG_EXTENSIONS):
+        self.root_dir = root_dir
+        if index_path is None:
+            index_path = os.path.join(root_dir, INDEX_NAME)
+        self.index_path = index_path
+        self.extensions = extensions
+
+        if os.path.isfile(index_path):
+            self.df = read_index(index_path)
+        else:
+            self.df = pd.DataFrame(columns=INDEX_COLS)
+        # Indices created by older versions may miss some columns
+        for col in INDEX_COLS:
+            if col not in self.df.columns:
+                self.df[col] = None
+        self.df = self.df.set_index("path", drop=False)
+
+    def __len__(self):
+        return self.df.shape[0]
+
+    def update(self, num_workers=None, chunk_size=64, perceptual=False):
+        """Rescan `root_dir` and update entries of new or changed files.
+
+        Parameters
+        ----------
+        num_workers : int
+            Number of processes. If None, use all CPUs.
+        chunk_size : int
+        perceptual : bool
+            Whether to also compute perceptual hashes (`phash` column), which
+            requires decoding images. They are computed for new or changed
+            files, and for files indexed without perceptual hash before.
+
+        Returns
+        -------
+        new, changed, removed : list of str
+            Relative paths of new, changed and removed files.
+
+        """
+        # Scan images and annotation files at once
+        scan = scan_dir(self.root_dir, tuple(self.extensions) + (".xml",))
+        is_xml = scan["path"].str.lower().str.endswith(".xml").to_numpy()
+        xml_paths = scan["path"][is_xml]
+        scan = scan[~is_xml].set_index("path", drop=False)
+        old = self.df.reindex(scan.index)
+
+        is_new = old["size"].isna().to_numpy()
+        is_changed = ~is_new & (
+            (old["size"].to_numpy() != scan["size"].to_numpy())
+            | (old["mtime_ns"].to_numpy() != scan["mtime_ns"].to_numpy()))
+        new = scan.index[is_new].tolist()
+        changed = scan.index[is_changed].tolist()
+        removed = self.df.index.difference(scan.index).tolist()
+
+        # Only hash files that are new or changed
+        to_describe = new + changed
+        tasks = [(self.root_dir, path, True, perceptual)
+                 for path in to_describe]
+        if perceptual:
+            missing = ~is_new & ~is_changed & old["phash"].isna().to_numpy()
+            to_phash = scan.index[missing].tolist()
+            tasks += [(self.root_dir, path, False, True) for path in to_phash]
+        if num_workers == 1 or len(tasks) < chunk_size:
+            described = list(map(describe_file, tasks))
+        else:
+            with Pool(num_workers) as pool:
+                described = pool.map(describe_file, tasks,
+                                     chunksize=chunk_size)
+
+        df = old.copy()
+        df["path"] = scan["path"]
+        df["size"] = scan["size"]
+        df["mtime_ns"] = scan["mtime_ns"]
+        if to_describe:
+            hashes, heights, widths, phashes = zip(
+                *described[:len(to_describe)])
+            df.loc[to_describe, "hash"] = hashes
+            df.loc[to_describe, "height"] = heights
+            df.loc[to_describe, "width"] = widths
+            df.loc[to_describe, "phash"] = pd.Series(
+                phashes, index=to_describe, dtype=object)
+        if perceptual and to_phash:
+            df.loc[to_phash, "phash"] = pd.Series(
+                [result[3] for result in described[len(to_describe):]],
+                index=to_phash, dtype=object)
+        # Annotation of `a/b.jpg` is `a/b.xml`, if it exists
+        stems = np.array([os.path.splitext(path)[0] for path in scan.index],
+                         dtype=object)
+        annotations = stems + ".xml" if len(stems) else stems
+        df["annotation"] = np.where(pd.Index(annotations).isin(xml_paths),
+                                    annotations, None)
+        self.df = df.loc[:, self._columns()]
+        return new, changed, removed
+
+    def _columns(self):
+        return INDEX_COLS + [col for col in self.df.columns
+                             if col.startswith(DONE_PREFIX)]
+
+    def save(self):
+        """
+        Save the index atomically, so that an interrupted save never leaves
+        a corrupted index behind.
+        """
+        tmp_path = self.index_path + ".tmp"
+        self.df.reset_index(drop=True).to_csv(tmp_path, index=False)
+        os.replace(tmp_path, self.index_path)
+
+    def pending(self, consumer):
+        """
+        Return relative paths (sorted) of files that `consumer` has never
+        processed, or whose content changed since it processed them.
+        """
+        col = DONE_PREFIX + consumer
+        if col not in self.df.columns:
+            return sorted(self.df.index.tolist())
+        mask = (self.df[col] != self.df["hash"]).to_numpy()
+        return sorted(self.df.index[mask].tolist())
+
+    def mark_done(self, consumer, paths):
+        """
+        Record that `consumer` has processed files in `paths` (relative
+        paths) in their current state. Call `save` to persist.
+        """
+        col = DONE_PREFIX + consumer
+        if col not in self.df.columns:
+            self.df[col] = None
+        paths = list(paths)
+        self.df.loc[paths, col] = self.df.loc[paths, "hash"].to_numpy()
+
+    def get(self, path):
+        """
+        Return the entry of a file as a pd.Series.
+        """
+        return self.df.loc[path]
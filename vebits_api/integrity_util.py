@@ -0,0 +1,206 @@
+"""Utilities to find corrupted images quickly. Headers and trailers of files
+are validated first; images are only fully decoded when they look suspect,
+or when sampled."""
+
+import os
+import csv
+import struct
+from multiprocessing import Pool
+
+import cv2
+import numpy as np
+
+JPEG_SOI = b"\xff\xd8\xff"
+JPEG_EOI = b"\xff\xd9"
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+PNG_IEND = b"\x00\x00\x00\x00IEND\xaeB`\x82"
+# Number of bytes read at the end of a file to look for its trailer
+TRAILER_SIZE = 1024
+
+OK = "ok"
+SUSPECT = "suspect"
+BAD = "bad"
+
+
+def check_header(img_path):
+    """Validate the header and trailer of a JPEG or PNG file without decoding.
+
+    Returns
+    -------
+    status : str
+        `OK`, `SUSPECT` (the file should be decoded to be sure) or `BAD`.
+    reason : str
+        Description of the problem, or None if status is `OK`.
+
+    """
+    try:
+        size = os.path.getsize(img_path)
+        with open(img_path, "rb") as f:
+            head = f.read(len(PNG_SIGNATURE))
+            f.seek(max(0, size - TRAILER_SIZE))
+            tail = f.read()
+    except OSError as e:
+        return BAD, "cannot read file: {}".format(e)
+
+    if size == 0:
+        return BAD, "empty file"
+
+    if head.startswith(JPEG_SOI):
+        if tail.endswith(JPEG_EOI):
+            return OK, None
+        # Some encoders append padding or metadata after the end marker
+        if JPEG_EOI in tail:
+            return SUSPECT, "data after JPEG end marker"
+        return BAD, "missing JPEG end marker (truncated file)"
+
+    if head == PNG_SIGNATURE:
+        if tail.endswith(PNG_IEND):
+            return OK, None
+        if PNG_IEND in tail:
+            return SUSPECT, "data after PNG IEND chunk"
+        return BAD, "missing PNG IEND chunk (truncated file)"
+
+    return SUSPECT, "unknown image format"
+
+
+def read_image_size(img_path):
+    """Read `(height, width)` of a JPEG or PNG image from its header, without
+    decoding it. Fall back to decoding for other formats. Return None if the
+    size cannot be determined.
+    """
+    with open(img_path, "rb") as f:
+        head = f.read(len(PNG_SIGNATURE))
+        if head == PNG_SIGNATURE:
+            # IHDR chunk: length (4), type (4), width (4), height (4)
+            ihdr = f.read(16)
+            if len(ihdr) == 16 and ihdr[4:8] == b"IHDR":
+                width, height = struct.unpack(">II", ihdr[8:16])
+                return height, width
+            return None
+
+        if head.startswith(JPEG_SOI):
+            f.seek(2)
+            while True:
+                marker = f.read(2)
+                if len(marker) < 2 or marker[0] != 0xFF:
+                    return None
+                # Skip padding bytes
+                while marker[1] == 0xFF:
+                    byte = f.read(1)
+                    if not byte:
+                        return None
+                    marker = marker[1:] + byte
+                code = marker[1]
+                # Markers without payload
+                if code == 0x01 or 0xD0 <= code <= 0xD9:
+                    continue
+                length = f.read(2)
+                if len(length) < 2:
+                    return None
+                length = struct.unpack(">H", length)[0]
+                # Start of frame markers, excluding DHT, JPG and DAC
+                if 0xC0 <= code <= 0xCF and code not in (0xC4, 0xC8, 0xCC):
+                    frame = f.read(5)
+                    if len(frame) < 5:
+                        return None
+                    height, width = struct.unpack(">HH", frame[1:5])
+                    return height, width
+                f.seek(length - 2, os.SEEK_CUR)
+
+    img = cv2.imread(img_path)
+    return None if img is None else img.shape[:2]
+
+
+def check_decode(img_path):
+    """
+    Fully decode an image. Return None if succeeded, or the reason of
+    failure otherwise.
+    """
+    try:
+        with open(img_path, "rb") as f:
+            buffer = np.frombuffer(f.read(), dtype=np.uint8)
+    except OSError as e:
+        return "cannot read file: {}".format(e)
+    if cv2.imdecode(buffer, cv2.IMREAD_UNCHANGED) is None:
+        return "cannot decode image"
+    return None
+
+
+def check_image(img_path, full_decode=False):
+    """
+    Check a single image. It is decoded only if its header or trailer looks
+    suspect, or if `full_decode` is True. Return None if the image is valid,
+    or the reason why it is corrupted otherwise.
+    """
+    status, reason = check_header(img_path)
+    if status == BAD:
+        return reason
+    if status == SUSPECT or full_decode:
+        decode_reason = check_decode(img_path)
+        if decode_reason is not None:
+            return decode_reason if reason is None else "{}, {}".format(
+                reason, decode_reason)
+    return None
+
+
+def _check_images(args):
+    """
+    Worker function used to check a chunk of images. Return number of images
+    checked and a list of `(img_path, reason)` of corrupted images.
+    """
+    results = []
+    for img_path, full_decode in args:
+        reason = check_image(img_path, full_decode)
+        if reason is not None:
+            results.append((img_path, reason))
+    return len(args), results
+
+
+def scan_images(img_paths, num_workers=None, sample_rate=0.0,
+                seed=None, chunk_size=64):
+    """Check many images in parallel.
+
+    Parameters
+    ----------
+    img_paths : list of str
+    num_workers : int
+        Number of processes. If None, use all CPUs. If 1, images are checked
+        in the calling process.
+    sample_rate : float
+        Fraction of images that are fully decoded even if their headers and
+        trailers are valid. Use 1.0 to decode all images.
+    seed : int
+        Seed used to sample images to decode.
+    chunk_size : int
+        Number of images checked per task.
+
+    Returns
+    -------
+    generator
+        Yields `(num_checked, corrupted)` for each finished chunk, where
+        `corrupted` is a list of `(img_path, reason)`.
+
+    """
+    rng = np.random.RandomState(seed)
+    full_decode = rng.random_sample(len(img_paths)) < sample_rate
+    tasks = [list(zip(img_paths[i:i + chunk_size],
+                      full_decode[i:i + chunk_size]))
+             for i in range(0, len(img_paths), chunk_size)]
+
+    if num_workers == 1:
+        for task in tasks:
+            yield _check_images(task)
+    else:
+        with Pool(num_workers) as pool:
+            for result in pool.imap_unordered(_check_images, tasks):
+                yield result
+
+
+def write_report(corrupted, report_path):
+    """
+    Write a list of `(img_path, reason)` to a csv file.
+    """
+    with open(report_path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["path", "reason"])
+        writer.writerows(sorted(corrupted))
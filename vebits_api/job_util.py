@@ -0,0 +1,199 @@
+"""Utilities to make long batch jobs resumable: outputs are written atomically,
+and completed work is recorded in a journal so that it can be skipped after
+a restart."""
+
+import os
+import json
+from contextlib import contextmanager
+
+
+def get_tmp_path(path):
+    """
+    Return a temporary path in the same directory as `path` (so that it can
+    be renamed to `path` atomically), keeping its extension.
+    """
+    head, tail = os.path.split(path)
+    return os.path.join(head, ".{}.{}.tmp{}".format(
+        tail, os.getpid(), os.path.splitext(tail)[1]))
+
+
+@contextmanager
+def atomic_path(path):
+    """Context manager yielding a temporary path, which is renamed to `path`
+    when the block exits without error, or removed otherwise. Hence `path`
+    either does not exist or is complete, even if the process is killed.
+
+    Examples
+    --------
+    >>> with atomic_path("a.jpg") as tmp_path:
+    ...     cv2.imwrite(tmp_path, img)
+
+    """
+    tmp_path = get_tmp_path(path)
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def atomic_write(path, data):
+    """
+    Write `data` (str or bytes) to `path` atomically.
+    """
+    mode = "wb" if isinstance(data, bytes) else "w"
+    with atomic_path(path) as tmp_path:
+        with open(tmp_path, mode) as f:
+            f.write(data)
+
+
+def fsync_paths(paths):
+    """
+    Flush files in `paths`, and the directories they were renamed in, to
+    disk, so that they survive a power loss.
+    """
+    dirs = set()
+    for path in paths:
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        dirs.add(os.path.dirname(os.path.abspath(path)))
+    # Directories cannot be opened on Windows, where renames are durable
+    if os.name == "nt":
+        return
+    for dir_path in dirs:
+        fd = os.open(dir_path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+class JobJournal():
+    """Append-only journal of the progress of a job, stored as JSON lines.
+
+    Each call to `commit` appends one line and flushes it to disk, so that it
+    survives a crash. A line may record completed items (e.g. input images),
+    arbitrary progress values (e.g. the frame index reached in a video) and
+    values appended to named records (e.g. hashes of frames kept so far).
+    A partially written last line (crash during `commit`) is ignored and
+    removed when the journal is loaded.
+
+    Parameters
+    ----------
+    journal_path : str
+        Path to the journal. It is created if it does not exist; otherwise,
+        its content is loaded.
+    fsync : bool
+        Whether to `fsync` outputs before each commit and the journal after
+        it. Disable only if losing the last commits on power loss is
+        acceptable.
+
+    """
+    def __init__(self, journal_path, fsync=True):
+        self.journal_path = journal_path
+        self.fsync = fsync
+        self.done = set()
+        self.progress = {}
+        self.records = {}
+
+        if os.path.isfile(journal_path):
+            self._load()
+        self.file = open(journal_path, "a")
+
+    def _load(self):
+        # Offset of the end of the last complete line
+        end = 0
+        with open(self.journal_path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    # Partial line written during a crash
+                    break
+                end += len(line)
+                try:
+                    entry = json.loads(line.decode("utf-8"))
+                except ValueError:
+                    continue
+                self.done.update(entry.get("items", []))
+                self.progress.update(entry.get("progress", {}))
+                for name, values in entry.get("records", {}).items():
+                    self.records.setdefault(name, []).extend(values)
+        # Remove the partial line, lest the next commit is appended to it
+        if end < os.path.getsize(self.journal_path):
+            with open(self.journal_path, "r+b") as f:
+                f.truncate(end)
+                f.flush()
+                if self.fsync:
+                    os.fsync(f.fileno())
+
+    def __contains__(self, item):
+        return item in self.done
+
+    def __len__(self):
+        return len(self.done)
+
+    def is_done(self, item):
+        return item in self.done
+
+    def get_progress(self, key, default=None):
+        return self.progress.get(key, default)
+
+    def get_records(self, name):
+        """
+        Return all values appended to record `name` so far, in order.
+        """
+        return list(self.records.get(name, []))
+
+    def commit(self, items=(), progress=None, records=None, outputs=()):
+        """Record completed `items` (list of str), update `progress` (a
+        JSON-serializable dict) and append values to `records` (a dict of
+        lists of JSON-serializable values). Call this only after all outputs
+        of the items have been written. If `fsync` is True, files in
+        `outputs` are flushed to disk first, so that the journal never
+        records work whose outputs could still be lost.
+        """
+        entry = {}
+        items = list(items)
+        if items:
+            entry["items"] = items
+        if progress:
+            entry["progress"] = progress
+        records = {name: list(values)
+                   for name, values in (records or {}).items() if values}
+        if records:
+            entry["records"] = records
+        if not entry:
+            return
+        if self.fsync:
+            fsync_paths(outputs)
+        self.file.write(json.dumps(entry) + "\n")
+        self.file.flush()
+        if self.fsync:
+            os.fsync(self.file.fileno())
+        self.done.update(items)
+        self.progress.update(progress or {})
+        for name, values in records.items():
+            self.records.setdefault(name, []).extend(values)
+
+    def compact(self):
+        """
+        Rewrite the journal as a single line, atomically.
+        """
+        entry = {"items": sorted(self.done), "progress": self.progress,
+                 "records": self.records}
+        self.file.close()
+        atomic_write(self.journal_path, json.dumps(entry) + "\n")
+        self.file = open(self.journal_path, "a")
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
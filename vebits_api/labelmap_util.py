@@ -98,16 +98,17 @@ def convert_label_map_to_categories(label_map,
     return categories
 
 
-@check_import([tf_imported], ["tensorflow"])
 def load_labelmap(path):
     """Loads label map proto.
 
     Args:
-      path: path to StringIntLabelMap proto text file.
+      path: path to StringIntLabelMap proto text file. Tensorflow is only
+        required for paths on remote file systems (e.g. gs://).
     Returns:
       a StringIntLabelMapProto
     """
-    with tf.gfile.GFile(path, 'r') as fid:
+    open_file = tf.gfile.GFile if tf_imported else open
+    with open_file(path, 'r') as fid:
         label_map_string = fid.read()
         label_map = string_int_label_map_pb2.StringIntLabelMap()
         try:
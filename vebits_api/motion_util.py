@@ -0,0 +1,141 @@
+"""Cheap motion detection on frames of fixed cameras, used to skip inference
+on frames where nothing changed and reuse previous detections instead."""
+
+import cv2
+import numpy as np
+
+from . import timing_util
+from .hash_util import _downsample
+
+MOTION_METHODS = ("diff", "mog2")
+
+
+class MotionGate():
+    """Decide whether a frame must be detected again, from a motion score
+    computed on a downscaled grayscale copy of it: the fraction of pixels
+    which changed since the last detected frame ("diff"), or which are
+    foreground for a MOG2 background model ("mog2"). Frames without motion
+    are skipped, but a detection is forced every `refresh_interval` frames
+    so that detections do not become stale.
+
+    Parameters
+    ----------
+    threshold : float
+        Fraction of pixels which must change for a frame to be detected.
+    refresh_interval : int
+        Maximum number of frames between two detections. If None, frames are
+        only detected on motion.
+    width : int
+        Width to which frames are downscaled, keeping their aspect ratio.
+    pixel_threshold : int
+        Minimum difference of gray levels (0-255) for a pixel to change, with
+        method "diff". Lower values are more sensitive to noise.
+    blur : int
+        Size of the Gaussian kernel smoothing downscaled frames, to reduce
+        noise. 0 to disable.
+    method : str
+        "diff" compares frames with the last detected frame, so that slow
+        motion accumulates until it is detected. "mog2" uses a background
+        model, which is more robust to noise and flickering but slower and
+        eventually ignores objects which stopped moving (until the next
+        refresh).
+
+    Examples
+    --------
+    >>> gate = MotionGate(threshold=0.005, refresh_interval=30)
+    >>> for frame in stream:
+    ...     if gate.should_detect(frame):
+    ...         boxes, scores, classes = detect(frame)
+    >>> print(gate.summary())
+
+    """
+    def __init__(self, threshold=0.005, refresh_interval=30, width=160,
+                 pixel_threshold=25, blur=5, method="diff"):
+        if method not in MOTION_METHODS:
+            raise ValueError("Unknown motion method: {}. Available methods: "
+                             "{}.".format(method, ", ".join(MOTION_METHODS)))
+        self.threshold = threshold
+        self.refresh_interval = refresh_interval
+        self.width = width
+        self.pixel_threshold = pixel_threshold
+        self.blur = blur
+        self.method = method
+        self.reset()
+
+    def reset(self):
+        """
+        Forget the reference frame (or background model) and counters, e.g.
+        when switching to another camera.
+        """
+        self.reference = None
+        self.subtractor = None
+        if self.method == "mog2":
+            self.subtractor = cv2.createBackgroundSubtractorMOG2(
+                detectShadows=False)
+        self.num_frames = 0
+        self.num_detected = 0
+        self.num_since_detection = 0
+        self.last_score = None
+
+    def preprocess(self, frame):
+        """
+        Return a downscaled, grayscale and blurred copy of `frame`.
+        """
+        height, width = frame.shape[:2]
+        small = _downsample(frame, self.width,
+                            max(1, int(round(height * self.width / width))))
+        if self.blur > 0:
+            small = cv2.GaussianBlur(small, (self.blur, self.blur), 0)
+        return small
+
+    def score(self, small):
+        """
+        Return the fraction of pixels of a preprocessed frame in motion. The
+        background model of method "mog2" is updated.
+        """
+        if self.method == "mog2":
+            return float(np.count_nonzero(self.subtractor.apply(small))
+                         / small.size)
+        if self.reference is None or self.reference.shape != small.shape:
+            return 1.0
+        changed = cv2.absdiff(small, self.reference) > self.pixel_threshold
+        return float(np.count_nonzero(changed) / small.size)
+
+    def should_detect(self, frame):
+        """
+        Return True if `frame` must be detected, in which case it becomes the
+        reference frame. Must be called on every frame, in order.
+        """
+        with timing_util.stage("motion_gate"):
+            small = self.preprocess(frame)
+            self.last_score = self.score(small)
+            self.num_frames += 1
+            detect = (self.num_detected == 0
+                      or self.last_score > self.threshold
+                      or (self.refresh_interval is not None
+                          and self.num_since_detection + 1
+                          >= self.refresh_interval))
+            if detect:
+                self.reference = small
+                self.num_detected += 1
+                self.num_since_detection = 0
+            else:
+                self.num_since_detection += 1
+            return detect
+
+    @property
+    def num_skipped(self):
+        return self.num_frames - self.num_detected
+
+    @property
+    def skip_ratio(self):
+        """
+        Fraction of frames whose detection was skipped so far.
+        """
+        return self.num_skipped / self.num_frames if self.num_frames else 0.0
+
+    def summary(self):
+        return {"num_frames": self.num_frames,
+                "num_detected": self.num_detected,
+                "num_skipped": self.num_skipped,
+                "skip_ratio": self.skip_ratio}
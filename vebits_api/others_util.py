@@ -1,3 +1,4 @@
+import os
 from functools import wraps
 
 
@@ -0,0 +1,210 @@
+"""Shared memory utilities to pass images between processes by slot index
+instead of by value (pickling)."""
+
+from multiprocessing import Queue
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+
+class SharedFramePool():
+    """A fixed number of equally-shaped frame slots backed by a single block
+    of shared memory. Processes exchange slot indices, which are cheap to
+    pickle, while frames themselves are written and read in place.
+
+    The pool can be passed as an argument to `multiprocessing.Process`; the
+    child process attaches to the same block of memory by name.
+
+    Parameters
+    ----------
+    num_slots : int
+        Maximum number of frames that can be held at a time.
+    frame_shape : tuple-like
+        Shape of each frame, e.g. `(height, width, 3)`.
+    dtype : numpy dtype
+        Data type of frames. Default: uint8.
+
+    """
+    def __init__(self, num_slots, frame_shape, dtype=np.uint8):
+        self.num_slots = num_slots
+        self.frame_shape = tuple(frame_shape)
+        self.dtype = np.dtype(dtype)
+
+        size = num_slots * int(np.prod(self.frame_shape)) * self.dtype.itemsize
+        self.shm = SharedMemory(create=True, size=size)
+        self.owner = True
+        self.closed = False
+        # Indices of slots available for writing
+        self.free_slots = Queue(maxsize=num_slots)
+        for slot in range(num_slots):
+            self.free_slots.put(slot)
+        self._get_frames()
+
+    def _get_frames(self):
+        self.frames = np.ndarray((self.num_slots,) + self.frame_shape,
+                                 dtype=self.dtype, buffer=self.shm.buf)
+
+    def __getstate__(self):
+        return {"num_slots": self.num_slots, "frame_shape": self.frame_shape,
+                "dtype": self.dtype, "name": self.shm.name,
+                "free_slots": self.free_slots}
+
+    def __setstate__(self, state):
+        self.num_slots = state["num_slots"]
+        self.frame_shape = state["frame_shape"]
+        self.dtype = state["dtype"]
+        self.free_slots = state["free_slots"]
+        self.shm = SharedMemory(name=state["name"])
+        self.owner = False
+        self.closed = False
+        self._get_frames()
+
+    def acquire(self, block=True, timeout=None):
+        """
+        Reserve a free slot and return its index. Raise `queue.Empty` if
+        no slot is available within `timeout`.
+        """
+        return self.free_slots.get(block, timeout)
+
+    def release(self, slot):
+        """
+        Return a slot to the pool. The frame in it must no longer be used.
+        """
+        self.free_slots.put(slot)
+
+    def put(self, frame, block=True, timeout=None):
+        """
+        Copy `frame` into a free slot and return the slot index.
+        """
+        if frame.shape != self.frame_shape:
+            raise ValueError("Frame must be of shape {}, got shape {} "
+                             "instead".format(self.frame_shape, frame.shape))
+        slot = self.acquire(block, timeout)
+        self.frames[slot] = frame
+        return slot
+
+    def get(self, slot):
+        """
+        Return the frame in `slot`. Note that this is a view of the shared
+        memory, which is only valid until the slot is released.
+        """
+        return self.frames[slot]
+
+    def close(self):
+        """
+        Detach from the shared memory. The process that created the pool
+        also frees the memory. Closing more than once has no effect.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        self.frames = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+class SharedArray():
+    """A numpy array backed by shared memory. Like `SharedFramePool`, it can
+    be passed to other processes, which attach to the same memory by name,
+    so that they can write results read by the parent in place.
+
+    Parameters
+    ----------
+    shape : tuple-like
+    dtype : numpy dtype
+        Default: float32.
+
+    """
+    def __init__(self, shape, dtype=np.float32):
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+
+        size = max(int(np.prod(self.shape)) * self.dtype.itemsize, 1)
+        self.shm = SharedMemory(create=True, size=size)
+        self.owner = True
+        self.closed = False
+        self._get_array()
+
+    def _get_array(self):
+        self.array = np.ndarray(self.shape, dtype=self.dtype,
+                                buffer=self.shm.buf)
+
+    def __getstate__(self):
+        return {"shape": self.shape, "dtype": self.dtype,
+                "name": self.shm.name}
+
+    def __setstate__(self, state):
+        self.shape = state["shape"]
+        self.dtype = state["dtype"]
+        self.shm = SharedMemory(name=state["name"])
+        self.owner = False
+        self.closed = False
+        self._get_array()
+
+    def close(self):
+        """
+        Detach from the shared memory. The process that created the array
+        also frees the memory. Closing more than once has no effect.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        self.array = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+class SharedFrameQueue():
+    """
+    Queue of frames backed by a `SharedFramePool`. This has the same
+    signatures as `detector_util.QueueWithID`, except that frames are
+    written to shared memory and only `(slot, object_id)` goes through the
+    underlying `multiprocessing.Queue`.
+    """
+    def __init__(self, pool):
+        self.pool = pool
+        self.queue = Queue(maxsize=pool.num_slots + 1)
+
+    def put(self, frame, object_id, block=True, timeout=None):
+        slot = self.pool.put(frame, block, timeout)
+        self.queue.put((slot, object_id))
+        return slot
+
+    def put_slot(self, slot, object_id):
+        """
+        Pass a slot that has already been filled, e.g. by `pool.acquire`
+        and writing to `pool.get(slot)` directly, to avoid one more copy.
+        """
+        self.queue.put((slot, object_id))
+
+    def put_end(self):
+        """
+        Signal consumers that no more frames will be put.
+        """
+        self.queue.put((None, None))
+
+    def get(self, block=True, timeout=None):
+        """
+        Return `(frame, object_id, slot)`. `frame` is a view of the shared
+        memory, and `slot` must be released with `release` once the frame
+        is no longer needed. Return `(None, None, None)` at the end.
+        """
+        slot, object_id = self.queue.get(block, timeout)
+        if slot is None:
+            return None, None, None
+        return self.pool.get(slot), object_id, slot
+
+    def release(self, slot):
+        self.pool.release(slot)
+
+    def qsize(self):
+        return self.queue.qsize()
+
+    def full(self):
+        return self.queue.qsize() >= self.pool.num_slots
+
+    def close(self):
+        self.queue.close()
+        self.pool.close()
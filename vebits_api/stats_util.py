@@ -0,0 +1,329 @@
+"""Statistics of bounding box annotations (class counts, box size and aspect
+ratio distributions, invalid boxes, ...) computed in vectorized passes over
+columnar annotations, and anchor sizes by k-means clustering."""
+
+import json
+
+import numpy as np
+import pandas as pd
+
+from .bbox_util import BBOX_COLS
+
+# Fixed bin edges, so that histograms of different chunks can be merged
+SIZE_BINS = np.r_[0, np.geomspace(1, 16384, 57)]
+ASPECT_BINS = np.linspace(-4, 4, 33)  # log2(width / height)
+RELATIVE_BINS = np.linspace(0, 1, 21)  # sqrt(box area / image area)
+
+
+def _histogram(values, bins):
+    """
+    Same as `np.histogram(values, bins)[0]`, except that values out of range
+    are counted in the first or last bin.
+    """
+    indices = np.clip(np.searchsorted(bins, values, side="right") - 1,
+                      0, len(bins) - 2)
+    return np.bincount(indices, minlength=len(bins) - 1)
+
+
+class DatasetStats():
+    """Accumulator of statistics over annotations. Call `update` with each
+    chunk of annotations (see `annotation_util.iter_annotations`), then
+    `summary` or `format_report`. Accumulators of different chunks or
+    datasets can be combined with `merge`.
+
+    Parameters
+    ----------
+    num_anchor_samples : int
+        Maximum number of boxes kept (uniformly sampled) to compute anchors
+        with `get_anchors`.
+    seed : int
+        Seed used to sample boxes.
+
+    """
+    def __init__(self, num_anchor_samples=1000000, seed=None):
+        self.num_anchor_samples = num_anchor_samples
+        self.rng = np.random.RandomState(seed)
+
+        self.num_boxes = 0
+        self.num_degenerate = 0
+        self.num_out_of_bounds = 0
+        self.class_counts = pd.Series(dtype=np.int64)
+        self.class_size_sums = pd.Series(dtype=np.float64)
+        self.image_counts = pd.Series(dtype=np.int64)
+        self.width_hist = np.zeros(len(SIZE_BINS) - 1, dtype=np.int64)
+        self.height_hist = np.zeros(len(SIZE_BINS) - 1, dtype=np.int64)
+        self.size_hist = np.zeros(len(SIZE_BINS) - 1, dtype=np.int64)
+        self.aspect_hist = np.zeros(len(ASPECT_BINS) - 1, dtype=np.int64)
+        self.relative_hist = np.zeros(len(RELATIVE_BINS) - 1, dtype=np.int64)
+        # Sampled boxes (width, height, image width, image height) and their
+        # random sampling keys: the boxes with the smallest keys are kept
+        self.samples = np.empty((0, 4), dtype=np.float32)
+        self.sample_keys = np.empty(0, dtype=np.float64)
+
+    def update(self, df):
+        """
+        Update statistics with a dataframe of annotations with columns
+        `filename, width, height, class, xmin, ymin, xmax, ymax`.
+        """
+        boxes = df.loc[:, BBOX_COLS].to_numpy(dtype=np.float64)
+        img_w = df["width"].to_numpy(dtype=np.float64)
+        img_h = df["height"].to_numpy(dtype=np.float64)
+        w = boxes[:, 2] - boxes[:, 0]
+        h = boxes[:, 3] - boxes[:, 1]
+
+        self.num_boxes += len(df)
+        degenerate = (w <= 0) | (h <= 0)
+        self.num_degenerate += int(degenerate.sum())
+        self.num_out_of_bounds += int(((boxes[:, 0] < 0) | (boxes[:, 1] < 0)
+                                       | (boxes[:, 2] > img_w)
+                                       | (boxes[:, 3] > img_h)).sum())
+
+        classes = df["class"].to_numpy()
+        size = np.sqrt(np.clip(w, 0, None) * np.clip(h, 0, None))
+        self.class_counts = self.class_counts.add(
+            pd.Series(classes).value_counts(), fill_value=0)
+        self.class_size_sums = self.class_size_sums.add(
+            pd.Series(size).groupby(classes).sum(), fill_value=0)
+        self.image_counts = self.image_counts.add(
+            df["filename"].value_counts(), fill_value=0)
+
+        self.width_hist += _histogram(w, SIZE_BINS)
+        self.height_hist += _histogram(h, SIZE_BINS)
+        self.size_hist += _histogram(size, SIZE_BINS)
+        # Aspect ratio and relative size are only defined for valid boxes
+        valid = ~degenerate & (img_w > 0) & (img_h > 0)
+        self.aspect_hist += _histogram(np.log2(w[valid] / h[valid]),
+                                       ASPECT_BINS)
+        self.relative_hist += _histogram(
+            size[valid] / np.sqrt(img_w[valid] * img_h[valid]), RELATIVE_BINS)
+
+        self._sample(np.stack([w[valid], h[valid], img_w[valid],
+                               img_h[valid]], axis=1))
+
+    def _sample(self, samples):
+        keys = self.rng.random_sample(len(samples))
+        self._keep_samples(np.concatenate([self.samples, samples]),
+                           np.concatenate([self.sample_keys, keys]))
+
+    def _keep_samples(self, samples, keys):
+        if len(keys) > self.num_anchor_samples:
+            kept = np.argpartition(keys, self.num_anchor_samples)[
+                :self.num_anchor_samples]
+            samples, keys = samples[kept], keys[kept]
+        self.samples = samples.astype(np.float32)
+        self.sample_keys = keys
+
+    def merge(self, other):
+        """
+        Add statistics accumulated by another `DatasetStats`.
+        """
+        self.num_boxes += other.num_boxes
+        self.num_degenerate += other.num_degenerate
+        self.num_out_of_bounds += other.num_out_of_bounds
+        self.class_counts = self.class_counts.add(other.class_counts,
+                                                  fill_value=0)
+        self.class_size_sums = self.class_size_sums.add(other.class_size_sums,
+                                                        fill_value=0)
+        self.image_counts = self.image_counts.add(other.image_counts,
+                                                  fill_value=0)
+        for name in ["width_hist", "height_hist", "size_hist",
+                     "aspect_hist", "relative_hist"]:
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+        self._keep_samples(np.concatenate([self.samples, other.samples]),
+                           np.concatenate([self.sample_keys,
+                                           other.sample_keys]))
+        return self
+
+    @property
+    def num_images(self):
+        return len(self.image_counts)
+
+    def get_anchors(self, num_anchors=9, relative=False, **kwargs):
+        """
+        Compute anchors from sampled boxes with `kmeans_anchors`. If
+        `relative` is True, box sizes are divided by image sizes first.
+        """
+        wh = self.samples[:, :2].astype(np.float64)
+        if relative:
+            wh = wh / self.samples[:, 2:]
+        return kmeans_anchors(wh, num_anchors, **kwargs)
+
+    def summary(self):
+        """
+        Return statistics as a JSON-serializable dictionary.
+        """
+        boxes_per_image = self.image_counts.to_numpy(dtype=np.int64)
+        class_counts = self.class_counts.sort_values(ascending=False)
+        class_mean_sizes = (self.class_size_sums / self.class_counts)
+        return {
+            "num_images": self.num_images,
+            "num_boxes": self.num_boxes,
+            "num_degenerate_boxes": self.num_degenerate,
+            "num_out_of_bounds_boxes": self.num_out_of_bounds,
+            "classes": {str(cl): {"count": int(count),
+                                  "mean_size": float(class_mean_sizes[cl])}
+                        for cl, count in class_counts.items()},
+            "boxes_per_image": {
+                "mean": float(boxes_per_image.mean())
+                if len(boxes_per_image) else 0.0,
+                "max": int(boxes_per_image.max())
+                if len(boxes_per_image) else 0,
+                "histogram": np.bincount(boxes_per_image).tolist()},
+            "histograms": {
+                "width": {"bins": SIZE_BINS.tolist(),
+                          "counts": self.width_hist.tolist()},
+                "height": {"bins": SIZE_BINS.tolist(),
+                           "counts": self.height_hist.tolist()},
+                "size": {"bins": SIZE_BINS.tolist(),
+                         "counts": self.size_hist.tolist()},
+                "log2_aspect_ratio": {"bins": ASPECT_BINS.tolist(),
+                                      "counts": self.aspect_hist.tolist()},
+                "relative_size": {"bins": RELATIVE_BINS.tolist(),
+                                  "counts": self.relative_hist.tolist()}},
+        }
+
+    def format_report(self):
+        """
+        Return a human-readable report of the main statistics.
+        """
+        summary = self.summary()
+        lines = ["Images: {}".format(summary["num_images"]),
+                 "Boxes: {}".format(summary["num_boxes"]),
+                 "Degenerate boxes: {}".format(
+                     summary["num_degenerate_boxes"]),
+                 "Out-of-bounds boxes: {}".format(
+                     summary["num_out_of_bounds_boxes"]),
+                 "Boxes per image: mean {:.2f}, max {}".format(
+                     summary["boxes_per_image"]["mean"],
+                     summary["boxes_per_image"]["max"]),
+                 "Classes (count, mean sqrt(area) in pixels):"]
+        for cl, stats in summary["classes"].items():
+            lines.append("    {}: {} ({:.1f})".format(cl, stats["count"],
+                                                     stats["mean_size"]))
+        lines.append("Box size (sqrt(area) in pixels):")
+        lines.extend(_format_histogram(SIZE_BINS, self.size_hist))
+        lines.append("Aspect ratio (width / height):")
+        lines.extend(_format_histogram(2 ** ASPECT_BINS, self.aspect_hist))
+        return "\n".join(lines)
+
+    def to_json(self, json_path, **extra):
+        """
+        Write `summary()`, updated with `extra` items, to a JSON file.
+        """
+        summary = self.summary()
+        summary.update(extra)
+        with open(json_path, "w") as f:
+            json.dump(summary, f, indent=2)
+
+
+def _format_histogram(bins, counts, width=40):
+    nonzero = np.flatnonzero(counts)
+    if not len(nonzero):
+        return []
+    lines = []
+    max_count = counts.max()
+    for i in range(nonzero[0], nonzero[-1] + 1):
+        lines.append("    [{:8.2f}, {:8.2f}) {:>10} {}".format(
+            bins[i], bins[i + 1], counts[i],
+            "#" * int(round(width * counts[i] / max_count))))
+    return lines
+
+
+def compute_stats(chunks, **kwargs):
+    """
+    Compute `DatasetStats` over an iterable of dataframes, e.g.
+    `annotation_util.iter_annotations(path)`.
+    """
+    stats = DatasetStats(**kwargs)
+    for df in chunks:
+        stats.update(df)
+    return stats
+
+
+def wh_iou(wh, anchors):
+    """
+    IoU between boxes and anchors of shape (n, 2) and (k, 2), given as
+    `(width, height)` and aligned at their top-left corners. Return an array
+    of shape (n, k).
+    """
+    inter = (np.minimum(wh[:, None, 0], anchors[None, :, 0])
+             * np.minimum(wh[:, None, 1], anchors[None, :, 1]))
+    union = (wh[:, 0] * wh[:, 1])[:, None] + anchors[:, 0] * anchors[:, 1] \
+        - inter
+    return inter / union
+
+
+def kmeans_anchors(wh, num_anchors=9, num_iters=100, seed=None,
+                   chunk_size=1000000):
+    """Cluster box sizes with k-means using `1 - IoU` as distance, as done to
+    select anchors of YOLO.
+
+    Identical sizes (common, since coordinates are integers) are merged and
+    weighted by their count, and distances are computed by chunks, so that
+    millions of boxes are clustered in seconds.
+
+    Parameters
+    ----------
+    wh : array-like
+        Array of shape (n, 2) of box widths and heights.
+    num_anchors : int
+    num_iters : int
+        Maximum number of iterations.
+    seed : int
+        Seed of the k-means++ initialization.
+    chunk_size : int
+        Number of sizes per chunk when computing distances.
+
+    Returns
+    -------
+    anchors : ndarray
+        Array of shape (num_anchors, 2), sorted by area.
+    mean_iou : float
+        Mean IoU between each box and its closest anchor.
+
+    """
+    wh = np.asarray(wh, dtype=np.float64)
+    wh = wh[(wh > 0).all(axis=1)]
+    # Unique rows, packed as complex numbers (much faster than `axis=0`)
+    unique, weights = np.unique(wh[:, 0] + 1j * wh[:, 1], return_counts=True)
+    wh = np.stack([unique.real, unique.imag], axis=1)
+    weights = weights.astype(np.float64)
+    if len(wh) <= num_anchors:
+        return wh[np.argsort(wh.prod(axis=1))], 1.0
+
+    def assign(anchors):
+        labels = np.empty(len(wh), dtype=np.int64)
+        best = np.empty(len(wh))
+        for start in range(0, len(wh), chunk_size):
+            iou = wh_iou(wh[start:start + chunk_size], anchors)
+            labels[start:start + chunk_size] = iou.argmax(axis=1)
+            best[start:start + chunk_size] = iou.max(axis=1)
+        return labels, best
+
+    # k-means++ initialization
+    rng = np.random.RandomState(seed)
+    anchors = wh[[rng.choice(len(wh), p=weights / weights.sum())]]
+    best = wh_iou(wh, anchors)[:, 0]
+    for _ in range(1, num_anchors):
+        distances = weights * (1 - best)
+        anchor = wh[rng.choice(len(wh), p=distances / distances.sum())]
+        anchors = np.vstack([anchors, anchor])
+        best = np.maximum(best, wh_iou(wh, anchor[None])[:, 0])
+
+    labels = None
+    for _ in range(num_iters):
+        new_labels, best = assign(anchors)
+        if labels is not None and np.array_equal(labels, new_labels):
+            break
+        labels = new_labels
+        # Weighted mean of each cluster; empty clusters keep their anchor
+        totals = np.bincount(labels, weights=weights, minlength=num_anchors)
+        for dim in range(2):
+            sums = np.bincount(labels, weights=weights * wh[:, dim],
+                               minlength=num_anchors)
+            anchors[:, dim] = np.where(totals > 0, sums / np.maximum(
+                totals, 1e-12), anchors[:, dim])
+
+    _, best = assign(anchors)
+    mean_iou = float((best * weights).sum() / weights.sum())
+    return anchors[np.argsort(anchors.prod(axis=1))], mean_iou
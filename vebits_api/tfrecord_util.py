@@ -0,0 +1,420 @@
+"""Utilities to write TFRecord files of Tensorflow Object Detection API
+format without Tensorflow. `tf.train.Example` messages are built from
+their protobuf definitions directly."""
+
+import os
+import struct
+from threading import Lock
+from multiprocessing import Pool
+
+import numpy as np
+from google.protobuf import descriptor_pb2, descriptor_pool
+# Try importing a fast implementation of CRC32C
+try:
+    from crc32c import crc32c as _crc32c
+    crc32c_imported = True
+except ModuleNotFoundError:
+    crc32c_imported = False
+
+from .bbox_util import BBOX_COLS, get_filename_index
+
+
+def _build_example_classes():
+    """
+    Build message classes equivalent to `tf.train.Example` and its fields,
+    as defined in `tensorflow/core/example/{example,feature}.proto`. A
+    private descriptor pool is used to avoid conflicts with Tensorflow.
+    """
+    F = descriptor_pb2.FieldDescriptorProto
+    file_proto = descriptor_pb2.FileDescriptorProto(
+        name="vebits_api/example.proto", package="tensorflow",
+        syntax="proto3")
+
+    def add_message(name, fields, parent=None):
+        message = (parent.nested_type if parent else file_proto.message_type).add()
+        message.name = name
+        for number, (field_name, field_type, label, type_name) in enumerate(fields, 1):
+            field = message.field.add(name=field_name, number=number,
+                                      type=field_type, label=label)
+            if type_name is not None:
+                field.type_name = type_name
+        return message
+
+    repeated, optional = F.LABEL_REPEATED, F.LABEL_OPTIONAL
+    add_message("BytesList", [("value", F.TYPE_BYTES, repeated, None)])
+    add_message("FloatList", [("value", F.TYPE_FLOAT, repeated, None)])
+    add_message("Int64List", [("value", F.TYPE_INT64, repeated, None)])
+
+    feature = add_message("Feature", [
+        ("bytes_list", F.TYPE_MESSAGE, optional, ".tensorflow.BytesList"),
+        ("float_list", F.TYPE_MESSAGE, optional, ".tensorflow.FloatList"),
+        ("int64_list", F.TYPE_MESSAGE, optional, ".tensorflow.Int64List")])
+    feature.oneof_decl.add(name="kind")
+    for field in feature.field:
+        field.oneof_index = 0
+
+    features = add_message("Features", [
+        ("feature", F.TYPE_MESSAGE, repeated,
+         ".tensorflow.Features.FeatureEntry")])
+    entry = add_message("FeatureEntry", [
+        ("key", F.TYPE_STRING, optional, None),
+        ("value", F.TYPE_MESSAGE, optional, ".tensorflow.Feature")],
+        parent=features)
+    entry.options.map_entry = True
+
+    add_message("Example", [
+        ("features", F.TYPE_MESSAGE, optional, ".tensorflow.Features")])
+
+    pool = descriptor_pool.DescriptorPool()
+    pool.Add(file_proto)
+    try:
+        from google.protobuf.message_factory import GetMessageClass
+    except ImportError:
+        # protobuf < 4.21
+        from google.protobuf.message_factory import MessageFactory
+        GetMessageClass = MessageFactory(pool).GetPrototype
+
+    return (GetMessageClass(pool.FindMessageTypeByName("tensorflow.Example")),
+            GetMessageClass(pool.FindMessageTypeByName("tensorflow.Feature")))
+
+
+Example, Feature = _build_example_classes()
+
+
+# CRC32C (Castagnoli), used to checksum TFRecord records
+def _make_crc32c_table():
+    table = []
+    for i in range(256):
+        crc = i
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0x82F63B78 if crc & 1 else crc >> 1
+        table.append(crc)
+    return table
+
+
+_CRC32C_TABLE = _make_crc32c_table()
+_CRC32C_ARRAY = np.array(_CRC32C_TABLE, dtype=np.uint32)
+# Inputs smaller than this are checksummed byte by byte in Python
+CRC32C_NUMPY_MIN_SIZE = 8192
+
+
+def _crc32c_python(data):
+    crc = 0xFFFFFFFF
+    table = _CRC32C_TABLE
+    for byte in data:
+        crc = table[(crc ^ byte) & 0xFF] ^ (crc >> 8)
+    return crc
+
+
+# Without the initial value and final xor, the CRC register is a linear
+# function over GF(2) of its previous value and of the input. The map of
+# feeding `2 ** k` zero bytes is stored as 4 tables of 256 values, one per
+# byte of the register.
+_CRC32C_ZEROS = []
+_CRC32C_ZEROS_LOCK = Lock()
+# Largest power of two of the number of zero bytes that can be fed
+_CRC32C_MAX_POWER = 48
+
+
+def _gf2_tables(columns):
+    """
+    Return the byte tables of the linear map with images of single bits
+    `columns`.
+    """
+    tables = []
+    for k in range(4):
+        table = np.zeros(1, dtype=np.uint32)
+        for column in columns[8 * k:8 * k + 8]:
+            table = np.concatenate([table, table ^ column])
+        tables.append(table)
+    return tables
+
+
+def _gf2_apply(tables, x):
+    return (tables[0][x & np.uint32(0xFF)]
+            ^ tables[1][(x >> np.uint32(8)) & np.uint32(0xFF)]
+            ^ tables[2][(x >> np.uint32(16)) & np.uint32(0xFF)]
+            ^ tables[3][x >> np.uint32(24)])
+
+
+def _crc32c_shift(crcs, num_bytes):
+    """
+    Return the CRC registers `crcs` (array of uint32) after feeding
+    `num_bytes` zero bytes.
+    """
+    with _CRC32C_ZEROS_LOCK:
+        if not _CRC32C_ZEROS:
+            bits = np.uint32(1) << np.arange(32, dtype=np.uint32)
+            # One zero byte, then square the map of the previous power of two
+            tables = _gf2_tables(_CRC32C_ARRAY[bits & np.uint32(0xFF)]
+                                 ^ (bits >> np.uint32(8)))
+            for _ in range(_CRC32C_MAX_POWER):
+                _CRC32C_ZEROS.append(tables)
+                tables = _gf2_tables(_gf2_apply(tables,
+                                                _gf2_apply(tables, bits)))
+    for tables in _CRC32C_ZEROS:
+        if num_bytes & 1:
+            crcs = _gf2_apply(tables, crcs)
+        num_bytes >>= 1
+        if not num_bytes:
+            break
+    return crcs
+
+
+def _crc32c_numpy(data, max_lanes=8192):
+    """Compute CRC32C of a large buffer with numpy. The data is split into
+    equal lanes, whose CRCs are computed together one byte column at a time,
+    then combined pairwise by shifting the CRC of the first lane of each pair
+    over the length of the second.
+    """
+    data = np.frombuffer(data, dtype=np.uint8)
+    # Lanes of at least 64 bytes, as a power of two
+    num_lanes = min(max_lanes, 1 << ((len(data) // 64).bit_length() - 1))
+    lane_size = -(-len(data) // num_lanes)
+    # Leading zero bytes do not change a CRC starting from 0
+    padded = np.zeros(num_lanes * lane_size, dtype=np.uint8)
+    padded[len(padded) - len(data):] = data
+    columns = np.ascontiguousarray(padded.reshape(num_lanes, lane_size).T)
+
+    crcs = np.zeros(num_lanes, dtype=np.uint32)
+    for column in columns:
+        crcs = _CRC32C_ARRAY[(crcs ^ column) & np.uint32(0xFF)] \
+            ^ (crcs >> np.uint32(8))
+
+    while len(crcs) > 1:
+        crcs = _crc32c_shift(crcs[0::2], lane_size) ^ crcs[1::2]
+        lane_size *= 2
+    # Contribution of the initial value 0xFFFFFFFF
+    init = _crc32c_shift(np.array([0xFFFFFFFF], dtype=np.uint32), len(data))
+    return int(crcs[0] ^ init[0])
+
+
+def crc32c(data):
+    if crc32c_imported:
+        return _crc32c(data)
+    if len(data) < CRC32C_NUMPY_MIN_SIZE:
+        crc = _crc32c_python(data)
+    else:
+        crc = _crc32c_numpy(data)
+    return crc ^ 0xFFFFFFFF
+
+
+def masked_crc32c(data):
+    crc = crc32c(data)
+    return (((crc >> 15) | (crc << 17)) + 0xA282EAD8) & 0xFFFFFFFF
+
+
+def encode_record(data):
+    """
+    Frame serialized bytes as a TFRecord record: length, masked CRC of
+    length, data and masked CRC of data.
+    """
+    length = struct.pack("<Q", len(data))
+    return b"".join([length, struct.pack("<I", masked_crc32c(length)),
+                     data, struct.pack("<I", masked_crc32c(data))])
+
+
+def _bytes_feature(values):
+    feature = Feature()
+    feature.bytes_list.value.extend(values)
+    return feature
+
+
+def _float_feature(values):
+    feature = Feature()
+    feature.float_list.value.extend(values)
+    return feature
+
+
+def _int64_feature(values):
+    feature = Feature()
+    feature.int64_list.value.extend(values)
+    return feature
+
+
+def create_tf_example(filename, encoded, width, height, labels, boxes,
+                      labelmap_dict, img_format=None):
+    """Create an Example with the same features as `generate_tfrecord.py`
+    of Tensorflow Object Detection API.
+
+    Parameters
+    ----------
+    filename : str
+    encoded : bytes
+        Encoded image, i.e. content of the image file.
+    width, height : int
+    labels : array-like
+        Label of each bounding box.
+    boxes : array-like
+        Array of shape (n, 4) containing `xmin, ymin, xmax, ymax` of each
+        bounding box, in pixels.
+    labelmap_dict : dict
+        A dictionary mapping labels with its index.
+    img_format : str
+        If None, inferred from the extension of `filename`.
+
+    """
+    if img_format is None:
+        img_format = os.path.splitext(filename)[1][1:].lower()
+        img_format = "jpeg" if img_format == "jpg" else img_format
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    filename = filename.encode("utf-8")
+
+    features = {
+        "image/height": _int64_feature([int(height)]),
+        "image/width": _int64_feature([int(width)]),
+        "image/filename": _bytes_feature([filename]),
+        "image/source_id": _bytes_feature([filename]),
+        "image/encoded": _bytes_feature([encoded]),
+        "image/format": _bytes_feature([img_format.encode("utf-8")]),
+        "image/object/bbox/xmin": _float_feature(boxes[:, 0] / width),
+        "image/object/bbox/xmax": _float_feature(boxes[:, 2] / width),
+        "image/object/bbox/ymin": _float_feature(boxes[:, 1] / height),
+        "image/object/bbox/ymax": _float_feature(boxes[:, 3] / height),
+        "image/object/class/text": _bytes_feature(
+            [str(label).encode("utf-8") for label in labels]),
+        "image/object/class/label": _int64_feature(
+            [labelmap_dict[label] for label in labels]),
+    }
+    example = Example()
+    for key, feature in features.items():
+        example.features.feature[key].CopyFrom(feature)
+    return example
+
+
+def create_record(filename, encoded, width, height, labels, boxes,
+                  labelmap_dict, img_format=None):
+    """
+    Same as `create_tf_example`, but return the Example serialized and
+    framed as a TFRecord record, ready to be written with `write_record`.
+    """
+    example = create_tf_example(filename, encoded, width, height, labels,
+                                boxes, labelmap_dict, img_format)
+    return encode_record(example.SerializeToString())
+
+
+def get_shard_paths(output_path, num_shards):
+    """
+    Return paths of shards following the naming convention of Tensorflow,
+    e.g. `train.record-00000-of-00010`. If `num_shards` is 1, return
+    `[output_path]`.
+    """
+    if num_shards == 1:
+        return [output_path]
+    return ["{}-{:05d}-of-{:05d}".format(output_path, i, num_shards)
+            for i in range(num_shards)]
+
+
+class TFRecordWriter():
+    """
+    Minimal replacement of `tf.io.TFRecordWriter`.
+    """
+    def __init__(self, path):
+        self.file = open(path, "wb")
+
+    def write(self, data):
+        """
+        Write serialized bytes, e.g. `example.SerializeToString()`.
+        """
+        self.file.write(encode_record(data))
+
+    def write_record(self, record):
+        """
+        Write bytes already framed by `encode_record` or `create_record`.
+        """
+        self.file.write(record)
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class ShardedTFRecordWriter():
+    """
+    Distribute records across `num_shards` files in a round-robin fashion.
+    Records are expected to be framed beforehand (see `create_record`), so
+    that the expensive part can be done by worker processes.
+    """
+    def __init__(self, output_path, num_shards=1):
+        self.paths = get_shard_paths(output_path, num_shards)
+        self.writers = [TFRecordWriter(path) for path in self.paths]
+        self.count = 0
+
+    def write_record(self, record):
+        self.writers[self.count % len(self.writers)].write_record(record)
+        self.count += 1
+
+    def close(self):
+        for writer in self.writers:
+            writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _write_shard(args):
+    """
+    Worker function used to write a single shard. Images are read as
+    encoded bytes; they are never decoded.
+    """
+    shard_path, images, labelmap_dict = args
+    with TFRecordWriter(shard_path) as writer:
+        for img_path, width, height, labels, boxes in images:
+            with open(img_path, "rb") as f:
+                encoded = f.read()
+            writer.write_record(create_record(
+                os.path.basename(img_path), encoded, width, height,
+                labels, boxes, labelmap_dict))
+    return len(images)
+
+
+def df_to_tfrecords(df, img_dir, output_path, labelmap_dict,
+                    num_shards=1, num_workers=None):
+    """Write images in `img_dir` and their bounding boxes in `df` to TFRecord
+    shards. Each shard is written by its own worker process.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Dataframe with columns `filename, width, height, class, xmin, ymin,
+        xmax, ymax`.
+    img_dir : str
+    output_path : str
+        See `get_shard_paths`.
+    labelmap_dict : dict
+        A dictionary mapping labels with its index.
+    num_shards : int
+    num_workers : int
+        Number of processes. If None, use all CPUs.
+
+    Returns
+    -------
+    generator
+        Yields number of images written by each finished shard.
+
+    """
+    order, filenames, starts, ends = get_filename_index(df)
+    widths = df["width"].to_numpy()[order][starts]
+    heights = df["height"].to_numpy()[order][starts]
+    labels = df["class"].to_numpy()[order]
+    boxes = df.loc[:, BBOX_COLS].to_numpy()[order]
+
+    shard_paths = get_shard_paths(output_path, num_shards)
+    tasks = [(path, [], labelmap_dict) for path in shard_paths]
+    for i, filename in enumerate(filenames):
+        start, end = starts[i], ends[i]
+        tasks[i % num_shards][1].append(
+            (os.path.join(img_dir, filename), widths[i], heights[i],
+             labels[start:end], boxes[start:end]))
+
+    with Pool(min(num_workers or os.cpu_count(), num_shards)) as pool:
+        for num_written in pool.imap_unordered(_write_shard, tasks):
+            yield num_written
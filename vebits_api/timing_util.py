@@ -0,0 +1,390 @@
+"""Lightweight timing of processing stages (decode, preprocess, inference,
+postprocess, draw, write, ...). Durations are aggregated into fixed-bucket
+histograms per stage, exportable as JSON or Prometheus text format. Timing is
+disabled by default, in which case stages cost a single attribute lookup.
+
+Examples
+--------
+>>> from vebits_api import timing_util
+>>> timing_util.enable()
+>>> with timing_util.stage("decode"):
+...     frame = cv2.imread(img_path)
+>>> print(timing_util.format_report())
+
+"""
+
+import os
+import json
+import time
+import bisect
+import functools
+import threading
+
+# Upper bounds of histogram buckets, in seconds. Fixed, so that histograms
+# of different runs or processes can be merged.
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+           0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram():
+    """Histogram of durations. `counts[i]` is the number of durations in
+    `(buckets[i - 1], buckets[i]]`, and the last count is the number of
+    durations above all bounds.
+    """
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = float("inf")
+        self.max = 0.0
+
+    def add(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        if other.buckets != self.buckets:
+            raise ValueError("Histograms with different buckets cannot be "
+                             "merged.")
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    @property
+    def mean(self):
+        return self.sum / self.count if self.count else 0.0
+
+    def quantile(self, q):
+        """
+        Estimate the `q`-quantile by linear interpolation within buckets,
+        clipped to the observed min and max.
+        """
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        cumulative = 0
+        for i, count in enumerate(self.counts):
+            if count > 0 and cumulative + count >= rank:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.max
+                value = lower + (upper - lower) * (rank - cumulative) / count
+                return min(max(value, self.min), self.max)
+            cumulative += count
+        return self.max
+
+    def to_dict(self):
+        return {"count": self.count, "sum": self.sum,
+                "mean": self.mean,
+                "min": self.min if self.count else 0.0, "max": self.max,
+                "p50": self.quantile(0.5), "p90": self.quantile(0.9),
+                "p99": self.quantile(0.99),
+                "buckets": list(self.buckets), "counts": list(self.counts)}
+
+    @classmethod
+    def from_dict(cls, d):
+        hist = cls(d["buckets"])
+        hist.counts = list(d["counts"])
+        hist.count = d["count"]
+        hist.sum = d["sum"]
+        hist.min = d["min"] if d["count"] else float("inf")
+        hist.max = d["max"]
+        return hist
+
+
+class _NullSpan():
+    """Span returned when timing is disabled. Does nothing."""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_SPAN = _NullSpan()
+
+
+class _Span():
+    __slots__ = ("timer", "name", "start")
+
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.timer.record(self.name, self.start, time.perf_counter())
+        return False
+
+
+class StageTimer():
+    """Aggregate durations of named stages into histograms.
+
+    Parameters
+    ----------
+    enabled : bool
+        If False, `stage` and `timed` do not measure anything.
+    buckets : tuple of float
+        Upper bounds of histogram buckets, in seconds.
+
+    """
+    def __init__(self, enabled=False, buckets=BUCKETS):
+        self.enabled = enabled
+        self.buckets = tuple(buckets)
+        self.histograms = {}
+        self.hooks = []
+        self._lock = threading.Lock()
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        with self._lock:
+            self.histograms = {}
+
+    def stage(self, name):
+        """
+        Return a context manager timing the code it wraps as stage `name`.
+        """
+        if not self.enabled:
+            return NULL_SPAN
+        return _Span(self, name)
+
+    def timed(self, name=None):
+        """
+        Decorator timing each call of the decorated function as stage `name`
+        (the qualified name of the function by default).
+        """
+        def wrapper(function):
+            stage_name = function.__qualname__ if name is None else name
+
+            @functools.wraps(function)
+            def timed_function(*args, **kwargs):
+                if not self.enabled:
+                    return function(*args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    self.record(stage_name, start, time.perf_counter())
+            return timed_function
+        return wrapper
+
+    def record(self, name, start, end):
+        """
+        Record a span of stage `name` between `start` and `end`, measured by
+        `time.perf_counter`, and call hooks with these arguments.
+        """
+        with self._lock:
+            hist = self.histograms.get(name)
+            if hist is None:
+                hist = self.histograms[name] = Histogram(self.buckets)
+            hist.add(end - start)
+        for hook in self.hooks:
+            hook(name, start, end)
+
+    def add_hook(self, hook):
+        """
+        Add a function called with `(name, start, end)` after each span is
+        recorded, e.g. to trace spans. Hooks are called from the thread
+        which recorded the span.
+        """
+        self.hooks.append(hook)
+
+    def remove_hook(self, hook):
+        self.hooks.remove(hook)
+
+    def merge(self, other):
+        """
+        Add histograms of another `StageTimer` (or of a dictionary returned
+        by `summary`, e.g. sent by another process).
+        """
+        if isinstance(other, StageTimer):
+            histograms = other.histograms
+        else:
+            histograms = {name: Histogram.from_dict(d)
+                          for name, d in other.items()}
+        with self._lock:
+            for name, hist in histograms.items():
+                if name not in self.histograms:
+                    self.histograms[name] = Histogram(self.buckets)
+                self.histograms[name].merge(hist)
+
+    def summary(self):
+        with self._lock:
+            return {name: hist.to_dict()
+                    for name, hist in sorted(self.histograms.items())}
+
+    def format_report(self):
+        lines = ["{:<24} {:>8} {:>10} {:>10} {:>10} {:>10} {:>10}".format(
+            "stage", "count", "total(s)", "mean(ms)", "p50(ms)", "p90(ms)",
+            "p99(ms)")]
+        for name, d in self.summary().items():
+            lines.append(
+                "{:<24} {:>8} {:>10.3f} {:>10.3f} {:>10.3f} {:>10.3f} "
+                "{:>10.3f}".format(name, d["count"], d["sum"],
+                                   d["mean"] * 1e3, d["p50"] * 1e3,
+                                   d["p90"] * 1e3, d["p99"] * 1e3))
+        return "\n".join(lines)
+
+    def to_json(self, path=None, **extra):
+        """
+        Return histograms as a JSON string, and write it to `path` if not
+        None. `extra` items are added at the top level.
+        """
+        data = dict(extra, stages=self.summary())
+        text = json.dumps(data, indent=2)
+        if path is not None:
+            with open(path, "w") as f:
+                f.write(text)
+        return text
+
+    def to_prometheus(self, path=None, metric="vebits_stage_duration_seconds"):
+        """
+        Return histograms in Prometheus text exposition format, and write it
+        to `path` (e.g. a file read by the node exporter textfile collector)
+        if not None.
+        """
+        lines = ["# HELP {} Duration of processing stages.".format(metric),
+                 "# TYPE {} histogram".format(metric)]
+        for name, d in self.summary().items():
+            label = 'stage="{}"'.format(
+                name.replace("\\", "\\\\").replace('"', '\\"'))
+            cumulative = 0
+            for bound, count in zip(d["buckets"], d["counts"]):
+                cumulative += count
+                lines.append('{}_bucket{{{},le="{}"}} {}'.format(
+                    metric, label, repr(float(bound)), cumulative))
+            lines.append('{}_bucket{{{},le="+Inf"}} {}'.format(
+                metric, label, d["count"]))
+            lines.append("{}_sum{{{}}} {}".format(metric, label,
+                                                  repr(d["sum"])))
+            lines.append("{}_count{{{}}} {}".format(metric, label,
+                                                    d["count"]))
+        text = "\n".join(lines) + "\n"
+        if path is not None:
+            with open(path, "w") as f:
+                f.write(text)
+        return text
+
+    def write(self, path):
+        """
+        Write histograms to `path`, in Prometheus text format if its
+        extension is `.prom` or `.txt`, and as JSON otherwise.
+        """
+        if path.endswith((".prom", ".txt")):
+            self.to_prometheus(path)
+        else:
+            self.to_json(path)
+
+
+class ChromeTracer():
+    """Hook of `StageTimer` recording spans as Chrome trace events, which can
+    be viewed in chrome://tracing or https://ui.perfetto.dev.
+
+    Parameters
+    ----------
+    max_events : int
+        Maximum number of events kept. Later spans are counted but dropped,
+        so that long runs do not exhaust memory.
+
+    Examples
+    --------
+    >>> tracer = ChromeTracer()
+    >>> timing_util.TIMER.add_hook(tracer)
+    >>> ...
+    >>> tracer.write("trace.json")
+
+    """
+    def __init__(self, max_events=1000000):
+        self.max_events = max_events
+        self.events = []
+        self.num_dropped = 0
+        self.pid = os.getpid()
+        self.origin = time.perf_counter()
+
+    def __call__(self, name, start, end):
+        if len(self.events) >= self.max_events:
+            self.num_dropped += 1
+            return
+        # list.append is atomic, so spans may be recorded from any thread
+        self.events.append({"name": name, "ph": "X", "pid": self.pid,
+                            "tid": threading.get_ident(),
+                            "ts": (start - self.origin) * 1e6,
+                            "dur": (end - start) * 1e6})
+
+    def write(self, path):
+        # Name threads, so that they can be told apart in the viewer
+        names = {thread.ident: thread.name
+                 for thread in threading.enumerate()}
+        metadata = [{"name": "thread_name", "ph": "M", "pid": self.pid,
+                     "tid": tid, "args": {"name": names.get(tid, str(tid))}}
+                    for tid in set(event["tid"] for event in self.events)]
+        with open(path, "w") as f:
+            json.dump({"traceEvents": metadata + self.events,
+                       "displayTimeUnit": "ms"}, f)
+
+
+# Timer used by vebits_api and scripts
+TIMER = StageTimer()
+
+
+def enable():
+    TIMER.enable()
+
+
+def disable():
+    TIMER.disable()
+
+
+def is_enabled():
+    return TIMER.enabled
+
+
+def stage(name):
+    """
+    Return a context manager timing the code it wraps as stage `name` with
+    the default timer.
+    """
+    if not TIMER.enabled:
+        return NULL_SPAN
+    return _Span(TIMER, name)
+
+
+def timed(name=None):
+    """
+    Decorator timing each call of the decorated function with the default
+    timer.
+    """
+    return TIMER.timed(name)
+
+
+def reset():
+    TIMER.reset()
+
+
+def summary():
+    return TIMER.summary()
+
+
+def format_report():
+    return TIMER.format_report()
+
+
+def write(path):
+    TIMER.write(path)
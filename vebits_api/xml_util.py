@@ -1,8 +1,31 @@
 import xml.etree.ElementTree as ET
 import os
+from multiprocessing import Pool
+
+from .job_util import atomic_write
 
 def create_xml_file(img_path, img_width, img_height, bbox_list, xml_path=None):
+    labels = [bbox.get_label() for bbox in bbox_list]
+    boxes = [(bbox.get_xmin(), bbox.get_ymin(),
+              bbox.get_xmax(), bbox.get_ymax()) for bbox in bbox_list]
+    create_xml_file_from_arrays(img_path, img_width, img_height,
+                                labels, boxes, xml_path)
+
+
+def create_xml_file_from_arrays(img_path, img_width, img_height,
+                                labels, boxes, xml_path=None):
+    """Same as `create_xml_file`, but takes labels and bounding boxes as
+    columnar arrays instead of a list of BBox objects.
 
+    Parameters
+    ----------
+    labels : array-like
+        Array of shape (n,) containing label of each bounding box.
+    boxes : array-like
+        Array of shape (n, 4) containing `xmin, ymin, xmax, ymax` of each
+        bounding box.
+
+    """
     # create the file structure
     annotate = ET.Element('annotation')
     folder = ET.SubElement(annotate, 'folder')
@@ -28,7 +51,7 @@ def create_xml_file(img_path, img_width, img_height, bbox_list, xml_path=None):
     segmented.text = '0'
 
     # Values in object are dynamic
-    for bbox in bbox_list:
+    for label, box in zip(labels, boxes):
         obj = ET.SubElement(annotate, 'object')
         name = ET.SubElement(obj, 'name')
         pose = ET.SubElement(obj, 'pose')
@@ -40,23 +63,131 @@ def create_xml_file(img_path, img_width, img_height, bbox_list, xml_path=None):
         xmax = ET.SubElement(bndbox, 'xmax')
         ymax = ET.SubElement(bndbox, 'ymax')
 
-        name.text = str(bbox.get_label())
+        name.text = str(label)
         pose.text = 'Unspecified'
         truncated.text = '0'
         difficult.text = '0'
 
-        xmin.text = str(bbox.get_xmin())
-        ymin.text = str(bbox.get_ymin())
-        xmax.text = str(bbox.get_xmax())
-        ymax.text = str(bbox.get_ymax())
+        xmin.text = str(box[0])
+        ymin.text = str(box[1])
+        xmax.text = str(box[2])
+        ymax.text = str(box[3])
 
     # create a new XML file with the results
     mydata = ET.tostring(annotate, encoding="unicode")
 
     if xml_path is None:
         xml_path = os.path.splitext(img_path)[0] + ".xml"
-    with open(xml_path, "w") as myfile:
-        myfile.write(mydata)
+    atomic_write(xml_path, mydata)
+
+
+def _create_xml_files(args):
+    """
+    Worker function used to write a chunk of *.xml files. Each element of
+    `args` is a tuple of arguments to `create_xml_file_from_arrays`.
+    """
+    for xml_args in args:
+        create_xml_file_from_arrays(*xml_args)
+    return len(args)
+
+
+def _count_written(results, callback=None):
+    """
+    Consume numbers of xml files written by each chunk, calling `callback`
+    with each of them, and return the total.
+    """
+    num_written = 0
+    for num in results:
+        num_written += num
+        if callback is not None:
+            callback(num)
+    return num_written
+
+
+def create_xml_files(img_names, widths, heights, labels, boxes, starts, ends,
+                     img_dir, dest_dir=None, num_workers=None, chunk_size=256,
+                     callback=None):
+    """Write *.xml files of PASCAL VOC format for many images in parallel,
+    given columnar annotations where bounding boxes of the same image are
+    stored contiguously.
+
+    Parameters
+    ----------
+    img_names, widths, heights : array-like
+        Arrays of shape (n_images,).
+    labels, boxes : array-like
+        Arrays of shape (n_boxes,) and (n_boxes, 4), respectively. Bounding
+        boxes of `img_names[i]` are `boxes[starts[i]:ends[i]]`.
+    starts, ends : array-like
+        Arrays of shape (n_images,).
+    img_dir : str
+        Directory to images, used to fill in the `path` field.
+    dest_dir : str
+        Directory to which all xml files will be saved. If None, `img_dir`
+        will be used.
+    num_workers : int
+        Number of processes to write files. If None, use all CPUs. If 1,
+        files will be written in the calling process.
+    chunk_size : int
+        Number of xml files written per task.
+    callback : callable
+        If specified, called with the number of xml files written by each
+        finished chunk, e.g. `tqdm.update` to track progress.
+
+    Returns
+    -------
+    int
+        Number of xml files written.
+
+    """
+    if dest_dir is None:
+        dest_dir = img_dir
+
+    tasks = []
+    for i in range(0, len(img_names), chunk_size):
+        chunk = []
+        for j in range(i, min(i + chunk_size, len(img_names))):
+            img_name = img_names[j]
+            xml_name = os.path.splitext(img_name)[0] + ".xml"
+            start, end = starts[j], ends[j]
+            chunk.append((os.path.join(img_dir, img_name),
+                          widths[j], heights[j],
+                          labels[start:end], boxes[start:end],
+                          os.path.join(dest_dir, xml_name)))
+        tasks.append(chunk)
+
+    if num_workers == 1:
+        return _count_written(map(_create_xml_files, tasks), callback)
+    with Pool(num_workers) as pool:
+        return _count_written(pool.imap_unordered(_create_xml_files, tasks),
+                              callback)
+
+
+def read_xml_file(xml_path):
+    """Read a *.xml file of PASCAL VOC format.
+
+    Returns
+    -------
+    filename : str
+    width, height : int
+    labels : list
+        Label of each bounding box.
+    boxes : list
+        `(xmin, ymin, xmax, ymax)` of each bounding box.
+
+    """
+    root = ET.parse(xml_path).getroot()
+    size = root.find("size")
+    width = int(float(size.find("width").text))
+    height = int(float(size.find("height").text))
+
+    labels, boxes = [], []
+    for obj in root.findall("object"):
+        bndbox = obj.find("bndbox")
+        labels.append(obj.find("name").text)
+        boxes.append(tuple(int(float(bndbox.find(tag).text))
+                           for tag in ["xmin", "ymin", "xmax", "ymax"]))
+    return root.find("filename").text, width, height, labels, boxes
 
 
 def change_label(xml_root, label_src, label_dest):